@@ -0,0 +1,4 @@
+# -------------------------
+# Стенд для замеров: фейковый Selectel, генератор сценариев, прогон main.main() по фазам
+# -------------------------
+# python3 -m bench.run --servers 50 --extra-dirs 20
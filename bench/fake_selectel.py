@@ -0,0 +1,233 @@
+import argparse
+import hashlib
+import json
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from bench.scenario import load_manifest
+
+# -------------------------
+# Фейковый Selectel: identity, список LE и certificate-manager на http.server
+# -------------------------
+# base_url/identity/v3/auth/tokens      POST -> 201, X-Subject-Token
+# base_url/le/                          GET  -> {"items": [...]}, ETag / 304
+# base_url/cm/cert/<id>                 GET  -> {"pem": {"certificates": [leaf, ca]}}
+# base_url/cm/cert/<id>/ca_chain        GET  -> {"pem": {"certificates": [ca]}}
+# base_url/cm/cert/<id>/private_key     GET  -> {"private_key": "..."}
+# Без верного X-Auth-Token — 401. Задержка и доля ошибок (503) настраиваются.
+# projects > 1 — сертификаты по кругу раскладываются по проектам p0, p1, ...: у каждого свой
+# токен (по scope.project.name) и свой список, чужой сертификат — 404.
+
+
+class FakeSelectel:
+    def __init__(
+        self,
+        manifest: dict,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        projects: int = 1,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.projects = project_names(projects)
+        # проект -> токен, токен -> проект
+        self.tokens = {p: secrets.token_hex(16) for p in self.projects}
+        self.token_project = {t: p for p, t in self.tokens.items()}
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counters: Counter = Counter()
+
+        with open(manifest["ca"], "r", encoding="utf-8") as f:
+            ca = f.read()
+        self.certs: Dict[str, Tuple[str, str, str]] = {}
+        self.cert_project: Dict[str, str] = {}
+        items: Dict[str, list] = {p: [] for p in self.projects}
+        for i, c in enumerate(manifest["certs"]):
+            with open(c["cert"], "r", encoding="utf-8") as f:
+                leaf = f.read()
+            with open(c["key"], "r", encoding="utf-8") as f:
+                key = f.read()
+            project = self.projects[i % len(self.projects)]
+            self.certs[c["id"]] = (leaf, ca, key)
+            self.cert_project[c["id"]] = project
+            items[project].append(
+                {"id": c["id"], "knox_cert_id": c["id"], "domains": c["domains"], "expire_at": c["expire_at"]}
+            )
+        # проект -> (тело списка, ETag)
+        self.le: Dict[str, Tuple[bytes, str]] = {}
+        for project, its in items.items():
+            body = json.dumps({"items": its}).encode("utf-8")
+            self.le[project] = (body, '"' + hashlib.sha256(body).hexdigest()[:16] + '"')
+
+        self.httpd = ThreadingHTTPServer((host, port), _handler(self))
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeSelectel":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-selectel", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    @property
+    def token(self) -> str:
+        return self.tokens[self.projects[0]]
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self._counters.clear()
+
+    def delay_and_fail(self) -> bool:
+        """
+        Задержка перед ответом; True — этот запрос должен получить 503.
+        """
+        with self._lock:
+            delay = self.latency + (self._rnd.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = self.error_rate > 0 and self._rnd.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return fail
+
+
+def project_names(n: int) -> List[str]:
+    # один проект — "bench", как SELECTEL_PROJECT_NAME в bench.env
+    return ["bench"] if n <= 1 else [f"p{i}" for i in range(n)]
+
+
+def _handler(fake: FakeSelectel):
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, как у настоящего API: пул соединений клиента должен переиспользовать сокеты
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send(self, code: int, obj: object = None, headers: Optional[Dict[str, str]] = None, body: Optional[bytes] = None):
+            if body is None:
+                body = json.dumps(obj).encode("utf-8") if obj is not None else b""
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _error(self, kind: str) -> None:
+            fake.count("errors")
+            fake.count(kind + "_error")
+            self._send(503, {"error": "injected"})
+
+        def do_POST(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(n) if n else b""
+            fake.count("requests")
+            if self.path.rstrip("/") != "/identity/v3/auth/tokens":
+                return self._send(404, {"error": "not found"})
+            fake.count("auth")
+            if fake.delay_and_fail():
+                return self._error("auth")
+            try:
+                project = json.loads(body)["auth"]["scope"]["project"]["name"]
+            except (ValueError, KeyError, TypeError):
+                project = None
+            if project not in fake.tokens:
+                return self._send(401, {"error": "unknown project"})
+            exp = (datetime.now(timezone.utc) + timedelta(hours=24)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            self._send(201, {"token": {"expires_at": exp}}, {"X-Subject-Token": fake.tokens[project]})
+
+        def do_GET(self):
+            fake.count("requests")
+            path = self.path.split("?", 1)[0]
+            project = fake.token_project.get(self.headers.get("X-Auth-Token") or "")
+            if project is None:
+                fake.count("unauthorized")
+                return self._send(401, {"error": "invalid token"})
+
+            if path.rstrip("/") == "/le":
+                fake.count("le_list")
+                if fake.delay_and_fail():
+                    return self._error("le_list")
+                le_body, le_etag = fake.le[project]
+                if self.headers.get("If-None-Match") == le_etag:
+                    fake.count("le_list_304")
+                    return self._send(304, headers={"ETag": le_etag})
+                return self._send(200, headers={"ETag": le_etag}, body=le_body)
+
+            parts = path.strip("/").split("/")
+            if len(parts) in (3, 4) and parts[:2] == ["cm", "cert"] and fake.cert_project.get(parts[2]) == project:
+                leaf, ca, key = fake.certs[parts[2]]
+                kind = parts[3] if len(parts) == 4 else "cert"
+                if kind not in ("cert", "ca_chain", "private_key"):
+                    return self._send(404, {"error": "not found"})
+                fake.count(kind)
+                if fake.delay_and_fail():
+                    return self._error(kind)
+                if kind == "cert":
+                    return self._send(200, {"pem": {"certificates": [leaf, ca]}})
+                if kind == "ca_chain":
+                    return self._send(200, {"pem": {"certificates": [ca]}})
+                return self._send(200, {"private_key": key})
+
+            self._send(404, {"error": "not found"})
+
+    return Handler
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Фейковый Selectel API для сценария bench")
+    parser.add_argument("root", help="Папка сценария (python3 -m bench.scenario)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Задержка каждого ответа")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Плюс случайная задержка до N мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 503 (0..1)")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--projects", type=int, default=1, help="На сколько проектов разложить сертификаты")
+    args = parser.parse_args(argv)
+
+    fake = FakeSelectel(
+        load_manifest(args.root), args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate,
+        seed=args.seed, host=args.host, port=args.port, projects=args.projects,
+    )
+    print(f"Фейковый Selectel на {fake.base_url} (Ctrl+C — выход)", flush=True)
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.httpd.server_close()
+        print(json.dumps(fake.counters(), sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+from bench.fake_selectel import FakeSelectel
+from bench.scenario import generate_scenario, install_local_pairs, load_manifest, state_dir, write_env
+
+# -------------------------
+# Прогон main.main() против фейкового Selectel по фазам с замерами
+# -------------------------
+# cold    — старые локальные пары, пустое хранилище и .state: полный цикл с обновлением всего
+# warm    — сразу следом: всё актуально, работают все кэши (токен, 304 на список, nginx -T, снимки)
+# nostate — как warm, но без .state: всё то же, только кэши собираются заново
+
+PHASES = ("cold", "warm", "nostate")
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def prepare_phase(phase: str, manifest: dict) -> None:
+    if phase == "cold":
+        install_local_pairs(manifest, wipe_store=True)
+    elif phase == "nostate":
+        shutil.rmtree(state_dir(manifest), ignore_errors=True)
+
+def run_phase(phase: str, manifest: dict, fake: FakeSelectel, env_path: str, log_dir: str, n: int) -> dict:
+    prepare_phase(phase, manifest)
+    fake.reset_counters()
+
+    out_path = os.path.join(log_dir, f"{phase}-{n}.json")
+    log_path = os.path.join(log_dir, f"{phase}-{n}.log")
+    with open(log_path, "w", encoding="utf-8") as log:
+        p = subprocess.run(
+            [sys.executable, "-m", "bench.worker", env_path, out_path],
+            cwd=REPO_DIR, stdout=log, stderr=subprocess.STDOUT,
+        )
+    if p.returncode != 0 or not os.path.exists(out_path):
+        raise RuntimeError(f"Фаза {phase}: worker упал (rc={p.returncode}), лог: {log_path}")
+    with open(out_path, "r", encoding="utf-8") as f:
+        res = json.load(f)
+
+    res["phase"] = phase
+    res["http"] = fake.counters()
+    res["log"] = log_path
+    return res
+
+
+def _summary(samples: List[dict]) -> dict:
+    # время — медиана по повторам, счётчики — из последнего прогона (они детерминированы)
+    last = samples[-1]
+    return {
+        "phase": last["phase"],
+        "rc": last["rc"],
+        "wall_s": statistics.median(s["wall_s"] for s in samples),
+        "wall_min_s": min(s["wall_s"] for s in samples),
+        "http_calls": last["http"].get("requests", 0),
+        "http": last["http"],
+        "subprocesses": last["subprocesses"],
+        "subprocesses_by_cmd": last["subprocesses_by_cmd"],
+        "peak_rss_mb": max(s["peak_rss_kb"] for s in samples) / 1024,
+        "cpu_s": statistics.median(s["cpu_s"] for s in samples),
+        "samples": len(samples),
+    }
+
+def print_table(rows: List[dict]) -> None:
+    head = ("фаза", "rc", "wall, с", "cpu, с", "HTTP", "auth", "список", "cert+key", "503", "процессов", "RSS, МБ")
+    lines = [head]
+    for r in rows:
+        h = r["http"]
+        lines.append((
+            r["phase"],
+            str(r["rc"]),
+            f"{r['wall_s']:.3f}",
+            f"{r['cpu_s']:.3f}",
+            str(r["http_calls"]),
+            str(h.get("auth", 0)),
+            f"{h.get('le_list', 0)} ({h.get('le_list_304', 0)}×304)",
+            str(h.get("cert", 0) + h.get("ca_chain", 0) + h.get("private_key", 0)),
+            str(h.get("errors", 0)),
+            str(r["subprocesses"]),
+            f"{r['peak_rss_mb']:.1f}",
+        ))
+    widths = [max(len(line[i]) for line in lines) for i in range(len(head))]
+    for i, line in enumerate(lines):
+        print("  ".join(col.rjust(w) if j else col.ljust(w) for j, (col, w) in enumerate(zip(line, widths))))
+        if i == 0:
+            print("  ".join("-" * w for w in widths))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Замеры main.py против фейкового Selectel")
+    parser.add_argument("--root", help="Папка сценария (есть manifest — берём как есть, нет — генерируем); "
+                                       "по умолчанию временная")
+    parser.add_argument("--keep", action="store_true", help="Не удалять временную папку сценария")
+    parser.add_argument("--servers", type=int, default=50, help="Сколько server-блоков nginx")
+    parser.add_argument("--extra-dirs", type=int, default=20, help="Сколько папок в EXTRA_CERT_DIRS")
+    parser.add_argument("--domains", type=int, default=10, help="Сколько разных wildcard-сертификатов")
+    parser.add_argument("--phases", default=",".join(PHASES), help=f"Через запятую из {', '.join(PHASES)}")
+    parser.add_argument("--repeat", type=int, default=1, help="Сколько раз прогонять каждую фазу")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Задержка ответа фейкового API")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Плюс случайная задержка до N мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 503 (0..1)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--projects", type=int, default=1, help="На сколько проектов Selectel разложить сертификаты")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Переопределить переменную .env (можно несколько раз), напр. FETCH_CONCURRENCY=1")
+    parser.add_argument("--json", metavar="FILE", help="Сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    phases = [p.strip() for p in args.phases.split(",") if p.strip()]
+    bad = [p for p in phases if p not in PHASES]
+    if bad:
+        parser.error(f"неизвестные фазы: {', '.join(bad)}")
+    overrides: Dict[str, str] = {}
+    for item in args.set:
+        if "=" not in item:
+            parser.error(f"--set ждёт KEY=VALUE: {item}")
+        k, v = item.split("=", 1)
+        overrides[k.strip()] = v.strip()
+
+    tmp = None
+    root = args.root
+    if not root:
+        tmp = root = tempfile.mkdtemp(prefix="ssl-bench-")
+    try:
+        if os.path.exists(os.path.join(root, "pki", "manifest.json")):
+            manifest = load_manifest(root)
+        else:
+            print(f"Генерирую сценарий в {root}: server-блоков {args.servers}, extra-папок {args.extra_dirs}, "
+                  f"сертификатов {args.domains}...", flush=True)
+            manifest = generate_scenario(root, args.servers, args.extra_dirs, args.domains)
+
+        fake = FakeSelectel(
+            manifest, args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate,
+            seed=args.seed, projects=args.projects,
+        )
+        fake.start()
+        try:
+            env_path = os.path.join(manifest["root"], "bench.env")
+            write_env(manifest, fake.base_url, env_path, overrides, projects=fake.projects)
+            log_dir = os.path.join(manifest["root"], "logs")
+            os.makedirs(log_dir, exist_ok=True)
+
+            rows = []
+            for phase in phases:
+                samples = [run_phase(phase, manifest, fake, env_path, log_dir, n) for n in range(max(1, args.repeat))]
+                rows.append(_summary(samples))
+        finally:
+            fake.stop()
+
+        print(f"Пар: {len(manifest['pairs'])} (nginx {manifest['servers']}, extra {manifest['extra_dirs']}), "
+              f"сертификатов в Selectel: {len(manifest['certs'])}, проектов {len(fake.projects)}, "
+              f"задержка API {args.latency_ms:g} мс")
+        print_table(rows)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                scenario = {
+                    "servers": manifest["servers"],
+                    "extra_dirs": manifest["extra_dirs"],
+                    "certs": len(manifest["certs"]),
+                    "projects": len(fake.projects),
+                    "latency_ms": args.latency_ms,
+                    "error_rate": args.error_rate,
+                    "env": overrides,
+                }
+                json.dump({"scenario": scenario, "phases": rows}, f, ensure_ascii=False, indent=2)
+        return 0 if all(r["rc"] == 0 for r in rows) else 1
+    finally:
+        if tmp and not args.keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# -------------------------
+# Генератор сценария: своя PKI, N server-блоков nginx, M папок EXTRA_CERT_DIRS
+# -------------------------
+# root/
+#   pki/ca.pem, pki/<домен>/{local,remote}.pem, key.pem   — цепочки (openssl CLI, EC P-256)
+#   pki/manifest.json                                       — что отдаёт фейковый Selectel
+#   nginx/nginx.conf, nginx/conf.d/siteNNNN.conf            — конфиг для фейкового nginx -T
+#   nginx/tls/siteNNNN/, extra/svcNNNN/                     — локальные пары (ставит install_local_pairs)
+#   bin/nginx, bin/systemctl                                — заглушки вместо настоящих бинарей
+#   store/                                                  — CERT_STORE_DIR
+
+MANIFEST = "manifest.json"
+
+# локальные сертификаты почти истекли, в Selectel — свежие: холодный прогон обновляет всё
+LOCAL_DAYS = 10
+REMOTE_DAYS = 90
+
+
+def _openssl(*args: str) -> str:
+    p = subprocess.run(["openssl", *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if p.returncode != 0:
+        raise RuntimeError(f"openssl {' '.join(args)}: {p.stderr.strip()[:500]}")
+    return p.stdout
+
+def _not_after(cert_path: str) -> str:
+    # "notAfter=Jan  1 00:00:00 2030 GMT" -> формат expire_at из LE списка Selectel
+    out = _openssl("x509", "-enddate", "-noout", "-in", cert_path).strip().split("=", 1)[1]
+    return datetime.strptime(" ".join(out.split()), "%b %d %H:%M:%S %Y %Z").strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _issue_leaf(pki: str, domain: str, key: str, out: str, days: int) -> None:
+    csr = out + ".csr"
+    ext = out + ".ext"
+    with open(ext, "w", encoding="utf-8") as f:
+        f.write(f"subjectAltName=DNS:*.{domain},DNS:{domain}\n")
+    _openssl("req", "-new", "-key", key, "-subj", f"/CN=*.{domain}", "-out", csr)
+    _openssl(
+        "x509", "-req", "-in", csr, "-CA", os.path.join(pki, "ca.pem"), "-CAkey", os.path.join(pki, "ca.key"),
+        "-CAcreateserial", "-days", str(days), "-extfile", ext, "-out", out,
+    )
+    os.unlink(csr)
+    os.unlink(ext)
+
+def _write_exec(path: str, text: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def generate_scenario(root: str, servers: int, extra_dirs: int, domains: int) -> dict:
+    """
+    Создаёт сценарий в root (папка должна быть пустой или отсутствовать).
+    Домены d0000.bench.test ...; server-блоки и extra-папки раскладываются по ним по кругу.
+
+    Возвращает манифест (он же лежит в pki/manifest.json).
+    """
+    root = os.path.abspath(root)
+    if os.path.exists(root) and os.listdir(root):
+        raise RuntimeError(f"Папка сценария не пустая: {root}")
+    domains = max(1, domains)
+    pki = os.path.join(root, "pki")
+    os.makedirs(pki, exist_ok=True)
+
+    _openssl("ecparam", "-name", "prime256v1", "-genkey", "-noout", "-out", os.path.join(pki, "ca.key"))
+    _openssl(
+        "req", "-x509", "-new", "-key", os.path.join(pki, "ca.key"), "-subj", "/CN=bench test CA",
+        "-days", "3650", "-out", os.path.join(pki, "ca.pem"),
+    )
+
+    certs = []
+    for i in range(domains):
+        domain = f"d{i:04d}.bench.test"
+        d = os.path.join(pki, domain)
+        os.makedirs(d)
+        key = os.path.join(d, "key.pem")
+        _openssl("ecparam", "-name", "prime256v1", "-genkey", "-noout", "-out", key)
+        _issue_leaf(pki, domain, key, os.path.join(d, "local.pem"), LOCAL_DAYS)
+        _issue_leaf(pki, domain, key, os.path.join(d, "remote.pem"), REMOTE_DAYS)
+        certs.append({
+            "id": f"bench-{i:04d}",
+            "domain": domain,
+            "domains": [f"*.{domain}", domain],
+            "cert": os.path.join(d, "remote.pem"),
+            "local_cert": os.path.join(d, "local.pem"),
+            "key": key,
+            "expire_at": _not_after(os.path.join(d, "remote.pem")),
+        })
+
+    pairs = []
+    conf_d = os.path.join(root, "nginx", "conf.d")
+    os.makedirs(conf_d)
+    for i in range(servers):
+        c = certs[i % domains]
+        tls = os.path.join(root, "nginx", "tls", f"site{i:04d}")
+        pairs.append({"dir": tls, "domain": c["domain"]})
+        with open(os.path.join(conf_d, f"site{i:04d}.conf"), "w", encoding="utf-8") as f:
+            f.write(
+                "server {\n"
+                "    listen 443 ssl;\n"
+                f"    server_name site{i:04d}.{c['domain']};\n"
+                f"    ssl_certificate {tls}/fullchain.pem;\n"
+                f"    ssl_certificate_key {tls}/privkey.pem;\n"
+                "    location / { return 200; }\n"
+                "}\n"
+            )
+    with open(os.path.join(root, "nginx", "nginx.conf"), "w", encoding="utf-8") as f:
+        f.write("events {}\nhttp {\n    include " + conf_d + "/*.conf;\n}\n")
+
+    for i in range(extra_dirs):
+        c = certs[i % domains]
+        pairs.append({"dir": os.path.join(root, "extra", f"svc{i:04d}"), "domain": c["domain"]})
+    os.makedirs(os.path.join(root, "extra"), exist_ok=True)
+
+    bindir = os.path.join(root, "bin")
+    os.makedirs(bindir)
+    # nginx -T как у настоящего: маркер "# configuration file" перед каждым файлом
+    _write_exec(os.path.join(bindir, "nginx"), (
+        "#!/bin/sh\n"
+        f"NGINX_DIR='{os.path.join(root, 'nginx')}'\n"
+        "case \"$1\" in\n"
+        "  -T)\n"
+        "    for f in \"$NGINX_DIR/nginx.conf\" \"$NGINX_DIR\"/conf.d/*.conf; do\n"
+        "      echo \"# configuration file $f:\"; cat \"$f\"; echo\n"
+        "    done\n"
+        "    echo 'nginx: configuration file test is successful' >&2 ;;\n"
+        "  *) echo 'nginx: configuration file test is successful' >&2 ;;\n"
+        "esac\n"
+    ))
+    _write_exec(os.path.join(bindir, "systemctl"), "#!/bin/sh\nexit 0\n")
+
+    manifest = {
+        "root": root,
+        "servers": servers,
+        "extra_dirs": extra_dirs,
+        "ca": os.path.join(pki, "ca.pem"),
+        "certs": certs,
+        "pairs": pairs,
+    }
+    with open(os.path.join(pki, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    install_local_pairs(manifest)
+    return manifest
+
+def load_manifest(root: str) -> dict:
+    with open(os.path.join(os.path.abspath(root), "pki", MANIFEST), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def install_local_pairs(manifest: dict, wipe_store: bool = True) -> None:
+    """
+    Возвращает сценарий к исходному виду: в каждой паре — старый локальный сертификат
+    обычными файлами, хранилище (и его .state) пустое.
+    """
+    by_domain: Dict[str, dict] = {c["domain"]: c for c in manifest["certs"]}
+    for pair in manifest["pairs"]:
+        shutil.rmtree(pair["dir"], ignore_errors=True)
+        os.makedirs(pair["dir"])
+        c = by_domain[pair["domain"]]
+        shutil.copyfile(c["local_cert"], os.path.join(pair["dir"], "fullchain.pem"))
+        shutil.copyfile(c["key"], os.path.join(pair["dir"], "privkey.pem"))
+        os.chmod(os.path.join(pair["dir"], "privkey.pem"), 0o600)
+    if wipe_store:
+        shutil.rmtree(store_dir(manifest), ignore_errors=True)
+        os.makedirs(store_dir(manifest))
+
+def store_dir(manifest: dict) -> str:
+    return os.path.join(manifest["root"], "store")
+
+def state_dir(manifest: dict) -> str:
+    return os.path.join(store_dir(manifest), ".state")
+
+
+def write_env(
+    manifest: dict,
+    base_url: str,
+    path: str,
+    extra: Optional[Dict[str, str]] = None,
+    projects: Optional[List[str]] = None,
+) -> None:
+    """
+    .env для main.py, смотрящий на фейковый Selectel по base_url и на заглушки из bin/.
+    projects — имена проектов фейка (больше одного — SELECTEL_PROJECTS).
+    """
+    root = manifest["root"]
+    env = {
+        "SELECTEL_USERNAME": "bench",
+        "SELECTEL_ACCOUNT_ID": "000000",
+        "SELECTEL_PASSWORD": "bench",
+        "SELECTEL_PROJECT_NAME": "bench",
+        "SELECTEL_IDENTITY_URL": base_url + "/identity/v3",
+        "SELECTEL_LE_BASE_URL": base_url + "/le",
+        "SELECTEL_CERT_MANAGER_URL": base_url + "/cm",
+        "CERT_STORE_DIR": store_dir(manifest),
+        "EXTRA_CERT_DIRS": os.path.join(root, "extra") if manifest["extra_dirs"] else "",
+        "MANAGED_PREFIXES": root,
+        "NGINX_BIN": os.path.join(root, "bin", "nginx"),
+        "SYSTEMCTL_BIN": os.path.join(root, "bin", "systemctl"),
+        "NGINX_PID_FILE": "",
+        "RELOAD_MIN_INTERVAL_SECONDS": "0",
+        "HTTP_TIMEOUT": "10",
+        "LOG_LEVEL": "WARNING",
+    }
+    if projects and len(projects) > 1:
+        env["SELECTEL_PROJECTS"] = ",".join(projects)
+        for p in projects:
+            env[f"SELECTEL_{p.upper()}_PROJECT_NAME"] = p
+    env.update(extra or {})
+    with open(path, "w", encoding="utf-8") as f:
+        for k, v in env.items():
+            f.write(f"{k}={v}\n")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Сгенерировать сценарий для bench (PKI, конфиг nginx, extra-папки)")
+    parser.add_argument("root", help="Пустая папка под сценарий")
+    parser.add_argument("--servers", type=int, default=50, help="Сколько server-блоков nginx")
+    parser.add_argument("--extra-dirs", type=int, default=20, help="Сколько папок в EXTRA_CERT_DIRS")
+    parser.add_argument("--domains", type=int, default=10, help="Сколько разных wildcard-сертификатов")
+    args = parser.parse_args(argv)
+
+    m = generate_scenario(args.root, args.servers, args.extra_dirs, args.domains)
+    print(f"Сценарий {m['root']}: доменов {len(m['certs'])}, пар {len(m['pairs'])}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import List, Optional
+
+# -------------------------
+# Один прогон main.main() в отдельном процессе (его запускает bench.run)
+# -------------------------
+# python3 -m bench.worker ENV_FILE RESULT_JSON
+# Отдельный процесс — чтобы пиковый RSS, кэши модулей и синглтоны (кэш сертификатов,
+# пул HTTP) не переезжали из фазы в фазу.
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    env_path, out_path = argv if argv is not None else sys.argv[1:]
+
+    # считаем запуски внешних программ: subprocess.run/check_output идут через Popen
+    spawned: Counter = Counter()
+    base_popen = subprocess.Popen
+
+    class CountingPopen(base_popen):
+        def __init__(self, args, *a, **kw):
+            name = args if isinstance(args, (str, bytes)) else args[0]
+            spawned[os.path.basename(os.fsdecode(name)).split()[0]] += 1
+            super().__init__(args, *a, **kw)
+
+    subprocess.Popen = CountingPopen
+
+    started = time.perf_counter()
+    import main as app
+    imported = time.perf_counter()
+    rc = app.main(["--env", env_path])
+    finished = time.perf_counter()
+
+    me = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result = {
+        "rc": rc,
+        "wall_s": finished - imported,
+        "import_s": imported - started,
+        "cpu_s": me.ru_utime + me.ru_stime,
+        "children_cpu_s": children.ru_utime + children.ru_stime,
+        # ru_maxrss на Linux — в КиБ
+        "peak_rss_kb": me.ru_maxrss,
+        "children_peak_rss_kb": children.ru_maxrss,
+        "subprocesses": sum(spawned.values()),
+        "subprocesses_by_cmd": dict(spawned),
+    }
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,12 @@ set -e
 
 ENV_FILE=".env"
 
+# ./create_service.sh --daemon — постоянная служба (main.py --daemon) вместо таймера
+MODE="timer"
+if [ "$1" = "--daemon" ]; then
+  MODE="daemon"
+fi
+
 if [ ! -f "$ENV_FILE" ]; then
   echo ".env файл не найден"
   exit 1
@@ -30,7 +36,29 @@ WORKDIR="$(dirname "$SCRIPT_PATH")"
 if [ ! -f "$SERVICE_PATH" ]; then
   echo "Создаю службу $SERVICE_NAME"
 
-  cat > "$SERVICE_PATH" <<EOF
+  if [ "$MODE" = "daemon" ]; then
+    cat > "$SERVICE_PATH" <<EOF
+[Unit]
+Description=Selectel SSL updater daemon (${SELECTEL_PROJECT_NAME})
+After=network-online.target
+Wants=network-online.target
+
+[Service]
+Type=simple
+WorkingDirectory=${WORKDIR}
+ExecStart=/usr/bin/python3 ${WORKDIR}/main.py --daemon
+ExecReload=/bin/kill -HUP \$MAINPID
+Restart=on-failure
+RestartSec=60
+User=root
+StandardOutput=journal
+StandardError=journal
+
+[Install]
+WantedBy=multi-user.target
+EOF
+  else
+    cat > "$SERVICE_PATH" <<EOF
 [Unit]
 Description=Selectel SSL updater (${SELECTEL_PROJECT_NAME})
 After=network.target
@@ -43,10 +71,24 @@ User=root
 StandardOutput=journal
 StandardError=journal
 EOF
+  fi
 else
   echo "Служба уже существует"
 fi
 
+if [ "$MODE" = "daemon" ]; then
+  systemctl daemon-reload
+  systemctl enable "$SERVICE_NAME"
+  systemctl restart "$SERVICE_NAME"
+
+  echo "Готово."
+  echo "Проверка службы:"
+  echo "systemctl status $SERVICE_NAME"
+  echo "Внеплановая проверка:"
+  echo "systemctl reload $SERVICE_NAME"
+  exit 0
+fi
+
 # --- создаем timer если нет ---
 if [ ! -f "$TIMER_PATH" ]; then
   echo "Создаю таймер $TIMER_NAME"
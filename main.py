@@ -13,40 +13,265 @@ cert_update.py
 import argparse
 import sys
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+from utils.daemon import note_next_check, run_daemon, utcnow
+from utils.domains import CertDomainIndex
 from utils.env import load_dotenv
+from utils.extra_dirs import scan_extra_ssl_pairs
+from utils.fleet import (
+    FleetError,
+    download_fleet_bundles,
+    fetch_fleet_index,
+    publish_fleet_bundles,
+    start_fleet_server,
+)
+from utils.hooks import (
+    hooks_for_paths,
+    load_pending_hooks,
+    load_post_update_hooks,
+    run_post_update_hooks,
+    save_pending_hooks,
+)
+from utils.local_certs import inspect_ssl_pairs
 from utils.logger import setup_logging
+from utils.metrics import inc_metric, init_metrics, note_cert_expiry, start_phase
+from utils.network import begin_http_run, close_http_pool, init_http_retry
 from utils.nginx import *
 from utils.openssl import *
 from utils.other import *
 from utils.parsers import  *
+from utils.plan import PlanError, build_plan, load_plan, write_plan
+from utils.projects import (
+    ProjectConfigError,
+    download_projects_cert_bundles,
+    fetch_projects_le_certs,
+    load_selectel_projects,
+)
+from utils.reload import flush_nginx_reload, init_nginx_reloader, request_nginx_reload
+from utils.retention import collect_garbage
 from utils.selectel_api import *
+from utils.store import (
+    bundle_files,
+    find_stored_bundle,
+    find_stored_object,
+    link_bundle_alias,
+    link_version_dir,
+    objects_dir,
+    store_bundle,
+)
 
 
 
-def main() -> int:
+def main(argv: Optional[List[str]] = None) -> int:
     parser = argparse.ArgumentParser(description="Selectel SSL auto-renew + nginx seamless switch")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["run", "plan", "apply", "serve", "pull"],
+        default="run",
+        help="run — проверить и обновить (по умолчанию); plan — только составить JSON-план; "
+             "apply — выполнить готовый план (--plan); serve — координатор флота: скачать из Selectel "
+             "и опубликовать в FLEET_PUBLISH_DIR; pull — узел флота: обновиться из FLEET_SOURCE",
+    )
+    parser.add_argument(
+        "--plan",
+        metavar="FILE",
+        help="plan: куда записать план (по умолчанию stdout); apply: какой план выполнить",
+    )
     parser.add_argument("--dry-run", action="store_true", help="Ничего не пишем на диск и не перезагружаем nginx")
-    args = parser.parse_args()
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Работать постоянно: проверять по расписанию из сроков сертификатов, SIGHUP — проверить сейчас",
+    )
+    parser.add_argument("--env", metavar="FILE", help="Путь к .env (по умолчанию .env рядом с main.py)")
+    args = parser.parse_args(argv)
+    if args.command == "apply" and not args.plan:
+        parser.error("apply: нужен --plan FILE")
+    if args.daemon and args.command not in ("run", "serve", "pull"):
+        parser.error("--daemon работает только с командами run, serve и pull")
 
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    env_path = os.path.join(script_dir, ".env")
+    env_path = args.env or os.path.join(script_dir, ".env")
     env = load_dotenv(env_path)
 
-    setup_logging(env.get("LOG_LEVEL", "INFO"), env.get("LOG_FILE"))
+    # план в stdout — тогда логи в stderr, чтобы не смешивать
+    plan_to_stdout = args.command == "plan" and (not args.plan or args.plan == "-")
+    setup_logging(env.get("LOG_LEVEL", "INFO"), env.get("LOG_FILE"), stream=sys.stderr if plan_to_stdout else sys.stdout)
 
-    # обязательные
-    username = env.get("SELECTEL_USERNAME") or env.get("SERVICE_USERNAME")
-    account_id = env.get("SELECTEL_ACCOUNT_ID") or env.get("ACCOUNT_ID")
-    password = env.get("SELECTEL_PASSWORD") or env.get("SERVICE_PASSWORD")
-    project_name = env.get("SELECTEL_PROJECT_NAME") or env.get("PROJECT_NAME")
+    # служебные файлы (кэши между запусками)
+    cert_store_dir = env.get("CERT_STORE_DIR", "/etc/nginx/ssl")
+    state_dir = env.get("STATE_DIR", os.path.join(cert_store_dir, ".state"))
+
+    # обязательные: учётка Selectel (одна или по проектам SELECTEL_PROJECTS);
+    # узлу флота доступ к Selectel не нужен — всё берётся у координатора
+    if args.command == "pull":
+        if not env.get("FLEET_SOURCE"):
+            logging.error("pull: не задан FLEET_SOURCE (папка или URL координатора)")
+            return 2
+    else:
+        try:
+            load_selectel_projects(env, state_dir, args.dry_run)
+        except ProjectConfigError as e:
+            logging.error("%s", e)
+            return 2
+    if args.command == "serve" and not env.get("FLEET_PUBLISH_DIR"):
+        logging.error("serve: не задан FLEET_PUBLISH_DIR (куда публиковать bundle для узлов)")
+        return 2
+    init_cert_cache(env.get("CERT_CACHE_FILE", os.path.join(state_dir, "cert-cache.json")))
+    # reload nginx: склейка запросов, не чаще RELOAD_MIN_INTERVAL_SECONDS, SIGHUP мастеру по pid-файлу
+    init_nginx_reloader(
+        env.get("SYSTEMCTL_BIN", "systemctl"),
+        env.get("NGINX_BIN", "nginx"),
+        dry_run=args.dry_run,
+        pid_file=env.get("NGINX_PID_FILE", "/run/nginx.pid") or None,
+        debounce=float(env.get("RELOAD_DEBOUNCE_SECONDS", "5")),
+        min_interval=float(env.get("RELOAD_MIN_INTERVAL_SECONDS", "30")),
+        max_test_failures=int(env.get("RELOAD_MAX_TEST_FAILURES", "3")),
+        cooldown=float(env.get("RELOAD_FAILURE_COOLDOWN_SECONDS", "3600")),
+        state_path=env.get("RELOAD_STATE_FILE", os.path.join(state_dir, "nginx-reload.json")),
+        background=args.daemon,
+    )
+    # HTTP: повторы с backoff/Retry-After, отключение мёртвого хоста, общий дедлайн на прогон
+    init_http_retry(
+        retries=int(env.get("HTTP_RETRIES", "3")),
+        backoff=float(env.get("HTTP_BACKOFF_SECONDS", "0.5")),
+        max_backoff=float(env.get("HTTP_BACKOFF_MAX_SECONDS", "30")),
+        run_deadline=float(env.get("HTTP_RUN_DEADLINE_SECONDS", "900")),
+        breaker_threshold=int(env.get("HTTP_BREAKER_THRESHOLD", "5")),
+        breaker_cooldown=float(env.get("HTTP_BREAKER_COOLDOWN_SECONDS", "60")),
+    )
+    # метрики: строка run_summary в лог, textfile для node_exporter (METRICS_TEXTFILE)
+    metrics = init_metrics(
+        textfile=None if args.dry_run else (env.get("METRICS_TEXTFILE") or None),
+        state_path=None if args.dry_run else env.get("METRICS_STATE_FILE", os.path.join(state_dir, "metrics.json")),
+        summary=env.get("METRICS_SUMMARY", "1").strip().lower() not in ("0", "false", "no", "off"),
+    )
+
+    def once(schedule=None, changed=None, watch_dirs=None) -> int:
+        metrics.begin_run()
+        begin_http_run()
+        if args.command == "serve":
+            rc = serve_once(args, env, schedule)
+        else:
+            rc = run_once(args, env, schedule, changed, watch_dirs)
+        if not args.daemon:
+            # отложенный reload — часть этого прогона
+            flush_nginx_reload()
+        # частичный или упавший прогон (inotify, apply, ошибка) мог видеть не все пары —
+        # сроки остальных доменов не трогаем
+        metrics.finish_run(rc, full=rc == 0 and changed is None and args.command != "apply")
+        return rc
+
+    if args.daemon:
+        if args.command == "serve" and env.get("FLEET_LISTEN"):
+            try:
+                start_fleet_server(
+                    env.get("FLEET_PUBLISH_DIR", ""),
+                    env["FLEET_LISTEN"],
+                    env.get("FLEET_TOKEN", ""),
+                    tls_cert=env.get("FLEET_TLS_CERT") or None,
+                    tls_key=env.get("FLEET_TLS_KEY") or None,
+                )
+            except (FleetError, OSError, ValueError) as e:
+                logging.error("Флот: не смог запустить HTTP-раздачу на %s: %s", env["FLEET_LISTEN"], e)
+                return 2
+        rc = run_daemon(
+            once,
+            min_interval=int(env.get("DAEMON_MIN_INTERVAL_SECONDS", "3600")),
+            max_interval=int(env.get("DAEMON_MAX_INTERVAL_SECONDS", "86400")),
+            jitter=int(env.get("DAEMON_JITTER_SECONDS", "300")),
+            watch=env.get("DAEMON_WATCH", "0").strip().lower() in ("1", "true", "yes", "on"),
+            debounce=float(env.get("DAEMON_WATCH_DEBOUNCE_SECONDS", "2")),
+        )
+        # отложенный reload — то, что не успел сделать таймер до остановки
+        flush_nginx_reload()
+
+    else:
+        if args.command == "serve" and env.get("FLEET_LISTEN"):
+            logging.warning("FLEET_LISTEN работает только с --daemon — сейчас только публикую в папку.")
+        rc = once()
+
+    # keep-alive соединения живут между проходами daemon — закрываем только на выходе
+    close_http_pool()
+    return rc
+
+
+def serve_once(
+    args: argparse.Namespace,
+    env: Dict[str, str],
+    schedule: Optional[Dict[str, datetime]] = None,
+) -> int:
+    """
+    Координатор флота: список Selectel -> скачать новые версии -> опубликовать в FLEET_PUBLISH_DIR.
+    Локальные пары и nginx не трогает; узлы забирают bundle командой pull.
+    """
+    le_base_url = env.get("SELECTEL_LE_BASE_URL", "https://api.selectel.ru/certs/le")
+    cert_manager_url = env.get("SELECTEL_CERT_MANAGER_URL", "https://cloud.api.selcloud.ru/certificate-manager/")
+    publish_dir = env["FLEET_PUBLISH_DIR"]
+    cert_store_dir = env.get("CERT_STORE_DIR", "/etc/nginx/ssl")
+    state_dir = env.get("STATE_DIR", os.path.join(cert_store_dir, ".state"))
+    http_timeout = int(env.get("HTTP_TIMEOUT", "30"))
+    fetch_concurrency = int(env.get("FETCH_CONCURRENCY", "8"))
+    renew_window = timedelta(days=int(env.get("DAEMON_RENEW_WINDOW_DAYS", "30")))
 
-    if not all([username, account_id, password, project_name]):
-        logging.error(
-            "Не хватает переменных в .env. Нужно: SELECTEL_USERNAME, SELECTEL_ACCOUNT_ID, SELECTEL_PASSWORD, SELECTEL_PROJECT_NAME"
+    projects = load_selectel_projects(env, state_dir, args.dry_run)
+    try:
+        start_phase("le_list")
+        items, project_errors = fetch_projects_le_certs(projects, le_base_url, http_timeout)
+        logging.info("Список LE сертификатов Selectel получен: %d шт.", len(items))
+
+        start_phase("publish")
+        # knox_id -> проект: bundle качается токеном того проекта, в чьём списке он есть
+        item_project = {str(it.get("knox_cert_id") or it.get("id")): it.get("project") for it in items}
+        published, errors = publish_fleet_bundles(
+            publish_dir,
+            items,
+            lambda ids: download_projects_cert_bundles(
+                projects,
+                {knox_id: item_project.get(knox_id) for knox_id in ids},
+                cert_manager_url,
+                timeout=http_timeout,
+                concurrency=fetch_concurrency,
+            ),
+            dry_run=args.dry_run,
         )
-        return 2
+        inc_metric("renewals", published)
+        for knox_id, err in errors.items():
+            logging.error("Не удалось скачать knox_cert_id=%s (пропускаю): %s", knox_id, err)
+            inc_metric("failures", kind="download")
+
+        # следующая проверка — к ожидаемому перевыпуску любого из сертификатов
+        for it in items:
+            exp = parse_selectel_date(it.get("expire_at") or "") if isinstance(it, dict) else None
+            if exp:
+                note_next_check(schedule, str(it.get("knox_cert_id") or it.get("id")), exp - renew_window)
+        if errors or project_errors:
+            note_next_check(schedule, "*", utcnow())
+        return 1 if errors or project_errors else 0
+
+    except Exception:
+        logging.exception("Фатальная ошибка")
+        return 1
 
-    identity_url = env.get("SELECTEL_IDENTITY_URL", "https://cloud.api.selcloud.ru/identity/v3")
+
+def run_once(
+    args: argparse.Namespace,
+    env: Dict[str, str],
+    schedule: Optional[Dict[str, datetime]] = None,
+    changed: Optional[Set[str]] = None,
+    watch_dirs: Optional[Set[str]] = None,
+) -> int:
+    """
+    Один проход: локальные пары -> список Selectel -> скачивание -> переключение -> reload.
+    args.command=plan останавливается после решения, что обновлять, и пишет план;
+    args.command=apply берёт решение из плана и сразу переходит к скачиванию/переключению.
+    args.command=pull вместо Selectel берёт список и bundle у координатора флота (FLEET_SOURCE).
+
+    schedule (для --daemon) заполняется сроками следующей проверки по доменам.
+    changed — пути, изменившиеся на диске (inotify): проверяются только затронутые пары.
+    watch_dirs заполняется папками, за которыми стоит следить через inotify.
+    """
     le_base_url = env.get("SELECTEL_LE_BASE_URL", "https://api.selectel.ru/certs/le")
     cert_manager_url = env.get("SELECTEL_CERT_MANAGER_URL", "https://cloud.api.selcloud.ru/certificate-manager/")
 
@@ -55,6 +280,7 @@ def main() -> int:
 
     cert_store_dir = env.get("CERT_STORE_DIR", "/etc/nginx/ssl")
     http_timeout = int(env.get("HTTP_TIMEOUT", "30"))
+    state_dir = env.get("STATE_DIR", os.path.join(cert_store_dir, ".state"))
 
     # дополнительные папки, в которых лежат cert/key для других сервисов
     extra_cert_dirs_raw = env.get("EXTRA_CERT_DIRS", "")
@@ -67,162 +293,366 @@ def main() -> int:
     managed_prefixes_list = [p.strip() for p in managed_prefixes.split(",") if p.strip()]
     # На сколько "должен быть новее" remote, чтобы обновлять (в минутах)
     min_diff_minutes = int(env.get("MIN_EXPIRE_DIFF_MINUTES", "60"))
+    # сколько запросов к certificate-manager выполнять параллельно
+    fetch_concurrency = int(env.get("FETCH_CONCURRENCY", "8"))
+    # сколько потоков осматривают локальные пары (0 — по числу ядер)
+    inspect_workers = int(env.get("INSPECT_WORKERS", "0"))
+    # за сколько дней до истечения начинать ждать перевыпуск в Selectel (для --daemon)
+    renew_window = timedelta(days=int(env.get("DAEMON_RENEW_WINDOW_DAYS", "30")))
+    # хранение старых версий и *.bak-*: N последних или всё моложе D дней
+    gc_enabled = env.get("GC_ENABLED", "1").strip().lower() not in ("0", "false", "no", "off")
+    gc_keep_versions = int(env.get("GC_KEEP_VERSIONS", "3"))
+    gc_keep_days = int(env.get("GC_KEEP_DAYS", "90"))
+    # хуки после обновления для не-nginx сервисов (HOOK_<NAME>_*, таймаут по умолчанию — HOOKS_TIMEOUT_SECONDS)
+    hooks = load_post_update_hooks(env)
+
+    # run — обычный проход, plan — только составить план, apply — выполнить готовый план,
+    # pull — как run, но список и bundle берутся у координатора флота, а не в Selectel
+    command = getattr(args, "command", None) or "run"
+    fleet_source = env.get("FLEET_SOURCE", "")
+    fleet_token = env.get("FLEET_TOKEN") or None
 
     now_stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     updated_any = False
+    updated_nginx_any = False
+    updated_paths = []
+    nginx_failed = False
+
+    # кэш пар из nginx -T (по mtime/size всех файлов конфига)
+    nginx_cache_path = None if args.dry_run else env.get("NGINX_CACHE_FILE", os.path.join(state_dir, "nginx-pairs.json"))
+    # снимок папок EXTRA_CERT_DIRS (перечитываются только папки с изменённым mtime)
+    extra_cache_path = None if args.dry_run else env.get("EXTRA_DIRS_CACHE_FILE", os.path.join(state_dir, "extra-dirs.json"))
+    # хуки, которые не сработали — повторяем при следующем запуске
+    hooks_state_path = None if args.dry_run else env.get("HOOKS_STATE_FILE", os.path.join(state_dir, "hooks.json"))
+    # индекс координатора флота (ETag для условного GET)
+    fleet_cache_path = None if args.dry_run else env.get("FLEET_INDEX_CACHE_FILE", os.path.join(state_dir, "fleet-index.json"))
+
+    # проекты Selectel (кэш токена и списка LE — у каждого свой); IAM-токен берётся лениво:
+    # apply по плану без скачивания и pull в Selectel не ходят
+    projects = [] if command == "pull" else load_selectel_projects(env, state_dir, args.dry_run)
+    project_errors: Dict[str, str] = {}
 
     try:
-        token = get_selectel_project_token(
-            identity_url=identity_url,
-            username=username,
-            account_id=account_id,
-            password=password,
-            project_name=project_name,
-            timeout=http_timeout,
-        )
-        logging.info("IAM-токен проекта получен.")
-
-        items = list_selectel_le_certs(le_base_url, token, timeout=http_timeout)
-        logging.info("Список LE сертификатов Selectel получен: %d шт.", len(items))
-
-        latest = build_latest_cert_map(items)
-
-        pairs_nginx = parse_nginx_ssl_pairs(nginx_bin) or []
-        pairs_extra = scan_extra_ssl_pairs(extra_cert_dirs) if extra_cert_dirs else []
-
-        if not pairs_nginx and not pairs_extra:
-            logging.warning("Не нашёл ни одной пары SSL ни в nginx, ни в EXTRA_CERT_DIRS.")
-            return 0
-
-        # объединяем пары без дублей; если пара есть в nginx — считаем её nginx (для reload)
-        nginx_set = set((os.path.abspath(c), os.path.abspath(k)) for c, k in pairs_nginx)
-        extra_set = set((os.path.abspath(c), os.path.abspath(k)) for c, k in pairs_extra)
-        all_pairs = sorted(nginx_set.union(extra_set))
-
-        logging.info("Нашёл SSL-пары: nginx=%d, extra=%d, итого=%d", len(nginx_set), len(extra_set), len(all_pairs))
-
-        updated_nginx_any = False
-
-        for cert_path, key_path in all_pairs:
-            is_nginx_pair = (cert_path, key_path) in nginx_set
-            if not os.path.exists(cert_path):
-                logging.warning("cert_path не существует: %s (пропускаю)", cert_path)
-                continue
-            if not os.path.exists(key_path):
-                logging.warning("key_path не существует: %s (пропускаю)", key_path)
-                continue
-
-            local_exp = get_cert_not_after(cert_path)
-            if not local_exp:
-                logging.warning("Не смог определить срок действия локального сертификата: %s", cert_path)
-                continue
-
-            domen = infer_domain_from_cert(cert_path) or infer_domain_from_path(cert_path)
-            if not domen:
-                logging.warning("Не смог определить домен для сертификата: %s (пропускаю)", cert_path)
-                continue
-
-            remote = latest.get(domen)
-
-            if not remote:
-                logging.info("В Selectel не нашёл сертификат для домена %s (пропускаю)", domen)
-                continue
-
-            remote_exp = parse_selectel_date(remote.get("expire_at") or "")
-            if not remote_exp:
-                logging.warning("У Selectel сертификата нет expire_at или не распарсилось: домен=%s", domen)
-                continue
+        if command == "apply":
+            # готовый план: без списка Selectel, nginx -T и разбора сертификатов
+            start_phase("load_plan")
+            renewals = load_plan(args.plan, cert_store_dir)
+            all_pairs = []
+        else:
+            start_phase("discover_nginx")
+            pairs_nginx = load_nginx_ssl_pairs(nginx_bin, cache_path=nginx_cache_path)
+            # None — nginx -T не отработал: на что смотрит nginx, неизвестно, GC в этот раз нельзя
+            nginx_failed = pairs_nginx is None
+            pairs_nginx = pairs_nginx or []
+            start_phase("discover_extra")
+            pairs_extra = scan_extra_ssl_pairs(
+                extra_cert_dirs,
+                cache_path=extra_cache_path,
+                cert_store_dir=cert_store_dir,
+                state_dir=state_dir,
+                dirs=watch_dirs,
+            ) if extra_cert_dirs else []
+
+            if not pairs_nginx and not pairs_extra:
+                logging.warning("Не нашёл ни одной пары SSL ни в nginx, ни в EXTRA_CERT_DIRS.")
+                if command == "plan":
+                    write_plan(args.plan, build_plan({}, cert_store_dir))
+                return 0
+
+            # объединяем пары без дублей; если пара есть в nginx — считаем её nginx (для reload)
+            nginx_set = set((os.path.abspath(c), os.path.abspath(k)) for c, k in pairs_nginx)
+            extra_set = set((os.path.abspath(c), os.path.abspath(k)) for c, k in pairs_extra)
+            all_pairs = sorted(nginx_set.union(extra_set))
 
-            diff = remote_exp - local_exp
             logging.info(
-                "Домен %s: local_exp=%s, remote_exp=%s, diff=%s",
-                domen,
-                local_exp.isoformat(sep=" "),
-                remote_exp.isoformat(sep=" "),
-                diff,
+                "Нашёл SSL-пары: nginx=%d, extra=%d, итого=%d", len(nginx_set), len(extra_set), len(all_pairs)
             )
 
-            if diff <= timedelta(minutes=min_diff_minutes):
-                continue  # локальный не хуже (или почти равен)
-
-            knox_id = remote.get("knox_cert_id") or remote.get("id")
-            if not knox_id:
-                logging.warning("Нет knox_cert_id/id у remote сертификата для %s (пропускаю)", domen)
-                continue
-
-            # скачиваем bundle
-            logging.info("Найден более новый сертификат для %s. Скачиваю knox_cert_id=%s", domen, knox_id)
-            certs, privkey = download_selectel_cert_bundle(cert_manager_url, token, knox_id, timeout=http_timeout)
-
-            # раскладываем по файлам
-            leaf = certs[0].strip() + "\n"
-            chain = "\n".join([c.strip() for c in certs[1:]]).strip()
-            chain = (chain + "\n") if chain else ""
-            fullchain = leaf + chain
-
-            # создаём папку хранения
-            dom_dir = os.path.join(cert_store_dir, domen)
-            ver_dir = os.path.join(dom_dir, remote_exp.strftime("%Y-%m-%d_%H-%M-%S"))
-            logging.info("Пишу сертификаты в: %s", ver_dir)
-
-            if not args.dry_run:
-                ensure_dir(ver_dir)
+            if watch_dirs is not None:
+                watch_dirs.update(os.path.dirname(p) for pair in all_pairs for p in pair)
+
+            if changed is not None:
+                # реакция на inotify: только пары, в папках которых что-то поменялось
+                changed_dirs = set(changed)
+                changed_dirs.update(os.path.dirname(p) for p in changed)
+                all_pairs = [
+                    pair for pair in all_pairs
+                    if os.path.dirname(pair[0]) in changed_dirs or os.path.dirname(pair[1]) in changed_dirs
+                ]
+                logging.info("Изменения на диске: путей %d, затронуто пар %d", len(changed), len(all_pairs))
+                if not all_pairs:
+                    return 0
+
+            # --- 0. осматриваем локальные пары параллельно (файлы, notAfter, SAN, домен) ---
+            start_phase("inspect")
+            inspected = inspect_ssl_pairs(all_pairs, workers=inspect_workers)
+            # сроки в метрики до похода в Selectel — чтобы алерт по истечению работал и без API
+            for local in inspected:
+                if not local["error"]:
+                    note_cert_expiry(local["cert"], local["domen"], local["local_exp"])
+
+            if command == "pull":
+                start_phase("fleet_index")
+                items = fetch_fleet_index(
+                    fleet_source, http_timeout, token=fleet_token, cache_path=fleet_cache_path
+                )
+            else:
+                # токены и списки всех проектов — параллельно, в один индекс доменов
+                start_phase("le_list")
+                items, project_errors = fetch_projects_le_certs(projects, le_base_url, http_timeout)
+                logging.info("Список LE сертификатов Selectel получен: %d шт.", len(items))
+                if project_errors:
+                    note_next_check(schedule, "*", utcnow())
+
+            start_phase("decide")
+            remote_index = CertDomainIndex(items)
+
+            # --- 1. решаем, какие пары обновлять, и группируем их по remote сертификату ---
+            # knox_id -> {"domen", "remote_exp", "stamp", "ver_dir",
+            #             "pairs": [{"cert", "key", "is_nginx", "cert_target", "key_target", ...}]}
+            renewals: Dict[str, dict] = {}
+
+            for local in inspected:
+                cert_path, key_path = local["cert"], local["key"]
+                is_nginx_pair = (cert_path, key_path) in nginx_set
+                if local["error"]:
+                    logging.warning("%s", local["error"])
+                    continue
+
+                local_exp = local["local_exp"]
+                domen = local["domen"]
+                san = local["san"]
+                # с SAN — только сертификат, покрывающий все локальные имена (иначе часть имён
+                # в nginx осталась бы без TLS); без SAN — как раньше: домен по имени папки,
+                # подходит и он сам, и его wildcard
+                match = remote_index.best_match(san or [domen, "*." + domen], strict=bool(san))
+
+                if not match:
+                    partial = remote_index.best_match(san) if san else None
+                    if partial:
+                        logging.warning(
+                            "Сертификат Selectel %s для %s покрывает не все имена локального, нет: %s (пропускаю)",
+                            partial[0].get("knox_cert_id") or partial[0].get("id"),
+                            domen,
+                            ", ".join(partial[2]),
+                        )
+                    else:
+                        logging.info("В Selectel не нашёл сертификат для домена %s (пропускаю)", domen)
+                    continue
+
+                remote, remote_exp, _uncovered = match
+
+                diff = remote_exp - local_exp
+                logging.info(
+                    "Домен %s: local_exp=%s, remote_exp=%s, diff=%s",
+                    domen,
+                    local_exp.isoformat(sep=" "),
+                    remote_exp.isoformat(sep=" "),
+                    diff,
+                )
 
-            cert_p = os.path.join(ver_dir, "cert.pem")
-            chain_p = os.path.join(ver_dir, "chain.pem")
-            fullchain_p = os.path.join(ver_dir, "fullchain.pem")
-            key_p = os.path.join(ver_dir, "privkey.pem")
+                if diff <= timedelta(minutes=min_diff_minutes):
+                    # локальный не хуже (или почти равен); ждём, когда Selectel перевыпустит
+                    note_next_check(schedule, domen, min(local_exp, remote_exp) - renew_window)
+                    continue
+
+                knox_id = remote.get("knox_cert_id") or remote.get("id")
+                if not knox_id:
+                    logging.warning("Нет knox_cert_id/id у remote сертификата для %s (пропускаю)", domen)
+                    continue
+
+                renewal = renewals.get(knox_id)
+                if renewal is None:
+                    stamp = remote_exp.strftime("%Y-%m-%d_%H-%M-%S")
+                    renewal = renewals[knox_id] = {
+                        "domen": domen,
+                        "remote_exp": remote_exp,
+                        "stamp": stamp,
+                        # папка версии домена — симлинк на объект в хранилище
+                        "ver_dir": os.path.join(cert_store_dir, domen, stamp),
+                        # run: проект Selectel, в чьём списке сертификат; pull: отпечаток leaf от координатора
+                        "project": remote.get("project"),
+                        "fingerprint": remote.get("fingerprint"),
+                        "pairs": [],
+                    }
+                renewal["pairs"].append({
+                    "cert": cert_path,
+                    "key": key_path,
+                    "is_nginx": is_nginx_pair,
+                    "cert_target": os.path.join(renewal["ver_dir"], pick_cert_filename_for_nginx_target(cert_path)),
+                    "key_target": os.path.join(renewal["ver_dir"], "privkey.pem"),
+                    "local_exp": local_exp,
+                    "diff": diff,
+                })
+
+            if renewals:
+                logging.info(
+                    "К обновлению: сертификатов=%d, пар=%d",
+                    len(renewals),
+                    sum(len(r["pairs"]) for r in renewals.values()),
+                )
 
-            if args.dry_run:
-                logging.info("[dry-run] Записал бы: %s, %s, %s, %s", cert_p, chain_p, fullchain_p, key_p)
-            else:
-                write_file(cert_p, leaf, 0o644)
-                write_file(chain_p, chain or "", 0o644)
-                write_file(fullchain_p, fullchain, 0o644)
-                write_file(key_p, privkey, 0o600)
-
-            # обновляем пути из nginx конфига (только если разрешены)
-            if not path_allowed(cert_path, managed_prefixes_list):
-                logging.error(
-                    "cert_path вне разрешённых префиксов (%s): %s (пропускаю обновление этого пути)",
-                    managed_prefixes_list,
-                    cert_path,
+            if command == "plan":
+                write_plan(args.plan, build_plan(renewals, cert_store_dir))
+                return 0
+
+        # --- 2. параллельно качаем все нужные bundle (до любых изменений на диске) ---
+        start_phase("download")
+        # то, что уже лежит в хранилище (тот же knox_id и expire), повторно не качаем
+        store = objects_dir(cert_store_dir)
+        to_fetch = []
+        for knox_id, renewal in renewals.items():
+            renewal["obj_dir"] = find_stored_bundle(store, knox_id, renewal["stamp"])
+            if not renewal["obj_dir"] and renewal.get("fingerprint"):
+                # pull: тот же leaf уже мог прийти под другим knox_id/сроком — сверяем по отпечатку
+                renewal["obj_dir"] = find_stored_object(store, renewal["fingerprint"])
+                if renewal["obj_dir"] and not args.dry_run:
+                    link_bundle_alias(store, knox_id, renewal["stamp"], renewal["obj_dir"])
+            if renewal["obj_dir"]:
+                logging.info(
+                    "Сертификат для %s (knox_cert_id=%s) уже есть в хранилище: %s",
+                    renewal["domen"], knox_id, renewal["obj_dir"],
                 )
                 continue
-            if not path_allowed(key_path, managed_prefixes_list):
-                logging.error(
-                    "key_path вне разрешённых префиксов (%s): %s (пропускаю обновление этого пути)",
-                    managed_prefixes_list,
-                    key_path,
-                )
+            logging.info("Найден более новый сертификат для %s. Скачиваю knox_cert_id=%s", renewal["domen"], knox_id)
+            to_fetch.append(knox_id)
+
+        if not to_fetch:
+            bundles, fetch_errors = {}, {}
+        elif command == "pull":
+            bundles, fetch_errors = download_fleet_bundles(
+                fleet_source,
+                {knox_id: renewals[knox_id]["fingerprint"] for knox_id in to_fetch},
+                timeout=http_timeout,
+                token=fleet_token,
+                concurrency=fetch_concurrency,
+            )
+        else:
+            # каждый bundle — токеном своего проекта; apply по плану: токен нужен,
+            # только если что-то придётся скачать (call возьмёт его сам)
+            bundles, fetch_errors = download_projects_cert_bundles(
+                projects,
+                {knox_id: renewals[knox_id].get("project") for knox_id in to_fetch},
+                cert_manager_url,
+                timeout=http_timeout,
+                concurrency=fetch_concurrency,
+            )
+        for knox_id, err in fetch_errors.items():
+            logging.error("Не удалось скачать knox_cert_id=%s (пропускаю): %s", knox_id, err)
+            inc_metric("failures", kind="download")
+            note_next_check(schedule, renewals[knox_id]["domen"], utcnow())
+
+        # --- 3. каждый remote сертификат раскладываем один раз, затем переключаем все его пары ---
+        start_phase("switch")
+        for knox_id, renewal in renewals.items():
+            if not renewal["obj_dir"] and knox_id not in bundles:
                 continue
+            domen = renewal["domen"]
+            remote_exp = renewal["remote_exp"]
+            note_next_check(schedule, domen, remote_exp - renew_window)
+
+            ver_dir = renewal["ver_dir"]
+
+            if knox_id in bundles:
+                # раскладываем по файлам
+                files = bundle_files(*bundles[knox_id])
+                if args.dry_run:
+                    logging.info("[dry-run] Записал бы в хранилище %s: %s", store, ", ".join(files))
+                else:
+                    obj_dir, written = store_bundle(store, knox_id, renewal["stamp"], files)
+                    logging.info("%s сертификаты в: %s", "Записал" if written else "Уже были", obj_dir)
+                    renewal["obj_dir"] = obj_dir
 
-            new_cert_file = os.path.join(ver_dir, pick_cert_filename_for_nginx_target(cert_path))
-            new_key_file = key_p
-
-            logging.info("Переключаю nginx пути:\n  %s -> %s\n  %s -> %s", cert_path, new_cert_file, key_path,
-                         new_key_file)
-            atomic_update_link_or_file(cert_path, new_cert_file, now_stamp, args.dry_run)
-            atomic_update_link_or_file(key_path, new_key_file, now_stamp, args.dry_run)
-
-            updated_any = True
-            if is_nginx_pair:
-                updated_nginx_any = True
+            if args.dry_run:
+                logging.info("[dry-run] Сделал бы %s ссылкой на объект хранилища", ver_dir)
+            else:
+                logging.info("Папка версии: %s -> %s", ver_dir, renewal["obj_dir"])
+                link_version_dir(ver_dir, renewal["obj_dir"])
+            inc_metric("renewals")
+
+            for pair in renewal["pairs"]:
+                cert_path, key_path = pair["cert"], pair["key"]
+                # обновляем пути из nginx конфига (только если разрешены)
+                if not path_allowed(cert_path, managed_prefixes_list):
+                    logging.error(
+                        "cert_path вне разрешённых префиксов (%s): %s (пропускаю обновление этого пути)",
+                        managed_prefixes_list,
+                        cert_path,
+                    )
+                    continue
+                if not path_allowed(key_path, managed_prefixes_list):
+                    logging.error(
+                        "key_path вне разрешённых префиксов (%s): %s (пропускаю обновление этого пути)",
+                        managed_prefixes_list,
+                        key_path,
+                    )
+                    continue
+
+                new_cert_file = pair["cert_target"]
+                new_key_file = pair["key_target"]
+
+                logging.info("Переключаю nginx пути:\n  %s -> %s\n  %s -> %s", cert_path, new_cert_file, key_path,
+                             new_key_file)
+                atomic_update_link_or_file(cert_path, new_cert_file, now_stamp, args.dry_run)
+                atomic_update_link_or_file(key_path, new_key_file, now_stamp, args.dry_run)
+
+                updated_any = True
+                updated_paths.append(cert_path)
+                inc_metric("updated_pairs")
+                if not args.dry_run:
+                    note_cert_expiry(cert_path, domen, remote_exp)
+                if pair["is_nginx"]:
+                    updated_nginx_any = True
+
+        # чистка старых версий и бэкапов (после переключения — чтобы не снести то, на что уже смотрят)
+        # (после реакции на inotify и apply по плану не чистим — это сделает ближайшая плановая проверка)
+        if gc_enabled and changed is None and command in ("run", "pull") and nginx_failed:
+            logging.warning("nginx -T не отработал — чистку старых версий пропускаю до следующего прогона.")
+        elif gc_enabled and changed is None and command in ("run", "pull"):
+            start_phase("gc")
+            collect_garbage(
+                cert_store_dir,
+                [p for pair in all_pairs for p in pair],
+                keep_versions=gc_keep_versions,
+                keep_days=gc_keep_days,
+                dry_run=args.dry_run,
+            )
 
+        start_phase(None)
         # reload/restart nginx — только если обновлялись nginx-пары
         if updated_nginx_any:
-            nginx_reload_or_restart(systemctl_bin, nginx_bin, args.dry_run)
+            request_nginx_reload(systemctl_bin, nginx_bin, args.dry_run, reason="обновлены nginx-пары")
         elif updated_any:
             logging.info("Сертификаты обновлены (extra), nginx не трогаю.")
         else:
             logging.info("Обновлений не требуется.")
 
-        return 0
-
+        # хуки сервисов (haproxy, postfix, ...): по папкам обновлённых пар + не сработавшие в прошлый раз
+        if hooks:
+            pending = set(load_pending_hooks(hooks_state_path))
+            todo = hooks_for_paths(hooks, updated_paths)
+            todo += [h for h in hooks if h.name in pending and h not in todo]
+            if todo:
+                start_phase("hooks")
+                results = run_post_update_hooks(todo, args.dry_run)
+                inc_metric("failures", sum(1 for ok, _ in results.values() if not ok), kind="hook")
+                save_pending_hooks(hooks_state_path, [name for name, (ok, _) in results.items() if not ok])
+
+        return 1 if fetch_errors or project_errors else 0
+
+    except PlanError as e:
+        logging.error("%s", e)
+        return 2
+    except FleetError as e:
+        logging.error("Флот: %s", e)
+        return 1
     except Exception:
         logging.exception("Фатальная ошибка")
         return 1
 
+    finally:
+        save_cert_cache(persist=not args.dry_run)
+
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,78 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.daemon import _daemon_loop
+from utils.inotify import open_inotify
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify только в Linux")
+class DaemonWatchTest(unittest.TestCase):
+    def setUp(self):
+        self.watcher = open_inotify()
+        if self.watcher is None:
+            self.skipTest("inotify недоступен")
+        self.dir = tempfile.mkdtemp()
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        self.wake = threading.Event()
+        self.stop = threading.Event()
+        self.calls = []
+
+    def tearDown(self):
+        self.watcher.close()
+        os.close(self.wake_r)
+        os.close(self.wake_w)
+
+    def _loop(self, run_once):
+        # min=max=1 с: без событий следующая проверка — плановая (changed=None) через секунду
+        _daemon_loop(run_once, self.watcher, self.wake_r, self.wake, self.stop, 1, 1, 0, 0.05)
+
+    def _write(self, name):
+        with open(os.path.join(self.dir, name), "w") as f:
+            f.write("x")
+
+    def test_own_writes_do_not_trigger_followup_run(self):
+        def run_once(schedule, changed=None, watch_dirs=None):
+            self.calls.append(changed)
+            watch_dirs.add(self.dir)
+            if len(self.calls) == 2:
+                # папка уже под наблюдением (после первого прохода);
+                # как переключение пары: бэкап, временный файл, rename на место
+                self._write("fullchain.pem.bak-2026-01-01_00-00-00")
+                self._write("fullchain.pem.tmp-1")
+                os.rename(os.path.join(self.dir, "fullchain.pem.tmp-1"), os.path.join(self.dir, "fullchain.pem"))
+            elif len(self.calls) == 3:
+                self.stop.set()
+            return 0
+
+        self._loop(run_once)
+        self.assertEqual(len(self.calls), 3)
+        self.assertIsNone(self.calls[2], "после собственных записей прохода не должно быть реактивной проверки")
+
+    def test_external_change_after_run_triggers_partial_run(self):
+        target = os.path.join(self.dir, "privkey.pem")
+
+        def run_once(schedule, changed=None, watch_dirs=None):
+            self.calls.append(changed)
+            watch_dirs.add(self.dir)
+            if len(self.calls) == 1:
+                threading.Timer(0.2, self._write, ("privkey.pem",)).start()
+            else:
+                self.stop.set()
+            return 0
+
+        started = time.monotonic()
+        self._loop(run_once)
+        self.assertEqual(len(self.calls), 2)
+        self.assertIn(target, self.calls[1] or set())
+        self.assertLess(time.monotonic() - started, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
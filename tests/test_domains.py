@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.domains import CertDomainIndex
+
+
+def _item(knox_id, domains, expire_at="2030-01-01T00:00:00Z"):
+    return {"id": knox_id, "knox_cert_id": knox_id, "domains": domains, "expire_at": expire_at}
+
+
+class BestMatchTest(unittest.TestCase):
+    def test_partial_coverage_is_rejected_in_strict_mode(self):
+        index = CertDomainIndex([_item("wild", ["*.example.com"])])
+        names = ["api.example.com", "example.com"]
+
+        item, _exp, missing = index.best_match(names)
+        self.assertEqual(item["knox_cert_id"], "wild")
+        self.assertEqual(missing, ["example.com"])
+        self.assertIsNone(index.best_match(names, strict=True))
+
+    def test_strict_prefers_full_coverage_even_if_older(self):
+        index = CertDomainIndex([
+            _item("wild", ["*.example.com"], "2031-01-01T00:00:00Z"),
+            _item("full", ["*.example.com", "example.com"], "2030-01-01T00:00:00Z"),
+        ])
+        item, _exp, missing = index.best_match(["api.example.com", "example.com"], strict=True)
+        self.assertEqual(item["knox_cert_id"], "full")
+        self.assertEqual(missing, [])
+
+    def test_wildcard_does_not_cover_apex_or_deeper_names(self):
+        index = CertDomainIndex([_item("wild", ["*.example.com"])])
+        self.assertIsNone(index.best_match(["example.com"], strict=True))
+        self.assertIsNone(index.best_match(["a.b.example.com"], strict=True))
+        self.assertIsNotNone(index.best_match(["*.example.com"], strict=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import signal
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.hooks import _send_signal, load_post_update_hooks
+
+
+class LoadHooksTest(unittest.TestCase):
+    def test_malformed_hook_timeout_skips_only_that_hook(self):
+        env = {
+            "HOOK_BAD_DIRS": "/etc/bad",
+            "HOOK_BAD_COMMAND": "true",
+            "HOOK_BAD_TIMEOUT": "10s",
+            "HOOK_GOOD_DIRS": "/etc/good",
+            "HOOK_GOOD_COMMAND": "true",
+            "HOOK_GOOD_TIMEOUT": "5",
+        }
+        with self.assertLogs(level="ERROR"):
+            hooks = load_post_update_hooks(env)
+        self.assertEqual([(h.name, h.timeout) for h in hooks], [("good", 5.0)])
+
+    def test_malformed_common_timeout_falls_back_to_default(self):
+        env = {"HOOKS_TIMEOUT_SECONDS": "half", "HOOK_APP_DIRS": "/etc/app", "HOOK_APP_COMMAND": "true"}
+        with self.assertLogs(level="ERROR"):
+            hooks = load_post_update_hooks(env)
+        self.assertEqual([h.timeout for h in hooks], [30.0])
+
+    def test_process_name_defaults_to_pidfile_name(self):
+        env = {"HOOK_POSTFIX_DIRS": "/etc/postfix", "HOOK_POSTFIX_PIDFILE": "/var/spool/postfix/pid/master.pid"}
+        self.assertEqual(load_post_update_hooks(env)[0].process, "master")
+
+
+@unittest.skipUnless(os.path.isdir("/proc/self"), "нужен /proc")
+class SendSignalTest(unittest.TestCase):
+    def test_signal_is_not_sent_to_foreign_process(self):
+        # свой pid под чужим именем: сигнал не уходит (иначе тест получил бы SIGUSR1)
+        with tempfile.NamedTemporaryFile("w", suffix=".pid", delete=False) as f:
+            f.write(f"{os.getpid()}\n")
+        self.addCleanup(os.unlink, f.name)
+        env = {
+            "HOOK_APP_DIRS": "/etc/app",
+            "HOOK_APP_PIDFILE": f.name,
+            "HOOK_APP_SIGNAL": "USR1",
+            "HOOK_APP_PROCESS": "not-this-process",
+        }
+        hook = load_post_update_hooks(env)[0]
+        self.assertEqual(hook.signal, signal.SIGUSR1)
+        with self.assertRaisesRegex(RuntimeError, "не not-this-process"):
+            _send_signal(hook)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import reload as reload_mod
+from utils.reload import NginxReloader
+from utils.state import save_json_state
+
+
+class NginxReloaderTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.dir, "reload.json")
+
+    def _reloader(self, **kwargs):
+        return NginxReloader("systemctl", "nginx", state_path=self.state_path, **kwargs)
+
+    def test_request_persists_pending(self):
+        self._reloader().request("тест")
+        # процесс «упал» до reload — новый экземпляр доделает его
+        self.assertEqual(self._reloader().pending, 1)
+
+    def test_flush_waits_without_holding_lock(self):
+        # reload был только что — flush ждёт min_interval
+        save_json_state(self.state_path, {"last_reload": time.time(), "pending": True})
+        reloader = self._reloader(min_interval=0.5)
+        done = threading.Event()
+        with mock.patch.object(reload_mod, "nginx_config_test", return_value=True), \
+                mock.patch.object(reload_mod, "systemctl_reload_or_restart", return_value=True) as reload_call:
+            flusher = threading.Thread(target=lambda: (reloader.flush(), done.set()))
+            flusher.start()
+            time.sleep(0.1)
+            started = time.monotonic()
+            reloader.request("во время ожидания")
+            self.assertLess(time.monotonic() - started, 0.2, "request() ждал блокировку, пока flush() спит")
+            flusher.join(2)
+        self.assertTrue(done.is_set())
+        self.assertEqual(reload_call.call_count, 1)
+        self.assertEqual(reloader.pending, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,14 @@
+import os
 import subprocess
 from typing import List, Tuple
 
+from utils.metrics import span
+
 
 def run_cmd(cmd: List[str], check: bool = False) -> Tuple[int, str]:
-    p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    # в метриках — программа и первый аргумент: "nginx -t", "systemctl reload"
+    with span(" ".join([os.path.basename(cmd[0])] + cmd[1:2]), kind="cmd"):
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     out = (p.stdout or "") + (p.stderr or "")
     if check and p.returncode != 0:
         raise RuntimeError(f"Команда упала ({p.returncode}): {' '.join(cmd)}\n{out[:2000]}")
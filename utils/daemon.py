@@ -0,0 +1,196 @@
+import logging
+import os
+import random
+import select
+import signal
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from utils.inotify import InotifyWatcher, open_inotify
+
+
+# -------------------------
+# Планировщик для --daemon
+# -------------------------
+def utcnow() -> datetime:
+    # все сроки (notAfter, expire_at) у нас naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def note_next_check(schedule: Optional[Dict[str, datetime]], domain: str, when: datetime) -> None:
+    """
+    Запоминает, когда домен нужно проверить в следующий раз (берём самый ранний срок).
+    """
+    if schedule is None:
+        return
+    cur = schedule.get(domain)
+    if cur is None or when < cur:
+        schedule[domain] = when
+
+def pick_next_wakeup(
+    schedule: Dict[str, datetime],
+    now: datetime,
+    min_interval: int,
+    max_interval: int,
+    jitter: int,
+) -> Tuple[float, Optional[str]]:
+    """
+    Возвращает (сколько секунд спать, домен, из-за которого просыпаемся).
+    Срок зажимается в [min_interval, max_interval], сверху добавляется случайный jitter.
+    """
+    domain = None
+    deadline = now + timedelta(seconds=max_interval)
+    for d, when in schedule.items():
+        if when < deadline:
+            deadline, domain = when, d
+
+    delay = (deadline - now).total_seconds()
+    delay = max(float(min_interval), min(float(max_interval), delay))
+    if jitter > 0:
+        delay += random.uniform(0, jitter)
+    return delay, domain
+
+def wait_for_changes(
+    watcher: InotifyWatcher,
+    wake_fd: int,
+    delay: float,
+    debounce: float,
+) -> Optional[Set[str]]:
+    """
+    Ждёт delay секунд, сигнала (wake_fd) или событий inotify.
+    Возвращает изменённые пути или None — «пора делать полную проверку»
+    (истёк срок, пришёл сигнал, переполнилась очередь inotify).
+
+    После первого события ждём, пока всё утихнет на debounce секунд
+    (но не дольше 10*debounce), чтобы замена cert+key+chain дала одну проверку.
+    """
+    deadline = time.monotonic() + delay
+    changed: Set[str] = set()
+    quiet_until = settle_until = None
+
+    while True:
+        now = time.monotonic()
+        if changed:
+            if now >= quiet_until or now >= settle_until:
+                return changed
+            timeout = min(quiet_until, settle_until) - now
+        else:
+            if now >= deadline:
+                return None
+            timeout = deadline - now
+
+        readable, _, _ = select.select([watcher.fileno(), wake_fd], [], [], timeout)
+        if wake_fd in readable:
+            try:
+                while os.read(wake_fd, 512):
+                    pass
+            except BlockingIOError:
+                pass
+            return None
+        if watcher.fileno() in readable:
+            paths, overflow = watcher.read()
+            if overflow:
+                logging.warning("inotify: очередь событий переполнена — полная проверка.")
+                return None
+            if paths:
+                now = time.monotonic()
+                if not changed:
+                    settle_until = now + debounce * 10
+                changed.update(paths)
+                quiet_until = now + debounce
+
+def run_daemon(
+    run_once: Callable[..., int],
+    min_interval: int,
+    max_interval: int,
+    jitter: int,
+    watch: bool = False,
+    debounce: float = 2.0,
+) -> int:
+    """
+    Крутит run_once по расписанию. SIGHUP — проверить прямо сейчас,
+    SIGTERM/SIGINT — аккуратно выйти.
+
+    watch=True: между проверками следим через inotify за папками, которые вернул
+    run_once(schedule, watch_dirs=...), и при изменениях вызываем
+    run_once(schedule, changed=...) только для затронутых пар.
+    """
+    wake = threading.Event()
+    stop = threading.Event()
+
+    def on_hup(_signum, _frame):
+        logging.info("Получен SIGHUP — внеплановая проверка.")
+        wake.set()
+
+    def on_stop(signum, _frame):
+        logging.info("Получен сигнал %s — завершаюсь.", signum)
+        stop.set()
+        wake.set()
+
+    signal.signal(signal.SIGHUP, on_hup)
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+
+    watcher = open_inotify() if watch else None
+    wake_r = wake_w = -1
+    if watcher:
+        # сигнал должен будить select(), а не только Event
+        wake_r, wake_w = os.pipe()
+        os.set_blocking(wake_r, False)
+        os.set_blocking(wake_w, False)
+        signal.set_wakeup_fd(wake_w)
+
+    logging.info(
+        "Daemon режим: min_interval=%ss, max_interval=%ss, jitter=%ss, inotify=%s",
+        min_interval, max_interval, jitter, "да" if watcher else "нет",
+    )
+
+    try:
+        _daemon_loop(run_once, watcher, wake_r, wake, stop, min_interval, max_interval, jitter, debounce)
+    finally:
+        if watcher:
+            signal.set_wakeup_fd(-1)
+            watcher.close()
+            os.close(wake_r)
+            os.close(wake_w)
+    return 0
+
+def _daemon_loop(run_once, watcher, wake_r, wake, stop, min_interval, max_interval, jitter, debounce) -> None:
+    schedule: Dict[str, datetime] = {}
+    changed: Optional[Set[str]] = None
+
+    while not stop.is_set():
+        if changed is None:
+            # полная проверка: расписание строим заново;
+            # после реакции на изменения — дополняем (note_next_check берёт самый ранний срок)
+            schedule = {}
+        # сбрасываем до прогона: SIGHUP/SIGTERM во время прогона не должен потеряться
+        wake.clear()
+        # набор папок строится до фильтра по changed — новые папки подхватываем сразу
+        watch_dirs: Set[str] = set()
+        rc = run_once(schedule, changed=changed, watch_dirs=watch_dirs)
+        if watcher and rc == 0:
+            watcher.sync(watch_dirs)
+        if watcher:
+            # события от записей самого прохода (.tmp-*/.bak-*, переключение ссылок, папки версий, GC)
+            # выбрасываем — иначе после каждого обновления шла бы вторая, лишняя проверка
+            watcher.read()
+        if rc != 0:
+            # ошибка — пробуем снова через минимальный интервал
+            schedule["*"] = utcnow()
+        if stop.is_set():
+            break
+
+        delay, domain = pick_next_wakeup(schedule, utcnow(), min_interval, max_interval, jitter)
+        logging.info(
+            "Следующая проверка через %s (%s).",
+            timedelta(seconds=int(delay)),
+            f"домен {domain}" if domain and domain != "*" else ("повтор после ошибки" if domain else "плановая"),
+        )
+
+        if watcher:
+            changed = wait_for_changes(watcher, wake_r, delay, debounce)
+        else:
+            changed = None
+            wake.wait(delay)
@@ -0,0 +1,131 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from utils.parsers import parse_selectel_date
+
+
+# -------------------------
+# Индекс remote сертификатов по доменам (trie по перевёрнутым меткам)
+# -------------------------
+class _Node:
+    __slots__ = ("children", "exact", "wild")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # сертификаты с именем ровно этого узла / с "*." + имя этого узла
+        self.exact: List[Tuple[dict, datetime]] = []
+        self.wild: List[Tuple[dict, datetime]] = []
+
+
+def _labels(name: str) -> List[str]:
+    return [l for l in reversed(name.split(".")) if l]
+
+
+def _norm(name: str) -> str:
+    return (name or "").strip().lower().strip(".")
+
+
+class CertDomainIndex:
+    """
+    Индекс remote сертификатов Selectel по SAN-доменам.
+
+    Поиск по имени идёт по меткам справа налево (com -> example -> api), поэтому
+    стоимость зависит от длины имени, а не от количества сертификатов.
+    Поддерживается:
+      - точное совпадение (api.example.com == api.example.com);
+      - wildcard покрывает поддомен (*.example.com покрывает api.example.com, но не example.com);
+      - wildcard против wildcard (*.example.com == *.example.com).
+    """
+
+    def __init__(self, items: Optional[List[dict]] = None):
+        self._root = _Node()
+        self.size = 0
+        for item in items or []:
+            self.add(item)
+
+    def add(self, item: dict) -> bool:
+        # дату разбираем один раз на элемент
+        exp = parse_selectel_date(item.get("expire_at") or "")
+        if not exp:
+            return False
+
+        added = False
+        for dom in item.get("domains") or []:
+            d = _norm(dom)
+            wild = d.startswith("*.")
+            if wild:
+                d = d[2:]
+            labels = _labels(d)
+            if not labels:
+                continue
+            node = self._root
+            for label in labels:
+                nxt = node.children.get(label)
+                if nxt is None:
+                    nxt = node.children[label] = _Node()
+                node = nxt
+            (node.wild if wild else node.exact).append((item, exp))
+            added = True
+
+        if added:
+            self.size += 1
+        return added
+
+    def _find(self, labels: List[str]) -> Optional[_Node]:
+        node = self._root
+        for label in labels:
+            node = node.children.get(label)
+            if node is None:
+                return None
+        return node
+
+    def covering(self, name: str) -> List[Tuple[dict, datetime]]:
+        """
+        Все remote сертификаты, которые покрывают имя name.
+        """
+        d = _norm(name)
+        if d.startswith("*."):
+            node = self._find(_labels(d[2:]))
+            return list(node.wild) if node else []
+
+        labels = _labels(d)
+        if not labels:
+            return []
+        res: List[Tuple[dict, datetime]] = []
+        node = self._find(labels)
+        if node:
+            res.extend(node.exact)
+        parent = self._find(labels[:-1]) if len(labels) > 1 else None
+        if parent:
+            res.extend(parent.wild)
+        return res
+
+    def best_match(self, names: List[str], strict: bool = False) -> Optional[Tuple[dict, datetime, List[str]]]:
+        """
+        Лучший remote сертификат для набора локальных имён (SAN):
+        сначала по числу покрытых имён, затем по самому позднему expire_at.
+        strict=True — годится только сертификат, покрывающий все имена (SAN remote ⊇ SAN local).
+
+        Возвращает (item, expire_at, непокрытые имена) или None.
+        """
+        names = list(dict.fromkeys(_norm(n) for n in names if _norm(n)))
+        covered: Dict[int, List[str]] = {}
+        entries: Dict[int, Tuple[dict, datetime]] = {}
+        for name in names:
+            for item, exp in self.covering(name):
+                k = id(item)
+                if k not in entries:
+                    entries[k] = (item, exp)
+                    covered[k] = []
+                if not covered[k] or covered[k][-1] != name:
+                    covered[k].append(name)
+
+        if not entries:
+            return None
+
+        best = max(entries, key=lambda k: (len(covered[k]), entries[k][1]))
+        item, exp = entries[best]
+        missing = [n for n in names if n not in covered[best]]
+        if strict and missing:
+            return None
+        return item, exp, missing
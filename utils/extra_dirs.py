@@ -0,0 +1,163 @@
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from utils.state import load_json_state, save_json_state
+from utils.store import OBJECTS_DIRNAME, VERSION_STAMP_RE
+
+# -------------------------
+# Поиск пар cert/key в EXTRA_CERT_DIRS (инкрементально, по снимку mtime папок)
+# -------------------------
+# Пары зависят только от ИМЁН файлов в папке, а любое добавление/удаление/переименование
+# файла или подпапки меняет mtime самой папки. Поэтому для папки с тем же (dev, ino, mtime)
+# берём из снимка её пары и список подпапок, а os.scandir делаем только для изменённых.
+
+# папки, изменённые меньше чем столько назад, в снимок как «чистые» не кладём:
+# на ФС с грубым mtime изменение в ту же секунду после скана было бы незаметно
+_RACY_NS = 2 * 1_000_000_000
+
+
+def ssl_pairs_in_dir(dirpath: str, files: Set[str]) -> List[Tuple[str, str]]:
+    """
+    Пары cert/key в одной папке:
+      - fullchain.pem + privkey.pem
+      - cert.pem + privkey.pem
+      - *.crt + *.key (одинаковый basename)
+    """
+    pairs = []
+    if "privkey.pem" in files:
+        key_path = os.path.join(dirpath, "privkey.pem")
+        for cert_name in ("fullchain.pem", "cert.pem"):
+            if cert_name in files:
+                pairs.append((os.path.join(dirpath, cert_name), key_path))
+
+    for f in sorted(files):
+        if not f.endswith(".crt"):
+            continue
+        key_name = os.path.splitext(f)[0] + ".key"
+        if key_name in files:
+            pairs.append((os.path.join(dirpath, f), os.path.join(dirpath, key_name)))
+    return pairs
+
+
+def storage_skip_dirs(cert_store_dir: str, state_dir: Optional[str] = None) -> Set[str]:
+    """
+    Собственное хранилище скрипта, в которое не спускаемся, даже если оно внутри EXTRA_CERT_DIRS.
+    """
+    skip = {os.path.realpath(os.path.join(cert_store_dir, OBJECTS_DIRNAME))}
+    skip.add(os.path.realpath(state_dir or os.path.join(cert_store_dir, ".state")))
+    return skip
+
+
+def _is_version_dir(path: str, cert_store_real: Optional[str]) -> bool:
+    # CERT_STORE_DIR/<domain>/<stamp> — папки версий (и старые настоящие, и симлинки)
+    if not cert_store_real or not VERSION_STAMP_RE.match(os.path.basename(path)):
+        return False
+    return os.path.dirname(os.path.dirname(os.path.realpath(path))) == cert_store_real
+
+
+def scan_extra_ssl_pairs(
+    extra_dirs: Iterable[str],
+    cache_path: Optional[str] = None,
+    cert_store_dir: Optional[str] = None,
+    state_dir: Optional[str] = None,
+    dirs: Optional[Set[str]] = None,
+) -> List[Tuple[str, str]]:
+    """
+    Рекурсивно ищет пары cert/key в EXTRA_CERT_DIRS для не-nginx сервисов.
+
+    С cache_path хранит снимок {папка: (dev, ino, mtime), подпапки, пары} и на следующих
+    запусках перечитывает только папки, у которых поменялся mtime.
+    В .objects/.state и папки версий CERT_STORE_DIR не заходит.
+    dirs (если передан) заполняется всеми просмотренными папками.
+
+    Возвращает список (cert_path, key_path) с абсолютными путями.
+    """
+    bases = []
+    for base in extra_dirs:
+        if not base:
+            continue
+        base = os.path.abspath(base)
+        if not os.path.isdir(base):
+            logging.warning("EXTRA_CERT_DIRS: папка не найдена/не папка: %s", base)
+            continue
+        bases.append(base)
+
+    skip: Set[str] = set()
+    cert_store_real = None
+    if cert_store_dir:
+        skip = storage_skip_dirs(cert_store_dir, state_dir)
+        cert_store_real = os.path.realpath(cert_store_dir)
+
+    state = load_json_state(cache_path) or {}
+    old: Dict[str, dict] = state.get("dirs") if isinstance(state.get("dirs"), dict) else {}
+    new: Dict[str, dict] = {}
+    racy_after = time.time_ns() - _RACY_NS
+
+    pairs: List[Tuple[str, str]] = []
+    seen = set()
+    scanned = reused = 0
+
+    stack = list(reversed(bases))
+    visited: Set[str] = set()
+    while stack:
+        dirpath = stack.pop()
+        if dirpath in visited:
+            continue
+        visited.add(dirpath)
+        if dirpath in skip or os.path.realpath(dirpath) in skip or _is_version_dir(dirpath, cert_store_real):
+            continue
+        try:
+            st = os.stat(dirpath)
+        except OSError:
+            continue
+        key = [st.st_dev, st.st_ino, st.st_mtime_ns]
+
+        entry = old.get(dirpath)
+        if entry and entry.get("key") == key:
+            reused += 1
+        else:
+            scanned += 1
+            files, subdirs = set(), []
+            try:
+                with os.scandir(dirpath) as it:
+                    for e in it:
+                        try:
+                            # как os.walk: симлинк на папку — папка (но внутрь не идём), остальное — файлы
+                            if e.is_dir():
+                                if not e.is_symlink():
+                                    subdirs.append(e.name)
+                            else:
+                                files.add(e.name)
+                        except OSError:
+                            files.add(e.name)
+            except OSError as e:
+                logging.warning("EXTRA_CERT_DIRS: не смог прочитать %s: %s", dirpath, e)
+                continue
+            entry = {
+                "key": key,
+                "subdirs": sorted(subdirs),
+                "pairs": [list(p) for p in ssl_pairs_in_dir(dirpath, files)],
+            }
+
+        if dirs is not None:
+            dirs.add(dirpath)
+        if st.st_mtime_ns < racy_after:
+            new[dirpath] = entry
+
+        for cert_path, key_path in entry["pairs"]:
+            pair = (cert_path, key_path)
+            if pair not in seen:
+                pairs.append(pair); seen.add(pair)
+        for name in reversed(entry["subdirs"]):
+            stack.append(os.path.join(dirpath, name))
+
+    logging.info(
+        "EXTRA_CERT_DIRS: папок %d (перечитано %d, из снимка %d), пар %d.",
+        scanned + reused, scanned, reused, len(pairs),
+    )
+
+    if cache_path and (scanned or len(new) != len(old)):
+        save_json_state(cache_path, {"dirs": new})
+    return pairs
@@ -0,0 +1,318 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import shutil
+import ssl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from utils.formatters import join_url
+from utils.network import get_header, http_request
+from utils.other import write_file, write_version_dir
+from utils.parsers import json_loads_safe, parse_selectel_date, split_pem_chain
+from utils.state import load_json_state, save_json_state
+from utils.store import bundle_files, bundle_fingerprint
+
+# -------------------------
+# Флот: один координатор ходит в Selectel (serve), остальные узлы берут у него (pull)
+# -------------------------
+# FLEET_PUBLISH_DIR/
+#   index.json                                — {"version", "serial", "generated_at", "bundles": [...]}
+#   <sha256 leaf>/{cert,chain,fullchain,privkey}.pem
+# Запись в bundles — как элемент списка LE Selectel (id, knox_cert_id, domains, expire_at)
+# плюс fingerprint: узел сопоставляет домены тем же CertDomainIndex и качает только
+# отпечатки, которых у него ещё нет. Каталог можно раздавать как есть (NFS, rsync, nginx)
+# или встроенным HTTP-сервером (serve --daemon с FLEET_LISTEN).
+
+FLEET_INDEX = "index.json"
+FLEET_VERSION = 1
+BUNDLE_FILES = ("cert.pem", "chain.pem", "fullchain.pem", "privkey.pem")
+_FINGERPRINT_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class FleetError(RuntimeError):
+    pass
+
+
+def _entry_ok(publish_dir: str, entry: dict) -> bool:
+    fp = entry.get("fingerprint") or ""
+    return bool(_FINGERPRINT_RE.match(fp)) and os.path.isfile(os.path.join(publish_dir, fp, "privkey.pem"))
+
+
+# -------------------------
+# Координатор: публикация
+# -------------------------
+def publish_fleet_bundles(
+    publish_dir: str,
+    items: List[dict],
+    fetch: Callable[[List[str]], Tuple[Dict[str, Tuple[List[str], str]], Dict[str, str]]],
+    dry_run: bool = False,
+) -> Tuple[int, Dict[str, str]]:
+    """
+    items — список LE Selectel. Для сертификатов, чья версия (knox_id, expire_at) ещё не
+    опубликована, качает bundle через fetch(knox_ids) и кладёт в publish_dir/<отпечаток>/,
+    затем атомарно переписывает index.json.
+
+    Не скачавшийся сертификат остаётся в индексе прежней версией.
+    Возвращает (сколько новых версий опубликовано, {knox_id: ошибка}).
+    """
+    index_path = os.path.join(publish_dir, FLEET_INDEX)
+    old = load_json_state(index_path) or {}
+    old_entries = {
+        e["knox_cert_id"]: e
+        for e in old.get("bundles") or []
+        if isinstance(e, dict) and e.get("knox_cert_id") and _entry_ok(publish_dir, e)
+    }
+
+    current = []
+    to_fetch = []
+    for it in items:
+        if not isinstance(it, dict):
+            continue
+        knox_id = it.get("knox_cert_id") or it.get("id")
+        if not knox_id or not parse_selectel_date(it.get("expire_at") or ""):
+            continue
+        current.append((knox_id, it))
+        prev = old_entries.get(knox_id)
+        if not prev or prev.get("expire_at") != it.get("expire_at"):
+            to_fetch.append(knox_id)
+
+    bundles, errors = fetch(to_fetch) if to_fetch else ({}, {})
+
+    entries = []
+    for knox_id, it in current:
+        if knox_id in bundles:
+            files = bundle_files(*bundles[knox_id])
+            fp = bundle_fingerprint(files["cert.pem"][0])
+            if dry_run:
+                logging.info("[dry-run] Опубликовал бы %s (knox_cert_id=%s)", fp, knox_id)
+            else:
+                write_version_dir(os.path.join(publish_dir, fp), files)
+            expire_at = it.get("expire_at")
+        elif knox_id in old_entries:
+            fp = old_entries[knox_id]["fingerprint"]
+            expire_at = old_entries[knox_id]["expire_at"]
+        else:
+            continue
+        entries.append({
+            "id": it.get("id"),
+            "knox_cert_id": knox_id,
+            "domains": it.get("domains") or [],
+            "expire_at": expire_at,
+            "fingerprint": fp,
+        })
+
+    if entries == old.get("bundles"):
+        logging.info("Флот: опубликованные версии не изменились (serial=%s).", old.get("serial"))
+        return 0, errors
+    if dry_run:
+        logging.info("[dry-run] Переписал бы %s: сертификатов %d", index_path, len(entries))
+        return len(bundles), errors
+
+    serial = int(old.get("serial") or 0) + 1
+    write_file(index_path, json.dumps({
+        "version": FLEET_VERSION,
+        "serial": serial,
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "bundles": entries,
+    }, ensure_ascii=False, indent=2), 0o644)
+    logging.info("Флот: опубликован index.json serial=%d (сертификатов %d, новых версий %d)", serial, len(entries), len(bundles))
+
+    # прошлое поколение оставляем: узел мог прочитать старый index.json и ещё не докачать
+    keep = {e["fingerprint"] for e in entries}
+    keep.update(e["fingerprint"] for e in old_entries.values())
+    prune_fleet_objects(publish_dir, keep)
+    return len(bundles), errors
+
+def prune_fleet_objects(publish_dir: str, keep: Set[str]) -> None:
+    try:
+        names = os.listdir(publish_dir)
+    except OSError:
+        return
+    for name in names:
+        if _FINGERPRINT_RE.match(name) and name not in keep:
+            logging.info("Флот: удаляю неопубликованную версию %s", name)
+            shutil.rmtree(os.path.join(publish_dir, name), ignore_errors=True)
+
+
+# -------------------------
+# Координатор: раздача по HTTP
+# -------------------------
+def start_fleet_server(
+    publish_dir: str,
+    listen: str,
+    token: str,
+    tls_cert: Optional[str] = None,
+    tls_key: Optional[str] = None,
+) -> ThreadingHTTPServer:
+    """
+    Отдаёт publish_dir по HTTP(S) в фоне: GET /index.json (ETag/304) и GET /<отпечаток>/<файл>.
+    Только с Authorization: Bearer <token> — в каталоге приватные ключи.
+    """
+    if not token:
+        raise FleetError("FLEET_LISTEN задан, а FLEET_TOKEN пустой — ключи без авторизации не раздаю")
+    host, _, port = listen.rpartition(":")
+    expected = ("Bearer " + token).encode("utf-8")
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            logging.debug("Флот HTTP %s: " + fmt, self.client_address[0], *args)
+
+        def _send(self, code: int, body: bytes = b"", headers: Optional[Dict[str, str]] = None):
+            self.send_response(code)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def do_GET(self):
+            if not hmac.compare_digest(self.headers.get("Authorization", "").encode("utf-8"), expected):
+                return self._send(401, b"unauthorized\n")
+            parts = self.path.split("?", 1)[0].strip("/").split("/")
+            if parts == [FLEET_INDEX]:
+                path = os.path.join(publish_dir, FLEET_INDEX)
+                ctype = "application/json"
+            elif len(parts) == 2 and _FINGERPRINT_RE.match(parts[0]) and parts[1] in BUNDLE_FILES:
+                path = os.path.join(publish_dir, parts[0], parts[1])
+                ctype = "application/x-pem-file"
+            else:
+                return self._send(404, b"not found\n")
+            try:
+                with open(path, "rb") as f:
+                    body = f.read()
+            except OSError:
+                return self._send(404, b"not found\n")
+
+            etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+            if self.headers.get("If-None-Match") == etag:
+                return self._send(304, headers={"ETag": etag})
+            self._send(200, body, {"Content-Type": ctype, "ETag": etag, "Cache-Control": "no-cache"})
+
+        do_HEAD = do_GET
+
+    httpd = ThreadingHTTPServer((host or "0.0.0.0", int(port)), Handler)
+    httpd.daemon_threads = True
+    scheme = "http"
+    if tls_cert:
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(tls_cert, tls_key or None)
+        httpd.socket = ctx.wrap_socket(httpd.socket, server_side=True)
+        scheme = "https"
+    threading.Thread(target=httpd.serve_forever, name="fleet-http", daemon=True).start()
+    logging.info("Флот: раздаю %s на %s://%s", publish_dir, scheme, listen)
+    return httpd
+
+
+# -------------------------
+# Узел: чтение индекса и bundle (каталог или URL)
+# -------------------------
+def _is_url(source: str) -> bool:
+    return source.startswith(("http://", "https://"))
+
+def _read_source(
+    source: str,
+    name: str,
+    timeout: int,
+    token: Optional[str],
+    headers: Optional[Dict[str, str]] = None,
+) -> Tuple[int, Dict[str, str], bytes]:
+    if not _is_url(source):
+        try:
+            with open(os.path.join(source, name), "rb") as f:
+                return 200, {}, f.read()
+        except FileNotFoundError:
+            return 404, {}, b""
+        except OSError as e:
+            raise FleetError(f"{source}/{name}: {e}") from e
+
+    req_headers = dict(headers or {})
+    if token:
+        req_headers["Authorization"] = "Bearer " + token
+    url = join_url(source, name)
+    status, resp_headers, body = http_request("GET", url, headers=req_headers, timeout=timeout)
+    if status in (401, 403):
+        raise FleetError(f"GET {url} -> HTTP {status}: проверьте FLEET_TOKEN")
+    return status, resp_headers, body
+
+def fetch_fleet_index(
+    source: str,
+    timeout: int,
+    token: Optional[str] = None,
+    cache_path: Optional[str] = None,
+) -> List[dict]:
+    """
+    Индекс координатора -> элементы в формате списка LE + fingerprint.
+    По HTTP — условный GET по ETag из cache_path.
+    """
+    state = load_json_state(cache_path) or {}
+    has_cache = state.get("source") == source and isinstance(state.get("items"), list)
+    headers = {"If-None-Match": state["etag"]} if has_cache and state.get("etag") else {}
+
+    status, resp_headers, body = _read_source(source, FLEET_INDEX, timeout, token, headers)
+    if status == 304 and has_cache:
+        logging.info("Флот: index.json не изменился (HTTP 304, serial=%s).", state.get("serial"))
+        return state["items"]
+    if status != 200:
+        raise FleetError(f"Не удалось получить {FLEET_INDEX} из {source}: HTTP {status}")
+
+    index = json_loads_safe(body)
+    if not isinstance(index, dict) or index.get("version") != FLEET_VERSION or not isinstance(index.get("bundles"), list):
+        raise FleetError(f"Неподдерживаемый {FLEET_INDEX} в {source}")
+    items = [e for e in index["bundles"] if isinstance(e, dict) and _FINGERPRINT_RE.match(e.get("fingerprint") or "")]
+    logging.info("Флот: index.json serial=%s от %s, сертификатов %d", index.get("serial"), index.get("generated_at"), len(items))
+
+    if _is_url(source):
+        etag = get_header(resp_headers, "ETag")
+        save_json_state(cache_path, {"source": source, "etag": etag, "serial": index.get("serial"), "items": items})
+    return items
+
+def fetch_fleet_bundle(source: str, fingerprint: str, timeout: int, token: Optional[str] = None) -> Tuple[List[str], str]:
+    """
+    (цепочка, ключ) по отпечатку; цепочка проверяется по отпечатку leaf.
+    """
+    out = {}
+    for name in ("fullchain.pem", "privkey.pem"):
+        status, _headers, body = _read_source(source, f"{fingerprint}/{name}", timeout, token)
+        if status != 200:
+            raise FleetError(f"{fingerprint}/{name}: HTTP {status}")
+        out[name] = body.decode("utf-8", errors="replace")
+
+    certs = split_pem_chain(out["fullchain.pem"])
+    if not certs or bundle_fingerprint(certs[0]) != fingerprint:
+        raise FleetError(f"{fingerprint}: отпечаток leaf не совпадает с опубликованным")
+    if "PRIVATE KEY" not in out["privkey.pem"]:
+        raise FleetError(f"{fingerprint}: в privkey.pem нет приватного ключа")
+    return certs, out["privkey.pem"]
+
+def download_fleet_bundles(
+    source: str,
+    wanted: Dict[str, str],
+    timeout: int,
+    token: Optional[str] = None,
+    concurrency: int = 8,
+) -> Tuple[Dict[str, Tuple[List[str], str]], Dict[str, str]]:
+    """
+    wanted: {knox_id: отпечаток}. Формат результата — как у download_selectel_cert_bundles.
+    """
+    bundles: Dict[str, Tuple[List[str], str]] = {}
+    errors: Dict[str, str] = {}
+    if not wanted:
+        return bundles, errors
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="fleet") as pool:
+        futures = {k: pool.submit(fetch_fleet_bundle, source, fp, timeout, token) for k, fp in wanted.items()}
+        for knox_id, fut in futures.items():
+            try:
+                bundles[knox_id] = fut.result()
+            except Exception as e:
+                errors[knox_id] = str(e)
+    return bundles, errors
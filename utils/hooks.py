@@ -0,0 +1,244 @@
+import logging
+import math
+import os
+import re
+import shlex
+import signal
+import socket
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.other import path_allowed, read_pidfile
+from utils.state import load_json_state, save_json_state
+
+# -------------------------
+# Хуки после обновления сертификатов (для не-nginx сервисов)
+# -------------------------
+# В .env, по сервису (NAME — любое имя, по нему хуки склеиваются и попадают в отчёт):
+#   HOOK_<NAME>_DIRS=/etc/haproxy/certs,/etc/haproxy/extra   — для пар в этих папках
+#   HOOK_<NAME>_COMMAND=systemctl reload haproxy               — команда (без shell)
+#   HOOK_<NAME>_PIDFILE=/run/postfix/master.pid + HOOK_<NAME>_SIGNAL=HUP — сигнал процессу
+#   HOOK_<NAME>_PROCESS=master  — имя процесса (/proc/<pid>/comm), по умолчанию — имя pid-файла
+#   HOOK_<NAME>_SOCKET=/run/app/admin.sock + HOOK_<NAME>_MESSAGE=reload  — строка в unix-сокет
+#   HOOK_<NAME>_TIMEOUT=30                                     — по умолчанию HOOKS_TIMEOUT_SECONDS
+
+_HOOK_VAR_RE = re.compile(r"^HOOK_([A-Za-z0-9_]+?)_DIRS$")
+
+
+class PostUpdateHook:
+    __slots__ = ("name", "dirs", "command", "pidfile", "process", "signal", "socket", "message", "timeout")
+
+    def __init__(self, name: str, dirs: List[str], timeout: float):
+        self.name = name
+        self.dirs = dirs
+        self.command: Optional[List[str]] = None
+        self.pidfile: Optional[str] = None
+        self.process = ""
+        self.signal = signal.SIGHUP
+        self.socket: Optional[str] = None
+        self.message = "reload"
+        self.timeout = timeout
+
+    @property
+    def kind(self) -> str:
+        if self.command:
+            return "command"
+        if self.pidfile:
+            return "signal"
+        return "socket"
+
+    def __repr__(self) -> str:
+        return f"PostUpdateHook({self.name}, {self.kind}, dirs={self.dirs})"
+
+
+def _parse_timeout(value: str) -> Optional[float]:
+    try:
+        timeout = float(value)
+    except ValueError:
+        return None
+    return timeout if timeout > 0 and math.isfinite(timeout) else None
+
+def load_post_update_hooks(env: Dict[str, str], default_timeout: float = 30.0) -> List[PostUpdateHook]:
+    """
+    Собирает хуки из HOOK_<NAME>_* переменных. Хук без действия или с кривыми настройками —
+    ошибка в лог и пропуск (остальной прогон не падает).
+    """
+    hooks: List[PostUpdateHook] = []
+    if env.get("HOOKS_TIMEOUT_SECONDS"):
+        common = _parse_timeout(env["HOOKS_TIMEOUT_SECONDS"])
+        if common is None:
+            logging.error(
+                "HOOKS_TIMEOUT_SECONDS=%r — не положительное число секунд, беру %.0f с",
+                env["HOOKS_TIMEOUT_SECONDS"], default_timeout,
+            )
+        else:
+            default_timeout = common
+    for var in sorted(env):
+        m = _HOOK_VAR_RE.match(var)
+        if not m:
+            continue
+        name = m.group(1)
+        prefix = f"HOOK_{name}_"
+        dirs = [d.strip() for d in env[var].split(",") if d.strip()]
+        timeout: Optional[float] = default_timeout
+        if env.get(prefix + "TIMEOUT"):
+            timeout = _parse_timeout(env[prefix + "TIMEOUT"])
+            if timeout is None:
+                logging.error(
+                    "Хук %s: %sTIMEOUT=%r — не положительное число секунд (пропускаю хук)",
+                    name.lower(), prefix, env[prefix + "TIMEOUT"],
+                )
+                continue
+        hook = PostUpdateHook(name.lower(), dirs, timeout)
+
+        if env.get(prefix + "COMMAND"):
+            try:
+                hook.command = shlex.split(env[prefix + "COMMAND"])
+            except ValueError as e:
+                logging.warning("Хук %s: не разобрал COMMAND (%s) — пропускаю хук", hook.name, e)
+                continue
+        elif env.get(prefix + "PIDFILE"):
+            hook.pidfile = env[prefix + "PIDFILE"]
+            # /var/spool/postfix/pid/master.pid -> master
+            hook.process = env.get(prefix + "PROCESS") or os.path.basename(hook.pidfile).split(".")[0]
+            sig = (env.get(prefix + "SIGNAL") or "HUP").strip().upper()
+            try:
+                hook.signal = signal.Signals[sig if sig.startswith("SIG") else "SIG" + sig]
+            except KeyError:
+                logging.warning("Хук %s: неизвестный сигнал %s (пропускаю хук)", hook.name, sig)
+                continue
+        elif env.get(prefix + "SOCKET"):
+            hook.socket = env[prefix + "SOCKET"]
+            hook.message = env.get(prefix + "MESSAGE") or hook.message
+        else:
+            logging.warning("Хук %s: не задан ни COMMAND, ни PIDFILE, ни SOCKET (пропускаю)", hook.name)
+            continue
+
+        if not dirs:
+            logging.warning("Хук %s: пустой список папок (пропускаю)", hook.name)
+            continue
+        hooks.append(hook)
+    return hooks
+
+def hooks_for_paths(hooks: List[PostUpdateHook], paths: Iterable[str]) -> List[PostUpdateHook]:
+    """
+    Хуки, под папки которых попал хотя бы один путь; каждый сервис — один раз,
+    сколько бы его пар ни обновилось.
+    """
+    paths = list(paths)
+    res: List[PostUpdateHook] = []
+    seen = set()
+    for h in hooks:
+        if not any(path_allowed(p, h.dirs) for p in paths):
+            continue
+        # одинаковое действие под разными именами тоже выполняем один раз
+        key = (h.kind, tuple(h.command or ()), h.pidfile, h.signal, h.socket, h.message)
+        if key in seen:
+            continue
+        seen.add(key)
+        res.append(h)
+    return res
+
+
+def _run_command(hook: PostUpdateHook) -> str:
+    try:
+        p = subprocess.run(
+            hook.command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=hook.timeout,
+        )
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"таймаут {hook.timeout:g} с")
+    except OSError as e:
+        raise RuntimeError(str(e))
+    if p.returncode != 0:
+        raise RuntimeError(f"rc={p.returncode}: {(p.stdout or '').strip()[:500]}")
+    return "rc=0"
+
+def _send_signal(hook: PostUpdateHook) -> str:
+    try:
+        pid, comm = read_pidfile(hook.pidfile)
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f"pid-файл {hook.pidfile}: {e}")
+    # comm обрезан ядром до 15 символов
+    if not comm.startswith(hook.process[:15]):
+        raise RuntimeError(
+            f"pid {pid} из {hook.pidfile} — не {hook.process} ({comm}), сигнал не отправлен "
+            f"(имя процесса задаётся HOOK_<NAME>_PROCESS)"
+        )
+    try:
+        os.kill(pid, hook.signal)
+    except OSError as e:
+        raise RuntimeError(f"kill -{hook.signal.name} {pid}: {e}")
+    return f"{hook.signal.name} -> pid {pid}"
+
+def _write_socket(hook: PostUpdateHook) -> str:
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(hook.timeout)
+    try:
+        s.connect(hook.socket)
+        s.sendall(hook.message.encode("utf-8") + b"\n")
+        s.shutdown(socket.SHUT_WR)
+        # ответ не обязателен; если сервис что-то ответил — покажем первую строку
+        try:
+            reply = s.recv(4096).decode("utf-8", "replace").strip().splitlines()
+        except socket.timeout:
+            reply = []
+    except OSError as e:
+        raise RuntimeError(f"{hook.socket}: {e}")
+    finally:
+        s.close()
+    return f"ответ: {reply[0][:200]}" if reply else "отправлено"
+
+_ACTIONS = {"command": _run_command, "signal": _send_signal, "socket": _write_socket}
+
+
+def run_post_update_hooks(
+    hooks: List[PostUpdateHook],
+    dry_run: bool,
+    concurrency: int = 16,
+) -> Dict[str, Tuple[bool, str]]:
+    """
+    Запускает хуки параллельно (каждый со своим таймаутом) и логирует итог по каждому.
+    Возвращает {имя хука: (успех, подробности)}.
+    """
+    results: Dict[str, Tuple[bool, str]] = {}
+    if not hooks:
+        return results
+
+    def run(hook: PostUpdateHook) -> Tuple[bool, str]:
+        if dry_run:
+            return True, f"[dry-run] {hook.kind}"
+        started = time.monotonic()
+        try:
+            detail = _ACTIONS[hook.kind](hook)
+            ok = True
+        except RuntimeError as e:
+            detail, ok = str(e), False
+        return ok, f"{detail} ({time.monotonic() - started:.1f} с)"
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(hooks))), thread_name_prefix="hook") as pool:
+        for hook, res in zip(hooks, pool.map(run, hooks)):
+            results[hook.name] = res
+
+    for name, (ok, detail) in results.items():
+        if ok:
+            logging.info("Хук %s: ок, %s", name, detail)
+        else:
+            logging.error("Хук %s: ошибка, %s", name, detail)
+    return results
+
+
+# -------------------------
+# Несработавшие хуки — повторить при следующем запуске
+# -------------------------
+def load_pending_hooks(path: Optional[str]) -> List[str]:
+    state = load_json_state(path) or {}
+    return [n for n in state.get("pending") or [] if isinstance(n, str)]
+
+def save_pending_hooks(path: Optional[str], names: List[str]) -> None:
+    if not path:
+        return
+    if not names and not os.path.exists(path):
+        return
+    save_json_state(path, {"pending": sorted(set(names))})
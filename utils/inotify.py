@@ -0,0 +1,147 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+import sys
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+# -------------------------
+# Linux inotify через ctypes (для --daemon)
+# -------------------------
+# Следим за ПАПКАМИ, а не за файлами: мы (и certbot/операторы) меняем файлы через
+# rename/замену симлинка, а watch на сам файл после такой замены теряется.
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class InotifyWatcher:
+    """
+    Набор inotify watch'ей на папки. read() отдаёт пути, которые поменялись.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._add.restype = ctypes.c_int
+        self._rm = libc.inotify_rm_watch
+        self._rm.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._rm.restype = ctypes.c_int
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.fd = fd
+        self._wd_to_dir: Dict[int, str] = {}
+        self._dir_to_wd: Dict[str, int] = {}
+        self._limit_warned = False
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def sync(self, dirs: Iterable[str]) -> None:
+        """
+        Приводит набор watch'ей к dirs: новые добавляет, лишние снимает.
+        """
+        want = set(os.path.abspath(d) for d in dirs if d)
+        for d in list(self._dir_to_wd):
+            if d not in want:
+                wd = self._dir_to_wd.pop(d)
+                self._wd_to_dir.pop(wd, None)
+                self._rm(self.fd, wd)
+
+        for d in sorted(want - set(self._dir_to_wd)):
+            wd = self._add(self.fd, os.fsencode(d), WATCH_MASK)
+            if wd < 0:
+                e = ctypes.get_errno()
+                if e == errno.ENOSPC and not self._limit_warned:
+                    logging.warning(
+                        "inotify: упёрся в fs.inotify.max_user_watches (%d папок под наблюдением), "
+                        "остальные проверяются только по расписанию.", len(self._dir_to_wd),
+                    )
+                    self._limit_warned = True
+                elif e not in (errno.ENOENT, errno.ENOTDIR, errno.ENOSPC):
+                    logging.debug("inotify: не смог следить за %s: %s", d, os.strerror(e))
+                continue
+            self._wd_to_dir[wd] = d
+            self._dir_to_wd[d] = wd
+
+        logging.debug("inotify: под наблюдением %d папок", len(self._dir_to_wd))
+
+    def read(self) -> Tuple[Set[str], bool]:
+        """
+        Вычитывает накопившиеся события.
+        Возвращает (изменённые пути, переполнилась ли очередь — тогда нужна полная проверка).
+        """
+        changed: Set[str] = set()
+        overflow = False
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not buf:
+                break
+
+            off = 0
+            while off + _EVENT.size <= len(buf):
+                wd, mask, _cookie, length = _EVENT.unpack_from(buf, off)
+                name = buf[off + _EVENT.size: off + _EVENT.size + length].rstrip(b"\0")
+                off += _EVENT.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                d = self._wd_to_dir.get(wd)
+                if d is None:
+                    continue
+                if mask & IN_IGNORED:
+                    # папку удалили/размонтировали — watch снят ядром
+                    self._wd_to_dir.pop(wd, None)
+                    self._dir_to_wd.pop(d, None)
+                changed.add(os.path.join(d, os.fsdecode(name)) if name else d)
+        return changed, overflow
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        self._wd_to_dir.clear()
+        self._dir_to_wd.clear()
+
+
+def open_inotify() -> Optional[InotifyWatcher]:
+    """
+    InotifyWatcher или None, если inotify недоступен (не Linux, нет libc и т.п.).
+    """
+    if not sys.platform.startswith("linux"):
+        logging.warning("inotify доступен только в Linux — работаю только по расписанию.")
+        return None
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError) as e:
+        logging.warning("inotify недоступен (%s) — работаю только по расписанию.", e)
+        return None
@@ -0,0 +1,58 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from utils.nginx import infer_domain_from_path
+from utils.openssl import get_cert_not_after, get_cert_san_domains
+from utils.parsers import infer_domain_from_cert
+
+
+# -------------------------
+# Осмотр локальных пар (параллельно)
+# -------------------------
+def inspect_ssl_pair(cert_path: str, key_path: str) -> Dict[str, object]:
+    """
+    Всё, что про пару можно узнать без Selectel: существование файлов, notAfter, SAN, домен.
+
+    {"cert", "key", "error", "local_exp", "san", "domen"}; при error остальное может быть None.
+    """
+    res: Dict[str, object] = {
+        "cert": cert_path, "key": key_path, "error": None,
+        "local_exp": None, "san": [], "domen": None,
+    }
+    if not os.path.exists(cert_path):
+        res["error"] = f"cert_path не существует: {cert_path} (пропускаю)"
+        return res
+    if not os.path.exists(key_path):
+        res["error"] = f"key_path не существует: {key_path} (пропускаю)"
+        return res
+
+    res["local_exp"] = get_cert_not_after(cert_path)
+    if not res["local_exp"]:
+        res["error"] = f"Не смог определить срок действия локального сертификата: {cert_path}"
+        return res
+
+    res["domen"] = infer_domain_from_cert(cert_path) or infer_domain_from_path(cert_path)
+    if not res["domen"]:
+        res["error"] = f"Не смог определить домен для сертификата: {cert_path} (пропускаю)"
+        return res
+
+    res["san"] = get_cert_san_domains(cert_path)
+    return res
+
+def inspect_ssl_pairs(pairs: List[Tuple[str, str]], workers: Optional[int] = None) -> List[Dict[str, object]]:
+    """
+    inspect_ssl_pair для всех пар в пуле потоков (по умолчанию — по числу ядер).
+    Порядок результата совпадает с порядком pairs.
+
+    Потоки, а не процессы: кэш метаданных сертификатов общий, а fallback на openssl
+    (fork/exec) и чтение файлов отпускают GIL.
+    """
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pairs) or 1))
+    if workers == 1:
+        return [inspect_ssl_pair(c, k) for c, k in pairs]
+
+    logging.debug("Осмотр локальных пар: %d шт. в %d потоков", len(pairs), workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inspect") as pool:
+        return list(pool.map(lambda p: inspect_ssl_pair(*p), pairs))
@@ -1,15 +1,15 @@
 
 import logging
 import sys
-from typing import Optional, List
+from typing import Optional, List, TextIO
 
 
 # -------------------------
 # Logging
 # -------------------------
-def setup_logging(level: str, log_file: Optional[str] = None) -> None:
+def setup_logging(level: str, log_file: Optional[str] = None, stream: TextIO = sys.stdout) -> None:
     lvl = getattr(logging, level.upper(), logging.INFO)
-    handlers: List[logging.Handler] = [logging.StreamHandler(sys.stdout)]
+    handlers: List[logging.Handler] = [logging.StreamHandler(stream)]
     if log_file:
         handlers.append(logging.FileHandler(log_file))
     logging.basicConfig(
@@ -0,0 +1,214 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, Optional, Tuple
+
+from utils.other import write_file
+from utils.state import load_json_state, save_json_state
+
+# -------------------------
+# Метрики прогона: длительность этапов, HTTP/команды, счётчики; JSON-итог и textfile для node_exporter
+# -------------------------
+# span("этап") — время этапа main; http_request и run_cmd отмечаются сами.
+# В конце прогона finish_run(): строка run_summary {...} в лог и (если задан METRICS_TEXTFILE)
+# файл для textfile-коллектора node_exporter. Счётчики *_total копятся между запусками в state_path.
+
+PREFIX = "selectel_ssl_"
+
+# вид span -> имя метки в textfile
+_SPAN_LABELS = {"phase": "phase", "http": "endpoint", "cmd": "cmd"}
+
+# сегменты пути с цифрами длиннее 3 символов — id (uuid сертификата и т.п.), а не часть маршрута
+_ID_SEGMENT_RE = re.compile(r"^(?=.*\d).{4,}$")
+
+
+def endpoint_label(method: str, path: str) -> str:
+    """
+    "GET", "/cm/cert/6f1c.../private_key" -> "GET /cm/cert/:id/private_key" (без id — не раздуваем метки).
+    """
+    segs = [":id" if _ID_SEGMENT_RE.match(s) else s for s in path.split("?", 1)[0].split("/")]
+    return f"{method.upper()} {'/'.join(segs) or '/'}"
+
+
+class RunMetrics:
+    def __init__(self, textfile: Optional[str] = None, state_path: Optional[str] = None, summary: bool = True):
+        self.textfile = textfile
+        self.state_path = state_path
+        self.summary = summary
+        self._lock = threading.Lock()
+
+        state = load_json_state(state_path) or {}
+        # (имя, метки) -> значение; метки — отсортированный tuple пар, в JSON — список
+        self.totals: Counter = Counter()
+        for name, labels, value in state.get("totals") or []:
+            self.totals[(name, tuple(tuple(p) for p in labels))] = value
+        # путь сертификата -> (домен, notAfter epoch); в textfile — минимум по домену
+        self.expiry: Dict[str, Tuple[str, float]] = {}
+        for path, v in (state.get("expiry") or {}).items():
+            if isinstance(v, list) and len(v) == 2:
+                self.expiry[path] = (str(v[0]), float(v[1]))
+
+        self.started = time.monotonic()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.spans: Dict[Tuple[str, str], list] = {}  # (вид, имя) -> [count, seconds]
+        self.counters: Counter = Counter()
+        self.run_expiry: Dict[str, Tuple[str, float]] = {}
+        self._phase: Optional[Tuple[str, float]] = None
+
+    def begin_run(self) -> None:
+        # то, что случилось между прогонами (reload таймером в daemon), попадёт в этот прогон
+        with self._lock:
+            self.started = time.monotonic()
+
+    def start_phase(self, name: Optional[str]) -> None:
+        """
+        Закрыть текущий этап и начать name (None — просто закрыть): этапы main идут друг за другом.
+        """
+        now = time.monotonic()
+        prev, self._phase = self._phase, ((name, now) if name else None)
+        if prev:
+            self.add_span("phase", prev[0], now - prev[1])
+
+    def add_span(self, kind: str, name: str, seconds: float) -> None:
+        with self._lock:
+            s = self.spans.setdefault((kind, name), [0, 0.0])
+            s[0] += 1
+            s[1] += seconds
+
+    def inc(self, name: str, n: int = 1, **labels: str) -> None:
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += n
+
+    def note_expiry(self, cert_path: str, domain: str, not_after: datetime) -> None:
+        # not_after — naive UTC, как всё в скрипте; повторная отметка пути (после обновления) заменяет прежнюю
+        ts = (not_after - datetime(1970, 1, 1)).total_seconds()
+        with self._lock:
+            self.run_expiry[cert_path] = (domain, ts)
+
+    def finish_run(self, rc: int, full: bool = True) -> dict:
+        """
+        full=False (частичный прогон по inotify, apply по плану) — сроки доменов, которых
+        не видели, остаются с прошлого раза; full=True — список доменов заменяется целиком.
+        Возвращает итог прогона (он же строка run_summary в логе).
+        """
+        self.start_phase(None)
+        with self._lock:
+            duration = time.monotonic() - self.started
+            if full:
+                self.expiry = dict(self.run_expiry)
+            else:
+                self.expiry.update(self.run_expiry)
+            self.totals.update(self.counters)
+            self.totals[("runs", (("result", "ok" if rc == 0 else "error"),))] += 1
+            summary = self._summary(rc, duration)
+            textfile = self._textfile(rc, duration) if self.textfile else None
+            state = {
+                "totals": [[name, [list(p) for p in labels], v] for (name, labels), v in sorted(self.totals.items())],
+                "expiry": {path: list(v) for path, v in self.expiry.items()},
+            }
+            self._reset()
+
+        if self.summary:
+            logging.info("run_summary %s", json.dumps(summary, ensure_ascii=False, sort_keys=True))
+        save_json_state(self.state_path, state)
+        if textfile is not None:
+            try:
+                write_file(self.textfile, textfile, 0o644)
+            except OSError as e:
+                logging.warning("Не смог записать метрики в %s: %s", self.textfile, e)
+        return summary
+
+    def _summary(self, rc: int, duration: float) -> dict:
+        # под self._lock
+        spans: Dict[str, dict] = {}
+        for (kind, name), (count, seconds) in sorted(self.spans.items()):
+            spans.setdefault(kind, {})[name] = {"count": count, "seconds": round(seconds, 4)}
+        counters: Dict[str, int] = {}
+        for (name, labels), v in sorted(self.counters.items()):
+            key = name + "".join(f" {k}={val}" for k, val in labels)
+            counters[key] = v
+        return {"rc": rc, "duration_s": round(duration, 4), "spans": spans, "counters": counters}
+
+    def _textfile(self, rc: int, duration: float) -> str:
+        # под self._lock
+        out = []
+
+        def metric(name: str, kind: str, help_: str, samples):
+            out.append(f"# HELP {PREFIX}{name} {help_}")
+            out.append(f"# TYPE {PREFIX}{name} {kind}")
+            for labels, value in samples:
+                lbl = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels)
+                val = str(value) if isinstance(value, int) else repr(float(value))
+                out.append(f"{PREFIX}{name}{{{lbl}}} {val}" if lbl else f"{PREFIX}{name} {val}")
+
+        metric("last_run_timestamp_seconds", "gauge", "Время окончания последнего прогона.", [((), time.time())])
+        metric("last_run_success", "gauge", "1 — последний прогон без ошибок.", [((), 1 if rc == 0 else 0)])
+        metric("last_run_duration_seconds", "gauge", "Длительность последнего прогона.", [((), duration)])
+        for kind in sorted({k for k, _ in self.spans}):
+            label = _SPAN_LABELS.get(kind, kind)
+            metric(
+                f"{kind}_duration_seconds", "gauge", f"Суммарное время ({kind}) в последнем прогоне.",
+                [(((label, name),), s[1]) for (k, name), s in sorted(self.spans.items()) if k == kind],
+            )
+            metric(
+                f"{kind}_calls", "gauge", f"Число вызовов ({kind}) в последнем прогоне.",
+                [(((label, name),), s[0]) for (k, name), s in sorted(self.spans.items()) if k == kind],
+            )
+        for name in sorted({n for n, _ in self.totals}):
+            metric(
+                f"{name}_total", "counter", f"Счётчик {name} (копится между запусками).",
+                [(labels, v) for (n, labels), v in sorted(self.totals.items()) if n == name],
+            )
+        earliest: Dict[str, float] = {}
+        for domain, ts in self.expiry.values():
+            earliest[domain] = min(ts, earliest.get(domain, ts))
+        now = time.time()
+        metric(
+            "cert_days_until_expiry", "gauge", "Дней до истечения самого раннего локального сертификата домена.",
+            [((("domain", d),), round((ts - now) / 86400, 3)) for d, ts in sorted(earliest.items())],
+        )
+        return "\n".join(out) + "\n"
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_METRICS: Optional[RunMetrics] = None
+
+
+def init_metrics(textfile: Optional[str] = None, state_path: Optional[str] = None, summary: bool = True) -> RunMetrics:
+    global _METRICS
+    _METRICS = RunMetrics(textfile, state_path, summary)
+    return _METRICS
+
+@contextmanager
+def span(name: str, kind: str = "phase") -> Iterator[None]:
+    # без init_metrics — ничего не считаем
+    if _METRICS is None:
+        yield
+        return
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        _METRICS.add_span(kind, name, time.monotonic() - started)
+
+def start_phase(name: Optional[str]) -> None:
+    if _METRICS is not None:
+        _METRICS.start_phase(name)
+
+def inc_metric(name: str, n: int = 1, **labels: str) -> None:
+    if _METRICS is not None and n:
+        _METRICS.inc(name, n, **labels)
+
+def note_cert_expiry(cert_path: str, domain: str, not_after: datetime) -> None:
+    if _METRICS is not None:
+        _METRICS.note_expiry(cert_path, domain, not_after)
@@ -1,7 +1,214 @@
+import email.utils
+import http.client
+import logging
+import random
+import ssl
+import threading
+import time
 import urllib.error
+import urllib.parse
 import urllib.request
 
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, Tuple
+
+from utils.metrics import endpoint_label, inc_metric, span
+
+MAX_REDIRECTS = 5
+USER_AGENT = "selectel-wildcard-ssl-autoupdate"
+
+# ошибки, после которых keep-alive соединение можно молча переоткрыть:
+# сервер закрыл его между запросами
+_STALE_CONN_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+# -------------------------
+# Пул keep-alive соединений
+# -------------------------
+class ConnectionPool:
+    """
+    Держит свободные соединения по ключу (scheme, host, port).
+    Соединение выдаётся одному потоку за раз; при последовательной работе
+    на каждый хост живёт ровно одно соединение.
+    """
+
+    def __init__(self):
+        self._idle: Dict[Tuple[str, str, int], List[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+        self._ssl_ctx: Optional[ssl.SSLContext] = None
+
+    def acquire(self, key: Tuple[str, str, int], timeout: float) -> Tuple[http.client.HTTPConnection, bool]:
+        """
+        Возвращает (conn, reused).
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+            if conn is None and key[0] == "https" and self._ssl_ctx is None:
+                self._ssl_ctx = ssl.create_default_context()
+
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=timeout, context=self._ssl_ctx), False
+        return http.client.HTTPConnection(host, port, timeout=timeout), False
+
+    def release(self, key: Tuple[str, str, int], conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            conns = [c for lst in self._idle.values() for c in lst]
+            self._idle.clear()
+        for c in conns:
+            try:
+                c.close()
+            except Exception:
+                pass
+
+
+_POOL = ConnectionPool()
+
+
+def close_http_pool() -> None:
+    _POOL.close()
+
+
+# -------------------------
+# Повторы с backoff, Retry-After, circuit breaker по хосту и дедлайн прогона
+# -------------------------
+# Повторяем сетевые ошибки и 429/5xx: пауза — случайная в [0, min(max_backoff, backoff * 2^n)],
+# на 429/503 — сколько просит Retry-After. Хост, который подряд threshold раз упал
+# (сеть или 5xx), cooldown секунд не дёргаем вовсе — сразу ошибка, без ожидания HTTP_TIMEOUT;
+# потом пропускаем один пробный запрос. Весь прогон укладывается в run_deadline секунд.
+# Повторять можно и POST: единственный POST — выпуск IAM-токена.
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_AFTER_STATUSES = (429, 503)
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        run_deadline: float = 0.0,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 60.0,
+    ):
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.run_deadline = run_deadline
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._lock = threading.Lock()
+        self._deadline: Optional[float] = None
+        # хост -> [ошибок подряд, открыт до (monotonic), пробный запрос уже идёт]
+        self._hosts: Dict[str, list] = {}
+
+    def begin_run(self) -> None:
+        with self._lock:
+            self._deadline = time.monotonic() + self.run_deadline if self.run_deadline > 0 else None
+
+    def remaining(self) -> Optional[float]:
+        # None — дедлайна нет
+        deadline = self._deadline
+        return None if deadline is None else deadline - time.monotonic()
+
+    def delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def allow(self, host: str) -> bool:
+        if self.breaker_threshold <= 0:
+            return True
+        with self._lock:
+            st = self._hosts.get(host)
+            if not st or st[0] < self.breaker_threshold:
+                return True
+            if time.monotonic() < st[1] or st[2]:
+                return False
+            # cooldown прошёл: один пробный запрос, остальные ждут его исхода
+            st[2] = True
+            return True
+
+    def is_open(self, host: str) -> bool:
+        with self._lock:
+            st = self._hosts.get(host)
+            return bool(st) and self.breaker_threshold > 0 and st[0] >= self.breaker_threshold
+
+    def record(self, host: str, ok: bool) -> None:
+        if self.breaker_threshold <= 0:
+            return
+        with self._lock:
+            st = self._hosts.setdefault(host, [0, 0.0, False])
+            if ok:
+                if st[0] >= self.breaker_threshold:
+                    logging.info("HTTP: %s снова отвечает — запросы к нему возобновлены.", host)
+                st[:] = [0, 0.0, False]
+                return
+            st[0] += 1
+            st[2] = False
+            if st[0] >= self.breaker_threshold:
+                opened = time.monotonic() >= st[1]
+                st[1] = time.monotonic() + self.breaker_cooldown
+                if opened:
+                    logging.warning(
+                        "HTTP: %s не отвечает (%d ошибок подряд) — %g с запросы к нему не шлю.",
+                        host, st[0], self.breaker_cooldown,
+                    )
+                    inc_metric("circuit_open", host=host)
+
+
+_RETRY = RetryPolicy()
+
+
+def init_http_retry(
+    retries: int = 3,
+    backoff: float = 0.5,
+    max_backoff: float = 30.0,
+    run_deadline: float = 0.0,
+    breaker_threshold: int = 5,
+    breaker_cooldown: float = 60.0,
+) -> RetryPolicy:
+    global _RETRY
+    _RETRY = RetryPolicy(retries, backoff, max_backoff, run_deadline, breaker_threshold, breaker_cooldown)
+    return _RETRY
+
+def begin_http_run() -> None:
+    # дедлайн отсчитывается от начала прогона (в daemon — каждой проверки)
+    _RETRY.begin_run()
+
+
+def _retry_after(headers: Dict[str, str]) -> Optional[float]:
+    # Retry-After: секунды или HTTP-дата
+    value = (get_header(headers, "Retry-After") or "").strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if dt is None:
+        return None
+    return max(0.0, dt.timestamp() - time.time())
+
 
 # -------------------------
 # HTTP helper
@@ -12,6 +219,133 @@ def http_request(
     headers: Optional[Dict[str, str]] = None,
     data: Optional[bytes] = None,
     timeout: int = 30,
+) -> Tuple[int, Dict[str, str], bytes]:
+    # время и число запросов по маршруту (id в пути схлопываются) — в метрики прогона;
+    # каждая попытка считается отдельно
+    parts = urllib.parse.urlsplit(url)
+    endpoint = endpoint_label(method, parts.path)
+    host = parts.netloc.lower()
+    policy = _RETRY
+
+    attempt = 0
+    while True:
+        remaining = policy.remaining()
+        if remaining is not None and remaining <= 0:
+            raise RuntimeError(f"HTTP запрос не выполнен: {method} {url}: исчерпан дедлайн прогона")
+        if not policy.allow(host):
+            inc_metric("api_requests", endpoint=endpoint, status="circuit_open")
+            raise RuntimeError(f"HTTP запрос не выполнен: {method} {url}: {host} временно отключён после ошибок")
+
+        status: object = "error"
+        retry_after: Optional[float] = None
+        try:
+            with span(endpoint, kind="http"):
+                status, hdrs, body = _http_request(
+                    method, url, headers, data, timeout if remaining is None else max(0.1, min(timeout, remaining)),
+                )
+        except RuntimeError as e:
+            policy.record(host, False)
+            if attempt >= policy.retries:
+                raise
+            reason, err = "error", e
+        else:
+            policy.record(host, status < 500)
+            if status not in RETRY_STATUSES or attempt >= policy.retries:
+                return status, hdrs, body
+            reason, err = str(status), None
+            if status in RETRY_AFTER_STATUSES:
+                retry_after = _retry_after(hdrs)
+        finally:
+            inc_metric("api_requests", endpoint=endpoint, status=str(status))
+
+        pause = policy.delay(attempt, retry_after)
+        remaining = policy.remaining()
+        if pause > policy.max_backoff or (remaining is not None and pause >= remaining) or policy.is_open(host):
+            # просят ждать дольше max_backoff, дольше, чем осталось прогону, или хост отключён — отдаём то, что есть
+            if err is not None:
+                raise err
+            return status, hdrs, body
+        logging.warning(
+            "HTTP %s: %s, повтор %d/%d через %.1f с",
+            endpoint, err or f"HTTP {status}", attempt + 1, policy.retries, pause,
+        )
+        inc_metric("http_retries", endpoint=endpoint, reason=reason)
+        time.sleep(pause)
+        attempt += 1
+
+
+def _http_request(
+    method: str,
+    url: str,
+    headers: Optional[Dict[str, str]],
+    data: Optional[bytes],
+    timeout: int,
+) -> Tuple[int, Dict[str, str], bytes]:
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https") or not parts.hostname or _proxy_for(scheme, parts.hostname):
+            # прокси и экзотика — как раньше, через urllib
+            return _urllib_request(method, url, headers, data, timeout)
+
+        status, hdrs, body = _pooled_request(method, parts, headers, data, timeout)
+
+        # urlopen сам ходил по редиректам для GET/HEAD — сохраняем это поведение
+        location = get_header(hdrs, "Location")
+        if status in (301, 302, 303, 307, 308) and location and method.upper() in ("GET", "HEAD"):
+            url = urllib.parse.urljoin(url, location)
+            continue
+        return status, hdrs, body
+
+    raise RuntimeError(f"HTTP запрос упал: {method} {url}: слишком много редиректов")
+
+
+def _pooled_request(
+    method: str,
+    parts: urllib.parse.SplitResult,
+    headers: Optional[Dict[str, str]],
+    data: Optional[bytes],
+    timeout: int,
+) -> Tuple[int, Dict[str, str], bytes]:
+    scheme = parts.scheme.lower()
+    port = parts.port or (443 if scheme == "https" else 80)
+    key = (scheme, parts.hostname, port)
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+    req_headers = {"User-Agent": USER_AGENT}
+    if headers:
+        req_headers.update(headers)
+
+    url = urllib.parse.urlunsplit(parts)
+    while True:
+        conn, reused = _POOL.acquire(key, timeout)
+        try:
+            conn.request(method.upper(), path, body=data, headers=req_headers)
+            resp = conn.getresponse()
+            body = resp.read()
+        except _STALE_CONN_ERRORS as e:
+            conn.close()
+            if reused:
+                continue  # сервер закрыл keep-alive — переподключаемся
+            raise RuntimeError(f"HTTP запрос упал: {method} {url}: {e}") from e
+        except Exception as e:
+            conn.close()
+            raise RuntimeError(f"HTTP запрос упал: {method} {url}: {e}") from e
+
+        hdrs = {k: v for k, v in resp.getheaders()}
+        if resp.will_close:
+            conn.close()
+        else:
+            _POOL.release(key, conn)
+        return resp.status, hdrs, body
+
+
+def _urllib_request(
+    method: str,
+    url: str,
+    headers: Optional[Dict[str, str]],
+    data: Optional[bytes],
+    timeout: int,
 ) -> Tuple[int, Dict[str, str], bytes]:
     req = urllib.request.Request(url=url, data=data, method=method.upper())
     if headers:
@@ -29,3 +363,17 @@ def http_request(
         return e.code, hdrs, body
     except Exception as e:
         raise RuntimeError(f"HTTP запрос упал: {method} {url}: {e}") from e
+
+
+def _proxy_for(scheme: str, host: str) -> bool:
+    proxies = urllib.request.getproxies()
+    return bool(proxies.get(scheme)) and not urllib.request.proxy_bypass(host)
+
+
+def get_header(headers: Dict[str, str], name: str) -> Optional[str]:
+    # заголовки могут прийти в любом регистре
+    low = name.lower()
+    for k, v in headers.items():
+        if k.lower() == low:
+            return v
+    return None
@@ -6,16 +6,167 @@ import subprocess
 from typing import Tuple, List, Optional, Dict
 
 from utils.cmd import run_cmd
+from utils.metrics import span
+from utils.state import load_json_state, save_json_state
 
 
-def parse_nginx_ssl_pairs(nginx_bin: str) -> List[Tuple[str, str]]:
+# -------------------------
+# Лексер/парсер конфига nginx (вывод nginx -T)
+# -------------------------
+# Один проход регуляркой по всему тексту; пробелы съедаются префиксом \s*.
+# Группы: 1 — слово, 2 — { } ;, 3 — комментарий, 4/5 — строка в "..." / '...'.
+# '#' и кавычки имеют смысл только в начале токена, как у nginx.
+_NGINX_TOKEN_RE = re.compile(
+    r"""\s*(?:
+      ((?![#"'])(?:[^\s{};\\$]+|\$\{[^}\s]*\}|\$|\\.)+)
+    | ([{};])
+    | (\#[^\n]*)
+    | ("[^"\\]*(?:\\.[^"\\]*)*")
+    | ('[^'\\]*(?:\\.[^'\\]*)*')
+    )""",
+    re.VERBOSE | re.DOTALL,
+)
+
+_TOK_WORD, _TOK_PUNCT, _TOK_COMMENT = 1, 2, 3
+
+_NGINX_CONF_MARKER_RE = re.compile(r"^# configuration file (.+):\s*$")
+
+_NGINX_ESCAPES = {"t": "\t", "n": "\n", "r": "\r"}
+
+
+class NginxDirective:
     """
-    Возвращает список уникальных пар (ssl_certificate, ssl_certificate_key)
-    из server-блоков nginx.
+    Узел лёгкого AST: директива (name args;) или блок (name args { ... }).
+    file/line — откуда директива пришла (по маркерам "# configuration file" из nginx -T).
+    """
+
+    __slots__ = ("name", "args", "file", "line", "block")
+
+    def __init__(self, name: str, args: List[str], file: Optional[str], line: int, block: Optional[list]):
+        self.name = name
+        self.args = args
+        self.file = file
+        self.line = line
+        self.block = block
 
-    Если nginx отсутствует или не запускается — возвращает пустой список.
+    def __repr__(self) -> str:
+        return f"NginxDirective({self.name!r}, {self.args!r}, {self.file}:{self.line}, block={self.block is not None})"
+
+
+def _unquote(tok: str) -> str:
+    body = tok[1:-1]
+    if "\\" not in body:
+        return body
+    return re.sub(r"\\(.)", lambda m: _NGINX_ESCAPES.get(m.group(1), m.group(1)), body)
+
+
+def parse_nginx_config(text: str) -> Tuple[List[NginxDirective], List[str]]:
+    """
+    Разбирает текст конфига (обычно вывод nginx -T) за один проход.
+
+    Возвращает (директивы верхнего уровня, список файлов из маркеров "# configuration file").
+    Незакрытые блоки молча закрываются в конце, лишние "}" игнорируются.
     """
+    root: List[NginxDirective] = []
+    stack: List[List[NginxDirective]] = [root]
+    files: List[str] = []
+
+    cur_file: Optional[str] = None
+    file_base = 0  # строка маркера текущего файла: line - file_base = строка внутри файла
+    words: List[str] = []
+    start_line = 0
+
+    line = 1
+    last_pos = 0
+
+    for m in _NGINX_TOKEN_RE.finditer(text):
+        kind = m.lastindex
+
+        # номер строки считаем лениво: только для начала директивы и маркеров файлов
+        if kind == _TOK_COMMENT:
+            tok = m.group(kind)
+            if tok.startswith("# configuration file "):
+                fm = _NGINX_CONF_MARKER_RE.match(tok)
+                if fm:
+                    cur_file = fm.group(1)
+                    files.append(cur_file)
+                    line += text.count("\n", last_pos, m.start(kind))
+                    last_pos = m.start(kind)
+                    file_base = line
+            continue
+
+        if kind == _TOK_PUNCT:
+            ch = m.group(kind)
+            if ch == "}":
+                words = []
+                if len(stack) > 1:
+                    stack.pop()
+                continue
+            if not words:
+                continue  # пустая директива (";;" или "{" без имени)
+            node = NginxDirective(words[0], words[1:], cur_file, start_line - file_base, [] if ch == "{" else None)
+            stack[-1].append(node)
+            if ch == "{":
+                stack.append(node.block)
+            words = []
+            continue
+
+        if not words:
+            line += text.count("\n", last_pos, m.start(kind))
+            last_pos = m.start(kind)
+            start_line = line
+        tok = m.group(kind)
+        words.append(tok if kind == _TOK_WORD else _unquote(tok))
+
+    return root, files
+
+
+def iter_nginx_server_blocks(nodes: List[NginxDirective]):
+    """
+    Обходит AST и отдаёт все блоки server { ... } (http и stream).
+    """
+    todo = list(reversed(nodes))
+    while todo:
+        node = todo.pop()
+        if node.block is None:
+            continue
+        if node.name == "server":
+            yield node
+            continue  # server внутри server не бывает
+        todo.extend(reversed(node.block))
+
+
+def nginx_ssl_pairs_from_config(nodes: List[NginxDirective]) -> List[Tuple[str, str]]:
+    """
+    Уникальные пары (ssl_certificate, ssl_certificate_key) по server-блокам.
+    Берём первую пару в блоке; пути с переменными ($) пропускаем.
+    """
+    pairs: List[Tuple[str, str]] = []
+    seen = set()
+
+    for server in iter_nginx_server_blocks(nodes):
+        cert = key = None
+        for d in server.block:
+            if not d.args or d.block is not None:
+                continue
+            if d.name == "ssl_certificate" and cert is None and "$" not in d.args[0]:
+                cert = d.args[0]
+            elif d.name == "ssl_certificate_key" and key is None and "$" not in d.args[0]:
+                key = d.args[0]
+        if not cert or not key:
+            continue
+        if (cert, key) not in seen:
+            seen.add((cert, key))
+            pairs.append((cert, key))
 
+    return pairs
+
+
+def dump_nginx_config(nginx_bin: str) -> Optional[str]:
+    """
+    Возвращает вывод nginx -T (только stdout — там конфиг), "" — если nginx не установлен
+    (пар nginx просто нет), или None — nginx есть, но конфиг получить не удалось.
+    """
     # --- 1. Проверяем наличие nginx ---
     resolved = None
 
@@ -26,147 +177,122 @@ def parse_nginx_ssl_pairs(nginx_bin: str) -> List[Tuple[str, str]]:
 
     if not resolved:
         logging.warning("nginx не найден: %s", nginx_bin)
-        return []
+        return ""
 
     # --- 2. Выполняем nginx -T ---
     try:
-        proc = subprocess.run(
-            [resolved, "-T"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
+        with span("nginx -T", kind="cmd"):
+            proc = subprocess.run(
+                [resolved, "-T"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
     except Exception as e:
         logging.warning("Ошибка запуска nginx: %s", e)
-        return []
+        return None
 
-    text = (proc.stdout or "") + (proc.stderr or "")
+    # stderr ("syntax is ok" и т.п.) в разбор не пускаем — это не конфиг
+    text = proc.stdout or ""
     if proc.returncode != 0 or not text:
-        logging.warning("nginx -T завершился с ошибкой (rc=%s)", proc.returncode)
-        return []
+        logging.warning("nginx -T завершился с ошибкой (rc=%s): %s", proc.returncode, (proc.stderr or "")[:500])
+        return None
+    return text
 
-    # --- 3. Парсим конфиг ---
-    lines = text.splitlines()
-
-    type_stack: List[str] = []
-    server_data_stack: List[Optional[Dict[str, List[str]]]] = []
-    collected_servers: List[Dict[str, List[str]]] = []
-
-    def push(kind: str):
-        type_stack.append(kind)
-        if kind == "server":
-            server_data_stack.append({"certs": [], "keys": []})
-        else:
-            server_data_stack.append(None)
-
-    def pop():
-        if not type_stack:
-            return
-        kind = type_stack.pop()
-        data = server_data_stack.pop()
-        if kind == "server" and data:
-            collected_servers.append(data)
-
-    pending_server = False
-
-    for raw in lines:
-        # убираем комментарии
-        line = re.sub(r"#.*$", "", raw).strip()
-        if not line:
-            continue
 
-        # если уже внутри server — ищем директивы
-        if "server" in type_stack:
-            m_cert = re.search(r"\bssl_certificate\s+([^;]+);", line)
-            m_key = re.search(r"\bssl_certificate_key\s+([^;]+);", line)
-
-            if m_cert and not re.search(r"\bssl_certificate_key\b", line):
-                path = m_cert.group(1).strip().strip('"').strip("'")
-                if "$" not in path:
-                    for i in range(len(type_stack) - 1, -1, -1):
-                        if type_stack[i] == "server":
-                            server_data_stack[i]["certs"].append(path)
-                            break
-
-            if m_key:
-                path = m_key.group(1).strip().strip('"').strip("'")
-                if "$" not in path:
-                    for i in range(len(type_stack) - 1, -1, -1):
-                        if type_stack[i] == "server":
-                            server_data_stack[i]["keys"].append(path)
-                            break
-
-        # если встретили слово server без {
-        if re.search(r"\bserver\b", line) and "{" not in line:
-            pending_server = True
-
-        # разбор блоков
-        i = 0
-        while i < len(line):
-            if line[i] == "{":
-                if re.search(r"\bserver\s*\{", line[: i + 1]) or pending_server:
-                    push("server")
-                    pending_server = False
-                else:
-                    push("other")
-                i += 1
-                continue
-
-            if line[i] == "}":
-                pop()
-                i += 1
-                continue
-
-            i += 1
+def parse_nginx_ssl_pairs(nginx_bin: str) -> Optional[List[Tuple[str, str]]]:
+    """
+    Возвращает список уникальных пар (ssl_certificate, ssl_certificate_key)
+    из server-блоков nginx.
 
-        if re.search(r"\bserver\s*\{", line):
-            pending_server = False
+    Если nginx не установлен — пустой список; если nginx -T не отработал — None
+    (пары неизвестны, а не «их нет»).
+    """
+    text = dump_nginx_config(nginx_bin)
+    if text is None:
+        return None
+    if not text:
+        return []
 
-    # добиваем стек если что-то не закрыто
-    while type_stack:
-        pop()
+    nodes, _files = parse_nginx_config(text)
+    return nginx_ssl_pairs_from_config(nodes)
 
-    # --- 4. Собираем уникальные пары ---
-    pairs: List[Tuple[str, str]] = []
-    seen = set()
+def load_nginx_ssl_pairs(nginx_bin: str, cache_path: Optional[str] = None) -> Optional[List[Tuple[str, str]]]:
+    """
+    parse_nginx_ssl_pairs с кэшем: если ни один файл из маркеров "# configuration file"
+    (и папки, где они лежат — на случай новых include по маске) не менялся
+    по mtime/size, nginx -T не запускаем и берём пары из cache_path.
+    """
+    state = load_json_state(cache_path)
+    if state and state.get("nginx_bin") == nginx_bin and isinstance(state.get("tree"), dict):
+        if state["tree"] and _nginx_config_tree_stat(list(state["tree"])) == state["tree"]:
+            pairs = [tuple(p) for p in state.get("pairs") or []]
+            logging.info("Конфиг nginx не менялся (%d файлов) — nginx -T пропускаю.", len(state["tree"]))
+            return pairs
+
+    text = dump_nginx_config(nginx_bin)
+    if text is None:
+        return None
+    if not text:
+        return []
 
-    for s in collected_servers:
-        if not s["certs"] or not s["keys"]:
-            continue
+    nodes, files = parse_nginx_config(text)
+    pairs = nginx_ssl_pairs_from_config(nodes)
+
+    if cache_path and files:
+        paths = set(files)
+        paths.update(os.path.dirname(f) for f in files)
+        save_json_state(cache_path, {
+            "nginx_bin": nginx_bin,
+            "tree": _nginx_config_tree_stat(sorted(paths)),
+            "pairs": [list(p) for p in pairs],
+        })
+    return pairs
 
-        cert = s["certs"][0]
-        key = s["keys"][0]
 
-        if (cert, key) not in seen:
-            seen.add((cert, key))
-            pairs.append((cert, key))
+def _nginx_config_tree_stat(paths: List[str]) -> Dict[str, Optional[List[int]]]:
+    tree: Dict[str, Optional[List[int]]] = {}
+    for p in paths:
+        try:
+            st = os.stat(p)
+            tree[p] = [st.st_mtime_ns, st.st_size]
+        except OSError:
+            tree[p] = None
+    return tree
 
-    return pairs
 
-def nginx_reload_or_restart(systemctl_bin: str, nginx_bin: str, dry_run: bool) -> None:
+def nginx_config_test(nginx_bin: str) -> bool:
     # Перед reload проверим конфиг
     rc, out = run_cmd([nginx_bin, "-t"])
     if rc != 0:
         logging.error("nginx -t не прошёл, reload/restart не делаю:\n%s", out[:2000])
-        return
+        return False
+    return True
 
+def systemctl_reload_or_restart(systemctl_bin: str, dry_run: bool) -> bool:
     if dry_run:
         logging.info("[dry-run] systemctl reload nginx")
         logging.info("[dry-run] (если не ок) systemctl restart nginx")
-        return
+        return True
 
     rc1, out1 = run_cmd([systemctl_bin, "reload", "nginx"])
     if rc1 == 0:
         logging.info("nginx успешно перезагружен (reload).")
-        return
+        return True
 
     logging.error("nginx reload не удался (rc=%s). Пытаюсь restart...\n%s", rc1, out1[:2000])
     rc2, out2 = run_cmd([systemctl_bin, "restart", "nginx"])
     if rc2 == 0:
         logging.info("nginx успешно перезапущен (restart).")
-        return
+        return True
 
     logging.critical("nginx restart тоже не удался (rc=%s):\n%s", rc2, out2[:2000])
+    return False
+
+def nginx_reload_or_restart(systemctl_bin: str, nginx_bin: str, dry_run: bool) -> None:
+    if not nginx_config_test(nginx_bin):
+        return
+    systemctl_reload_or_restart(systemctl_bin, dry_run)
 
 def pick_cert_filename_for_nginx_target(nginx_cert_path: str) -> str:
     """
@@ -186,24 +312,6 @@ def pick_cert_filename_for_nginx_target(nginx_cert_path: str) -> str:
     return "fullchain.pem"
 
 
-def strip_nginx_comment(line: str) -> str:
-    # Наивно (но обычно достаточно): режем всё после #, если это не внутри кавычек.
-    # Для простоты игнорируем сложные случаи.
-    if "#" not in line:
-        return line
-    in_s = False
-    in_d = False
-    res = []
-    for ch in line:
-        if ch == "'" and not in_d:
-            in_s = not in_s
-        elif ch == '"' and not in_s:
-            in_d = not in_d
-        if ch == "#" and not in_s and not in_d:
-            break
-        res.append(ch)
-    return "".join(res)
-
 def infer_domain_from_path(cert_path: str) -> Optional[str]:
     # очень грубо: берём имя папки над файлом (часто /etc/nginx/ssl/example.com/fullchain.pem)
     try:
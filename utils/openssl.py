@@ -1,15 +1,142 @@
 import logging
+import os
 import re
+import threading
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 from utils.cmd import run_cmd
+from utils.state import load_json_state, save_json_state
+from utils.x509 import X509Error, read_certificate_file
+
+CERT_CACHE_VERSION = 1
+
+
+# -------------------------
+# Кэш метаданных сертификатов (между запусками)
+# -------------------------
+class CertMetaCache:
+    """
+    realpath -> {"key": [st_dev, st_ino, st_mtime_ns, st_size], "not_after", "san", "subject", "fingerprint"}
+
+    Без path работает только в памяти (в пределах одного запуска).
+    Потокобезопасен: пары осматриваются параллельно.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self._lock = threading.Lock()
+
+        state = load_json_state(path)
+        if state and state.get("version") == CERT_CACHE_VERSION and isinstance(state.get("entries"), dict):
+            self.entries = state["entries"]
+
+    def get(self, real: str, key: list) -> Optional[Dict[str, object]]:
+        e = self.entries.get(real)
+        if not e or e.get("key") != key:
+            with self._lock:
+                self.misses += 1
+            logging.debug("Кэш сертификатов: miss %s", real)
+            return None
+        try:
+            not_after = datetime.fromisoformat(e["not_after"])
+        except (KeyError, TypeError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        logging.debug("Кэш сертификатов: hit %s", real)
+        return {
+            "not_after": not_after,
+            "san": list(e.get("san") or []),
+            "subject": e.get("subject") or "",
+            "fingerprint": e.get("fingerprint") or "",
+        }
+
+    def put(self, real: str, key: list, info: Dict[str, object]) -> None:
+        entry = {
+            "key": key,
+            "not_after": info["not_after"].isoformat(),
+            "san": info["san"],
+            "subject": info["subject"],
+            "fingerprint": info["fingerprint"],
+        }
+        with self._lock:
+            self.entries[real] = entry
+            self.dirty = True
+
+    def save(self, persist: bool = True) -> None:
+        # выкидываем записи по исчезнувшим путям
+        gone = [p for p in self.entries if not os.path.exists(p)]
+        for p in gone:
+            del self.entries[p]
+        if gone:
+            self.dirty = True
+
+        logging.info(
+            "Кэш сертификатов: hit=%d, miss=%d, удалено устаревших=%d, записей=%d",
+            self.hits, self.misses, len(gone), len(self.entries),
+        )
+        if persist and self.path and self.dirty:
+            save_json_state(self.path, {"version": CERT_CACHE_VERSION, "entries": self.entries})
+            self.dirty = False
+
+
+_CACHE = CertMetaCache()
+
+
+def init_cert_cache(path: Optional[str]) -> CertMetaCache:
+    global _CACHE
+    _CACHE = CertMetaCache(path)
+    return _CACHE
+
+def save_cert_cache(persist: bool = True) -> None:
+    _CACHE.save(persist)
+
+
+# -------------------------
+# Разбор сертификата в процессе (без fork/exec)
+# -------------------------
+def get_cert_info(cert_path: str) -> Optional[Dict[str, object]]:
+    """
+    Возвращает {"not_after", "san", "subject", "fingerprint"} за одно чтение файла.
+    Сначала смотрит в кэш по (st_dev, st_ino, st_mtime_ns, st_size) цели симлинка.
+    None — если встроенный парсер не справился (тогда зовём openssl).
+    """
+    try:
+        real = os.path.realpath(cert_path)
+        st = os.stat(real)
+    except OSError:
+        return None
+    key = [st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size]
+
+    info = _CACHE.get(real, key)
+    if info:
+        return info
+
+    try:
+        info = read_certificate_file(real)
+    except (OSError, X509Error, ValueError) as e:
+        logging.debug("Встроенный парсер не смог прочитать %s: %s (fallback на openssl)", cert_path, e)
+        return None
+
+    _CACHE.put(real, key, info)
+    return info
 
 
 # -------------------------
 # openssl helpers
 # -------------------------
 def get_cert_not_after(cert_path: str) -> Optional[datetime]:
+    info = get_cert_info(cert_path)
+    if info:
+        return info["not_after"]
+
     rc, out = run_cmd(["openssl", "x509", "-enddate", "-noout", "-in", cert_path])
     if rc != 0:
         logging.warning("openssl не смог прочитать сертификат: %s\n%s", cert_path, out[:500])
@@ -27,6 +154,10 @@ def get_cert_not_after(cert_path: str) -> Optional[datetime]:
         return None
 
 def get_cert_san_domains(cert_path: str) -> List[str]:
+    info = get_cert_info(cert_path)
+    if info:
+        return list(info["san"])
+
     rc, out = run_cmd(["openssl", "x509", "-noout", "-ext", "subjectAltName", "-in", cert_path])
     if rc != 0:
         return []
@@ -1,7 +1,8 @@
 import logging
 import os
+import shutil
 import tempfile
-from typing import List
+from typing import Dict, List, Tuple
 
 
 def ensure_dir(path: str) -> None:
@@ -55,60 +56,92 @@ def write_file(path: str, data: str, mode: int) -> None:
         except Exception:
             pass
 
+def write_version_dir(ver_dir: str, files: Dict[str, Tuple[str, int]]) -> bool:
+    """
+    Долговечно и атомарно создаёт папку версии целиком.
+    files: {имя файла: (содержимое, mode)}
+
+    Всё пишется во временную папку рядом, каждый файл fsync'ится один раз,
+    затем папка переименовывается в ver_dir и один раз fsync'ится родитель.
+    Если ver_dir уже есть с тем же содержимым — ничего не делаем (возвращает False).
+    """
+    parent = os.path.dirname(ver_dir)
+    ensure_dir(parent)
+
+    if os.path.isdir(ver_dir) and _dir_has_files(ver_dir, files):
+        logging.info("Папка версии уже на месте, перезапись не нужна: %s", ver_dir)
+        return False
+
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+    try:
+        os.chmod(tmp, 0o755)
+        for name, (data, mode) in files.items():
+            if not data.endswith("\n"):
+                data += "\n"
+            fd = os.open(os.path.join(tmp, name), os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(os.path.join(tmp, name), mode)
+        _fsync_dir(tmp)
+
+        if os.path.lexists(ver_dir):
+            # папка есть, но содержимое другое (недописанная/битая) — убираем в сторону
+            old = f"{ver_dir}.old-{os.getpid()}"
+            logging.warning("Папка версии %s уже есть с другим содержимым, заменяю.", ver_dir)
+            os.rename(ver_dir, old)
+            try:
+                os.rename(tmp, ver_dir)
+            except OSError:
+                # не оставляем ver_dir пустым местом: возвращаем прежнюю папку
+                os.rename(old, ver_dir)
+                raise
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.rename(tmp, ver_dir)
+        _fsync_dir(parent)
+        return True
+    finally:
+        if os.path.lexists(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+
+def _dir_has_files(d: str, files: Dict[str, Tuple[str, int]]) -> bool:
+    for name, (data, _mode) in files.items():
+        if not data.endswith("\n"):
+            data += "\n"
+        try:
+            with open(os.path.join(d, name), "r", encoding="utf-8") as f:
+                if f.read() != data:
+                    return False
+        except (OSError, UnicodeDecodeError):
+            return False
+    return True
+
+def _fsync_dir(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def read_pidfile(pid_file: str) -> Tuple[int, str]:
+    """
+    PID из pid-файла и имя процесса (/proc/<pid>/comm) — pid мог достаться другому процессу
+    после падения сервиса. OSError / ValueError — файла или процесса нет, мусор в файле.
+    """
+    with open(pid_file, "r", encoding="utf-8") as f:
+        parts = f.read().split()
+    if not parts:
+        raise ValueError("пустой pid-файл")
+    pid = int(parts[0])
+    with open(f"/proc/{pid}/comm", "r", encoding="utf-8") as f:
+        comm = f.read().strip()
+    return pid, comm
+
 def path_allowed(path: str, prefixes: List[str]) -> bool:
     ap = os.path.abspath(path)
     for p in prefixes:
         if ap.startswith(os.path.abspath(p).rstrip("/") + "/") or ap == os.path.abspath(p):
             return True
     return False
-
-def scan_extra_ssl_pairs(extra_dirs):
-    """Рекурсивно ищет пары cert/key в EXTRA_CERT_DIRS для не-nginx сервисов.
-
-    Поддерживаемые варианты в одной папке:
-      - fullchain.pem + privkey.pem
-      - cert.pem + privkey.pem
-      - *.crt + *.key (одинаковый basename)
-
-    Возвращает список (cert_path, key_path) с абсолютными путями.
-    """
-    pairs = []  # list[(cert_path, key_path)]
-    seen = set()
-
-    for base in extra_dirs:
-        if not base:
-            continue
-        base = os.path.abspath(base)
-        if not os.path.isdir(base):
-            logging.warning("EXTRA_CERT_DIRS: папка не найдена/не папка: %s", base)
-            continue
-
-        for dirpath, _, filenames in os.walk(base):
-            files = set(filenames)
-
-            if "privkey.pem" in files:
-                key_path = os.path.join(dirpath, "privkey.pem")
-                if "fullchain.pem" in files:
-                    cert_path = os.path.join(dirpath, "fullchain.pem")
-                    pair = (os.path.abspath(cert_path), os.path.abspath(key_path))
-                    if pair not in seen:
-                        pairs.append(pair); seen.add(pair)
-                if "cert.pem" in files:
-                    cert_path = os.path.join(dirpath, "cert.pem")
-                    pair = (os.path.abspath(cert_path), os.path.abspath(key_path))
-                    if pair not in seen:
-                        pairs.append(pair); seen.add(pair)
-
-            for f in files:
-                if not f.endswith(".crt"):
-                    continue
-                base_name = os.path.splitext(f)[0]
-                key_name = base_name + ".key"
-                if key_name in files:
-                    cert_path = os.path.join(dirpath, f)
-                    key_path = os.path.join(dirpath, key_name)
-                    pair = (os.path.abspath(cert_path), os.path.abspath(key_path))
-                    if pair not in seen:
-                        pairs.append(pair); seen.add(pair)
-
-    return pairs
\ No newline at end of file
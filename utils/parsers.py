@@ -1,7 +1,7 @@
 import re
 from datetime import datetime
 import json
-from typing import List, Dict, Optional
+from typing import List, Optional
 
 from utils.openssl import get_cert_san_domains
 
@@ -58,28 +58,6 @@ def json_loads_safe(data):
     except (UnicodeDecodeError, json.JSONDecodeError):
         return None
 
-def build_latest_cert_map(items: List[dict]) -> Dict[str, dict]:
-    """
-    Возвращает {base_domain: item} с максимальным expire_at.
-    """
-    best: Dict[str, dict] = {}
-
-    for item in items:
-        domains = item.get("domains") or []
-        exp = parse_selectel_date(item.get("expire_at") or "")
-        if not exp:
-            continue
-
-        for dom in domains:
-            b = parse_domain_base(dom)
-            if not b:
-                continue
-            cur = best.get(b)
-            if (cur is None) or (parse_selectel_date(cur.get("expire_at") or "") or datetime.min) < exp:
-                best[b] = item
-
-    return best
-
 def extract_private_key(obj: object) -> Optional[str]:
     if isinstance(obj, dict):
         for k in ("private_key", "key", "data"):
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import socket
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from utils.other import path_allowed, write_file
+
+PLAN_VERSION = 1
+# поля пары в плане, без которых её не выполнить
+_PAIR_FIELDS = ("cert", "key", "cert_target", "key_target")
+
+
+# -------------------------
+# План обновления (main.py plan / main.py apply --plan)
+# -------------------------
+class PlanError(ValueError):
+    pass
+
+
+def pair_lstat(path: str) -> Optional[List[int]]:
+    # симлинк/файл по самому пути: если его подменили после плана — inode/mtime другие
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    return [st.st_ino, st.st_mtime_ns]
+
+def build_plan(renewals: Dict[str, dict], cert_store_dir: str) -> dict:
+    """
+    renewals (knox_id -> {"project", "domen", "remote_exp", "stamp", "ver_dir", "pairs"}) -> JSON-совместимый план.
+    """
+    out = []
+    for knox_id, r in renewals.items():
+        out.append({
+            "knox_id": knox_id,
+            # проект Selectel (SELECTEL_PROJECTS), чьим токеном качать; "" — единственный
+            "project": r.get("project") or "",
+            "domen": r["domen"],
+            "remote_exp": r["remote_exp"].isoformat(),
+            "stamp": r["stamp"],
+            "ver_dir": r["ver_dir"],
+            "pairs": [
+                {
+                    "cert": p["cert"],
+                    "key": p["key"],
+                    "is_nginx": p["is_nginx"],
+                    "cert_target": p["cert_target"],
+                    "key_target": p["key_target"],
+                    "local_exp": p["local_exp"].isoformat() if p.get("local_exp") else None,
+                    "diff_seconds": int(p["diff"].total_seconds()) if p.get("diff") is not None else None,
+                    "lstat": [pair_lstat(p["cert"]), pair_lstat(p["key"])],
+                }
+                for p in r["pairs"]
+            ],
+        })
+    return {
+        "version": PLAN_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "host": socket.gethostname(),
+        "cert_store_dir": os.path.abspath(cert_store_dir),
+        "renewals": out,
+    }
+
+def write_plan(path: Optional[str], plan: dict) -> None:
+    """
+    path=None или "-" — в stdout.
+    """
+    text = json.dumps(plan, ensure_ascii=False, indent=2, sort_keys=True)
+    if not path or path == "-":
+        sys.stdout.write(text + "\n")
+        sys.stdout.flush()
+        return
+    write_file(path, text, 0o600)
+    logging.info("План записан: %s", path)
+
+def load_plan(path: str, cert_store_dir: str) -> Dict[str, dict]:
+    """
+    Читает план и возвращает renewals в том же виде, что строит run_once.
+    Пары, которые поменялись на диске после составления плана, выкидываются.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            plan = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PlanError(f"Не смог прочитать план {path}: {e}") from e
+
+    if not isinstance(plan, dict) or plan.get("version") != PLAN_VERSION:
+        raise PlanError(f"Неподдерживаемая версия плана в {path}: {plan.get('version') if isinstance(plan, dict) else None}")
+    if os.path.abspath(plan.get("cert_store_dir") or "") != os.path.abspath(cert_store_dir):
+        raise PlanError(
+            f"План составлен для CERT_STORE_DIR={plan.get('cert_store_dir')}, а сейчас {cert_store_dir}"
+        )
+
+    # inode/mtime сравнимы, только если план составлен на этой же машине
+    check_lstat = plan.get("host") == socket.gethostname()
+
+    renewals: Dict[str, dict] = {}
+    for i, r in enumerate(plan.get("renewals") or []):
+        try:
+            knox_id = r["knox_id"]
+            domen = r["domen"]
+            remote_exp = datetime.fromisoformat(r["remote_exp"])
+            ver_dir = r["ver_dir"]
+            if not all(isinstance(v, str) for v in (knox_id, domen, ver_dir)):
+                raise TypeError("knox_id, domen и ver_dir должны быть строками")
+        except (KeyError, TypeError, ValueError) as e:
+            raise PlanError(f"Битая запись в плане: renewals[{i}]: {e}") from e
+        if not path_allowed(ver_dir, [cert_store_dir]) or os.path.basename(ver_dir) != r.get("stamp"):
+            raise PlanError(f"Папка версии вне CERT_STORE_DIR или не совпадает со stamp: {ver_dir}")
+        if not isinstance(r.get("pairs") or [], list):
+            raise PlanError(f"Битая запись в плане: renewals[{i}].pairs — не список")
+
+        pairs = []
+        for j, p in enumerate(r.get("pairs") or []):
+            bad = [f for f in _PAIR_FIELDS if not isinstance(p, dict) or not isinstance(p.get(f), str)]
+            if bad:
+                raise PlanError(f"Битая запись в плане: renewals[{i}].pairs[{j}]: нет или не строка {', '.join(bad)}")
+            if check_lstat and [pair_lstat(p["cert"]), pair_lstat(p["key"])] != p.get("lstat"):
+                logging.warning("Пара изменилась после составления плана, пропускаю: %s", p["cert"])
+                continue
+            for target in (p["cert_target"], p["key_target"]):
+                if os.path.dirname(target) != ver_dir:
+                    raise PlanError(f"Цель ссылки не в папке версии {ver_dir}: {target}")
+            pairs.append({
+                "cert": p["cert"],
+                "key": p["key"],
+                "is_nginx": bool(p.get("is_nginx")),
+                "cert_target": p["cert_target"],
+                "key_target": p["key_target"],
+            })
+        if not pairs:
+            continue
+
+        renewals[knox_id] = {
+            "project": r.get("project") or "",
+            "domen": domen,
+            "remote_exp": remote_exp,
+            "stamp": r["stamp"],
+            "ver_dir": ver_dir,
+            "pairs": pairs,
+        }
+
+    logging.info(
+        "План %s (%s, %s): сертификатов=%d, пар=%d",
+        path, plan.get("host"), plan.get("created_at"),
+        len(renewals), sum(len(r["pairs"]) for r in renewals.values()),
+    )
+    return renewals
@@ -0,0 +1,193 @@
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from utils.metrics import span
+from utils.selectel_api import SelectelSession, download_selectel_cert_bundles, fetch_selectel_le_certs
+
+# -------------------------
+# Несколько проектов/аккаунтов Selectel в одном прогоне
+# -------------------------
+# В .env:
+#   SELECTEL_PROJECTS=prod,stage                  — имена проектов (без него — один проект из SELECTEL_*)
+#   SELECTEL_<NAME>_USERNAME / _ACCOUNT_ID / _PASSWORD / _PROJECT_NAME
+# Не заданное для проекта берётся из общих SELECTEL_* (один аккаунт — достаточно _PROJECT_NAME).
+# Токены и списки сертификатов всех проектов берутся параллельно и сливаются в один индекс доменов;
+# элементы списка помечаются полем "project", по нему bundle качаются токеном своего проекта.
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9_]+$")
+
+# поле -> общие переменные (как раньше, с запасными именами)
+_CREDENTIALS = {
+    "USERNAME": ("SELECTEL_USERNAME", "SERVICE_USERNAME"),
+    "ACCOUNT_ID": ("SELECTEL_ACCOUNT_ID", "ACCOUNT_ID"),
+    "PASSWORD": ("SELECTEL_PASSWORD", "SERVICE_PASSWORD"),
+    "PROJECT_NAME": ("SELECTEL_PROJECT_NAME", "PROJECT_NAME"),
+}
+
+
+class ProjectConfigError(ValueError):
+    pass
+
+
+class SelectelProject:
+    __slots__ = ("name", "session", "le_cache_path")
+
+    def __init__(self, name: str, session: SelectelSession, le_cache_path: Optional[str]):
+        # name="" — единственный проект из общих SELECTEL_* (пути кэшей как раньше)
+        self.name = name
+        self.session = session
+        self.le_cache_path = le_cache_path
+
+    @property
+    def label(self) -> str:
+        return self.name or self.session.project_name
+
+    def __repr__(self) -> str:
+        return f"SelectelProject({self.label})"
+
+
+def _per_project(path: Optional[str], name: str) -> Optional[str]:
+    # token.json -> token-prod.json: у каждого проекта свой кэш
+    if not path or not name:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{name}{ext}"
+
+def load_selectel_projects(env: Dict[str, str], state_dir: str, dry_run: bool) -> List[SelectelProject]:
+    """
+    Проекты из SELECTEL_PROJECTS (или один из общих SELECTEL_*).
+    Не хватает учётных данных — ProjectConfigError.
+    """
+    names = [n.strip() for n in (env.get("SELECTEL_PROJECTS") or "").split(",") if n.strip()]
+    token_cache = None if dry_run else env.get("TOKEN_CACHE_FILE", os.path.join(state_dir, "token.json"))
+    le_cache = None if dry_run else env.get("LE_LIST_CACHE_FILE", os.path.join(state_dir, "le-list.json"))
+
+    projects: List[SelectelProject] = []
+    for name in names or [""]:
+        if name and not _NAME_RE.match(name):
+            raise ProjectConfigError(f"SELECTEL_PROJECTS: недопустимое имя проекта {name!r} (латиница, цифры, _)")
+        prefix = f"SELECTEL_{name.upper()}_" if name else None
+        creds: Dict[str, str] = {}
+        for field, common in _CREDENTIALS.items():
+            value = env.get(prefix + field) if prefix else None
+            for var in common:
+                value = value or env.get(var)
+            creds[field] = value or ""
+
+        missing = [
+            f"{prefix}{f} (или SELECTEL_{f})" if prefix else f"SELECTEL_{f}"
+            for f, v in creds.items() if not v
+        ]
+        if missing:
+            raise ProjectConfigError(f"Не хватает переменных в .env: {', '.join(missing)}")
+
+        name = name.lower()
+        session = SelectelSession(
+            identity_url=env.get("SELECTEL_IDENTITY_URL", "https://cloud.api.selcloud.ru/identity/v3"),
+            username=creds["USERNAME"],
+            account_id=creds["ACCOUNT_ID"],
+            password=creds["PASSWORD"],
+            project_name=creds["PROJECT_NAME"],
+            timeout=int(env.get("HTTP_TIMEOUT", "30")),
+            # кэш IAM-токена (в dry-run не пишем на диск)
+            cache_path=_per_project(token_cache, name),
+            refresh_margin=int(env.get("TOKEN_REFRESH_MARGIN_SECONDS", "600")),
+        )
+        projects.append(SelectelProject(name, session, _per_project(le_cache, name)))
+
+    if len({p.name for p in projects}) != len(projects):
+        raise ProjectConfigError("SELECTEL_PROJECTS: имена проектов повторяются")
+    return projects
+
+def project_for(projects: List[SelectelProject], name: Optional[str]) -> Optional[SelectelProject]:
+    """
+    Проект по метке из списка/плана; план без метки (старый) — если проект один.
+    """
+    for p in projects:
+        if p.name == (name or ""):
+            return p
+    return projects[0] if len(projects) == 1 and not name else None
+
+
+def fetch_projects_le_certs(
+    projects: List[SelectelProject],
+    le_base_url: str,
+    timeout: int,
+) -> Tuple[List[dict], Dict[str, str]]:
+    """
+    Токен и список LE сертификатов каждого проекта — параллельно: время — как у самого медленного.
+    Элементы помечаются "project". Возвращает (items всех проектов, {проект: текст ошибки}).
+    Упали все проекты — исключение первого (как раньше с одним проектом).
+    """
+    def fetch(project: SelectelProject) -> List[dict]:
+        with span(project.label, kind="project"):
+            project.session.auth()
+            logging.info("IAM-токен проекта %s получен.", project.label)
+            items = project.session.call(lambda t: fetch_selectel_le_certs(
+                le_base_url, t, timeout=timeout, cache_path=project.le_cache_path
+            ))
+        logging.info("Список LE сертификатов Selectel (%s) получен: %d шт.", project.label, len(items))
+        return [dict(it, project=project.name) for it in items if isinstance(it, dict)]
+
+    items: List[dict] = []
+    errors: Dict[str, str] = {}
+    first_exc: Optional[BaseException] = None
+    with ThreadPoolExecutor(max_workers=len(projects), thread_name_prefix="project") as pool:
+        futures = [(p, pool.submit(fetch, p)) for p in projects]
+        for project, fut in futures:
+            try:
+                items.extend(fut.result())
+            except Exception as e:
+                first_exc = first_exc or e
+                errors[project.label] = str(e)
+
+    if first_exc is not None and len(errors) == len(projects):
+        raise first_exc
+    for label, err in errors.items():
+        logging.error("Проект %s: не получил список сертификатов (его домены пропускаю): %s", label, err)
+    return items, errors
+
+def download_projects_cert_bundles(
+    projects: List[SelectelProject],
+    wanted: Dict[str, Optional[str]],
+    cert_manager_url: str,
+    timeout: int,
+    concurrency: int = 8,
+) -> Tuple[Dict[str, Tuple[List[str], str]], Dict[str, str]]:
+    """
+    wanted: {knox_id: проект}. Каждый bundle качается токеном своего проекта, проекты — параллельно.
+    Ответ как у download_selectel_cert_bundles.
+    """
+    bundles: Dict[str, Tuple[List[str], str]] = {}
+    errors: Dict[str, str] = {}
+    by_project: Dict[str, List[str]] = {}
+    for knox_id, name in wanted.items():
+        project = project_for(projects, name)
+        if project is None:
+            errors[knox_id] = f"проект {name!r} не настроен в SELECTEL_PROJECTS"
+            continue
+        by_project.setdefault(project.name, []).append(knox_id)
+    if not by_project:
+        return bundles, errors
+
+    def fetch(project: SelectelProject, ids: List[str]):
+        return project.session.call(lambda t: download_selectel_cert_bundles(
+            cert_manager_url, t, ids, timeout=timeout, concurrency=concurrency
+        ))
+
+    with ThreadPoolExecutor(max_workers=len(by_project), thread_name_prefix="project") as pool:
+        futures = [
+            (ids, pool.submit(fetch, project_for(projects, name), ids))
+            for name, ids in by_project.items()
+        ]
+        for ids, fut in futures:
+            try:
+                got, errs = fut.result()
+            except Exception as e:
+                errs, got = {knox_id: str(e) for knox_id in ids}, {}
+            bundles.update(got)
+            errors.update(errs)
+    return bundles, errors
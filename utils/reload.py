@@ -0,0 +1,231 @@
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Optional
+
+from utils.metrics import inc_metric, span
+from utils.nginx import nginx_config_test, nginx_reload_or_restart, systemctl_reload_or_restart
+from utils.other import read_pidfile
+from utils.state import load_json_state, save_json_state
+
+
+# -------------------------
+# Контроллер reload nginx: склейка запросов, минимальный интервал, стоп после сбоев nginx -t
+# -------------------------
+class NginxReloader:
+    """
+    request() — «нужен reload»; сам reload делается не чаще, чем раз в min_interval,
+    и не раньше, чем через debounce после последнего запроса (серия ротаций = один reload).
+
+    background=True (daemon): reload выполняется таймером в фоне.
+    background=False (разовый запуск): reload делает flush() в конце прогона.
+
+    После max_test_failures подряд проваленных nginx -t reload не делаем cooldown секунд.
+    Время последнего reload, счётчик сбоев и несделанный reload хранятся в state_path —
+    интервал соблюдается и между запусками, а отложенный reload не теряется.
+    """
+
+    def __init__(
+        self,
+        systemctl_bin: str,
+        nginx_bin: str,
+        dry_run: bool = False,
+        pid_file: Optional[str] = None,
+        debounce: float = 5.0,
+        min_interval: float = 30.0,
+        max_test_failures: int = 3,
+        cooldown: float = 3600.0,
+        state_path: Optional[str] = None,
+        background: bool = False,
+    ):
+        self.systemctl_bin = systemctl_bin
+        self.nginx_bin = nginx_bin
+        self.dry_run = dry_run
+        self.pid_file = pid_file
+        self.debounce = debounce
+        self.min_interval = min_interval
+        self.max_test_failures = max(1, max_test_failures)
+        self.cooldown = cooldown
+        self.state_path = state_path
+        self.background = background
+
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self.pending = 0
+        self.last_request = 0.0
+        self.last_attempt = 0.0
+
+        state = load_json_state(state_path) or {}
+        self.last_reload = float(state.get("last_reload") or 0)
+        self.test_failures = int(state.get("test_failures") or 0)
+        self.blocked_until = float(state.get("blocked_until") or 0)
+        # прошлый запуск переключил сертификаты, но reload так и не случился — повторим
+        if state.get("pending"):
+            self.pending = 1
+            if background:
+                self._schedule()
+
+    def request(self, reason: str = "") -> None:
+        with self._lock:
+            self.pending += 1
+            self.last_request = time.time()
+            logging.info(
+                "Нужен reload nginx%s (запросов в очереди: %d).",
+                f" ({reason})" if reason else "", self.pending,
+            )
+            # сразу на диск: упади процесс до reload — следующий запуск его доделает
+            self._save()
+            if self.background:
+                self._schedule()
+
+    def due_in(self, use_debounce: bool = True) -> float:
+        now = time.time()
+        due = self.last_reload + self.min_interval
+        if use_debounce:
+            # в фоне ждём и окончания блокировки после сбоев nginx -t
+            due = max(due, self.last_request + self.debounce, self.last_attempt + self.min_interval, self.blocked_until)
+        return max(0.0, due - now)
+
+    def _schedule(self) -> None:
+        # под self._lock
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.due_in(), self._fire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _fire(self) -> None:
+        with self._lock:
+            self._timer = None
+            if not self.pending:
+                return
+            # пока ждали, мог прийти новый запрос — тогда ждём ещё
+            if self.due_in() > 0:
+                self._schedule()
+                return
+            self._reload()
+
+    def flush(self) -> None:
+        """
+        Выполнить отложенный reload сейчас (с учётом min_interval, без debounce).
+        """
+        while True:
+            with self._lock:
+                if self._timer:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self.pending:
+                    return
+                wait = self.due_in(use_debounce=False)
+                if wait <= 0:
+                    self._reload()
+                    return
+            # ждём без блокировки — request() из других потоков не встаёт;
+            # после паузы всё проверяем заново (reload мог уже сделать таймер)
+            logging.info("Reload nginx был недавно — жду %.0f с (RELOAD_MIN_INTERVAL_SECONDS).", wait)
+            time.sleep(wait)
+
+    def _reload(self) -> None:
+        # под self._lock
+        with span("reload"):
+            self._do_reload()
+
+    def _do_reload(self) -> None:
+        # под self._lock
+        now = time.time()
+        if self.blocked_until > now:
+            logging.critical(
+                "nginx -t не прошёл %d раз подряд — reload отключён ещё на %.0f с. Исправьте конфиг nginx.",
+                self.test_failures, self.blocked_until - now,
+            )
+            inc_metric("nginx_reloads", result="blocked")
+            self._save()
+            return
+
+        self.last_attempt = now
+        if not nginx_config_test(self.nginx_bin):
+            inc_metric("nginx_reloads", result="test_failed")
+            self.test_failures += 1
+            if self.test_failures >= self.max_test_failures:
+                self.blocked_until = now + self.cooldown
+                logging.critical(
+                    "nginx -t не прошёл %d раз подряд — больше не пытаюсь reload %.0f с.",
+                    self.test_failures, self.cooldown,
+                )
+            self._save()
+            if self.background:
+                self._schedule()
+            return
+
+        self.test_failures = 0
+        self.blocked_until = 0
+        if self._signal_master() or systemctl_reload_or_restart(self.systemctl_bin, self.dry_run):
+            self.last_reload = time.time()
+            if self.pending > 1:
+                logging.info("Один reload nginx вместо %d.", self.pending)
+            inc_metric("nginx_reloads", result="ok")
+            self.pending = 0
+        else:
+            inc_metric("nginx_reloads", result="failed")
+        self._save()
+        if self.pending and self.background:
+            self._schedule()
+
+    def _signal_master(self) -> bool:
+        """
+        SIGHUP мастер-процессу из pid-файла (то же, что nginx -s reload) — без systemctl.
+        False — pid-файла нет / процесс не nginx / нет прав: тогда идём через systemctl.
+        """
+        if not self.pid_file:
+            return False
+        try:
+            pid, comm = read_pidfile(self.pid_file)
+        except (OSError, ValueError) as e:
+            logging.debug("pid-файл nginx %s не подошёл: %s", self.pid_file, e)
+            return False
+        if not comm.startswith("nginx"):
+            logging.warning("PID %d из %s — не nginx (%s), reload через systemctl.", pid, self.pid_file, comm)
+            return False
+
+        if self.dry_run:
+            logging.info("[dry-run] kill -HUP %d (nginx master)", pid)
+            return True
+        try:
+            os.kill(pid, signal.SIGHUP)
+        except OSError as e:
+            logging.warning("Не смог отправить SIGHUP nginx (pid %d): %s", pid, e)
+            return False
+        logging.info("nginx перезагружен: SIGHUP мастер-процессу (pid %d).", pid)
+        return True
+
+    def _save(self) -> None:
+        if self.dry_run or not self.state_path:
+            return
+        save_json_state(self.state_path, {
+            "last_reload": self.last_reload,
+            "test_failures": self.test_failures,
+            "blocked_until": self.blocked_until,
+            "pending": bool(self.pending),
+        })
+
+
+_RELOADER: Optional[NginxReloader] = None
+
+
+def init_nginx_reloader(*args, **kwargs) -> NginxReloader:
+    global _RELOADER
+    _RELOADER = NginxReloader(*args, **kwargs)
+    return _RELOADER
+
+def request_nginx_reload(systemctl_bin: str, nginx_bin: str, dry_run: bool, reason: str = "") -> None:
+    # без init_nginx_reloader — как раньше: nginx -t и reload сразу
+    if _RELOADER is None:
+        nginx_reload_or_restart(systemctl_bin, nginx_bin, dry_run)
+        return
+    _RELOADER.request(reason)
+
+def flush_nginx_reload() -> None:
+    if _RELOADER is not None:
+        _RELOADER.flush()
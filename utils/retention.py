@@ -0,0 +1,181 @@
+import logging
+import os
+import re
+import shutil
+import time
+from typing import Dict, Iterable, List, Set, Tuple
+
+from utils.store import ALIASES_DIRNAME, OBJECTS_DIRNAME, VERSION_STAMP_RE
+
+# -------------------------
+# Чистка старых версий и *.bak-* файлов
+# -------------------------
+_BAK_RE = re.compile(r"^(?P<base>.+)\.bak-(?P<ts>\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})$")
+# недописанные папки/файлы (.tmp-*) моложе этого могут быть чужой незавершённой записью
+STALE_TMP_SECONDS = 3600
+
+
+def _resolve_link_target(path: str) -> str:
+    t = os.readlink(path)
+    if not os.path.isabs(t):
+        t = os.path.join(os.path.dirname(path), t)
+    return os.path.normpath(t)
+
+def protected_paths(managed_paths: Iterable[str]) -> Set[str]:
+    """
+    Всё, на что сейчас указывают управляемые пути: сама цель ссылки, её папка
+    (папка версии) и то же после realpath (объект в хранилище).
+    """
+    prot: Set[str] = set()
+    for p in managed_paths:
+        try:
+            if os.path.islink(p):
+                t = _resolve_link_target(p)
+                prot.add(t)
+                prot.add(os.path.dirname(t))
+            r = os.path.realpath(p)
+            prot.add(r)
+            prot.add(os.path.dirname(r))
+        except OSError:
+            continue
+    return prot
+
+def _is_protected(path: str, prot: Set[str]) -> bool:
+    # сравниваем и «как есть», и после realpath — CERT_STORE_DIR сам может быть симлинком
+    return os.path.normpath(path) in prot or os.path.realpath(path) in prot
+
+def _usage(path: str) -> Tuple[int, int]:
+    """
+    (байты, inode) для файла/ссылки или всего дерева папки (без перехода по симлинкам).
+    """
+    st = os.lstat(path)
+    if not os.path.isdir(path) or os.path.islink(path):
+        return st.st_size, 1
+    size, inodes = st.st_size, 1
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+                inodes += 1
+            except OSError:
+                pass
+    return size, inodes
+
+def _remove(path: str, dry_run: bool, stats: Dict[str, int]) -> None:
+    try:
+        size, inodes = _usage(path)
+    except OSError:
+        return
+    if dry_run:
+        logging.info("[dry-run] Удалил бы: %s", path)
+    else:
+        logging.info("GC: удаляю %s", path)
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+        except OSError as e:
+            logging.warning("GC: не смог удалить %s: %s", path, e)
+            return
+    stats["bytes"] += size
+    stats["inodes"] += inodes
+
+def _keep(idx: int, mtime: float, keep_versions: int, min_mtime: float) -> bool:
+    # оставляем N самых новых ИЛИ всё, что моложе keep_days
+    return idx < keep_versions or mtime >= min_mtime
+
+def collect_garbage(
+    cert_store_dir: str,
+    managed_paths: List[str],
+    keep_versions: int,
+    keep_days: int,
+    dry_run: bool,
+) -> Tuple[int, int]:
+    """
+    Удаляет:
+      - папки версий CERT_STORE_DIR/<domain>/<stamp> сверх политики хранения;
+      - объекты .objects/<sha256>, на которые больше не ссылается ни одна версия, и их by-id алиасы;
+      - брошенные .objects/.tmp-* (запись прервалась) старше STALE_TMP_SECONDS;
+      - файлы <path>.bak-<stamp> рядом с управляемыми путями сверх политики хранения.
+    Никогда не трогает то, на что указывает какой-либо управляемый путь.
+
+    Возвращает (освобождено байт, освобождено inode).
+    """
+    stats = {"bytes": 0, "inodes": 0}
+    prot = protected_paths(managed_paths)
+    min_mtime = time.time() - keep_days * 86400
+
+    # --- 1. версии по доменам ---
+    remaining_versions: List[str] = []
+    if os.path.isdir(cert_store_dir):
+        for dom in os.scandir(cert_store_dir):
+            if dom.name.startswith(".") or not dom.is_dir(follow_symlinks=False):
+                continue
+            versions = sorted(
+                (e for e in os.scandir(dom.path) if VERSION_STAMP_RE.match(e.name)),
+                key=lambda e: e.name,
+                reverse=True,
+            )
+            for idx, e in enumerate(versions):
+                path = os.path.normpath(e.path)
+                mtime = e.stat(follow_symlinks=False).st_mtime
+                if _is_protected(path, prot) or _keep(idx, mtime, keep_versions, min_mtime):
+                    remaining_versions.append(path)
+                    continue
+                _remove(path, dry_run, stats)
+
+    # --- 2. объекты хранилища без ссылок ---
+    store = os.path.join(cert_store_dir, OBJECTS_DIRNAME)
+    if os.path.isdir(store):
+        referenced = set(prot)
+        referenced.update(os.path.realpath(v) for v in remaining_versions)
+        orphans = set()
+        stale_before = time.time() - STALE_TMP_SECONDS
+        for e in os.scandir(store):
+            if e.name.startswith(".tmp-"):
+                try:
+                    if e.stat(follow_symlinks=False).st_mtime < stale_before:
+                        _remove(e.path, dry_run, stats)
+                except OSError:
+                    pass
+                continue
+            if e.name == ALIASES_DIRNAME or e.name.startswith(".") or not e.is_dir(follow_symlinks=False):
+                continue
+            path = os.path.realpath(e.path)
+            if path not in referenced:
+                orphans.add(path)
+                _remove(e.path, dry_run, stats)
+
+        aliases = os.path.join(store, ALIASES_DIRNAME)
+        if os.path.isdir(aliases):
+            for e in os.scandir(aliases):
+                if not e.is_symlink():
+                    continue
+                target = os.path.realpath(e.path)
+                if target in orphans or not os.path.exists(target):
+                    _remove(e.path, dry_run, stats)
+
+    # --- 3. *.bak-<stamp> рядом с управляемыми путями ---
+    for d in sorted(set(os.path.dirname(os.path.abspath(p)) for p in managed_paths)):
+        if not os.path.isdir(d):
+            continue
+        groups: Dict[str, List[os.DirEntry]] = {}
+        for e in os.scandir(d):
+            m = _BAK_RE.match(e.name)
+            if m:
+                groups.setdefault(m.group("base"), []).append(e)
+        for baks in groups.values():
+            baks.sort(key=lambda e: _BAK_RE.match(e.name).group("ts"), reverse=True)
+            for idx, e in enumerate(baks):
+                mtime = e.stat(follow_symlinks=False).st_mtime
+                if _is_protected(e.path, prot) or _keep(idx, mtime, keep_versions, min_mtime):
+                    continue
+                _remove(e.path, dry_run, stats)
+
+    logging.info(
+        "GC%s: освобождено %d байт, %d inode (храню версий: %d, дней: %d)",
+        " [dry-run]" if dry_run else "",
+        stats["bytes"], stats["inodes"], keep_versions, keep_days,
+    )
+    return stats["bytes"], stats["inodes"]
@@ -1,13 +1,27 @@
 # -------------------------
 # Selectel IAM token (project scoped)
 # -------------------------
+import hashlib
 import json
 import logging
-from typing import List, Tuple, Optional
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Tuple, Optional, TypeVar
 
 from utils.formatters import join_url
-from utils.network import http_request
-from utils.parsers import json_loads_safe, extract_private_key, extract_pem_certificates
+from utils.network import get_header, http_request
+from utils.parsers import (
+    json_loads_safe,
+    extract_private_key,
+    extract_pem_certificates,
+    parse_selectel_date,
+)
+from utils.state import load_json_state, save_json_state
+
+
+class SelectelAuthError(RuntimeError):
+    """API ответил 401: токен истёк или отозван."""
 
 
 def get_selectel_project_token(
@@ -17,7 +31,27 @@ def get_selectel_project_token(
     password: str,
     project_name: str,
     timeout: int,
+    cache_path: Optional[str] = None,
+    refresh_margin: int = 600,
+    force: bool = False,
 ) -> str:
+    """
+    Если задан cache_path — токен и его expires_at хранятся в файле (0600)
+    и переиспользуются, пока до истечения больше refresh_margin секунд.
+    force=True — игнорировать кэш (например, после 401).
+    """
+    cache_key = hashlib.sha256(
+        "|".join([identity_url, username, account_id, project_name]).encode("utf-8")
+    ).hexdigest()
+
+    if cache_path and not force:
+        cached = load_json_state(cache_path)
+        if cached and cached.get("key") == cache_key and cached.get("token"):
+            exp = parse_selectel_date(cached.get("expires_at") or "")
+            if exp and exp - timedelta(seconds=refresh_margin) > _utcnow():
+                logging.info("IAM-токен взят из кэша (действует до %s UTC).", exp.isoformat(sep=" "))
+                return cached["token"]
+
     url = join_url(identity_url, "auth/tokens")
     payload = {
         "auth": {
@@ -49,41 +83,151 @@ def get_selectel_project_token(
         raise RuntimeError(f"Не удалось получить IAM-токен проекта. HTTP {status}. Ответ: {j or body[:500]}")
 
     # Заголовок может быть в разном регистре
-    token = headers.get("X-Subject-Token") or headers.get("x-subject-token")
+    token = get_header(headers, "X-Subject-Token")
     if not token:
         raise RuntimeError("IAM-токен не найден в заголовке X-Subject-Token.")
+
+    if cache_path:
+        j = json_loads_safe(body)
+        tok = j.get("token") if isinstance(j, dict) else None
+        expires_at = tok.get("expires_at") if isinstance(tok, dict) else None
+        if parse_selectel_date(expires_at or ""):
+            save_json_state(cache_path, {"key": cache_key, "token": token, "expires_at": expires_at}, 0o600)
+        else:
+            logging.warning("В ответе identity нет token.expires_at — токен не кэширую.")
     return token
 
+def invalidate_selectel_token_cache(cache_path: Optional[str]) -> None:
+    if cache_path and os.path.exists(cache_path):
+        try:
+            os.unlink(cache_path)
+        except OSError as e:
+            logging.warning("Не смог удалить кэш токена %s: %s", cache_path, e)
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+T = TypeVar("T")
+
+
+class SelectelSession:
+    """
+    IAM-токен одного проекта: auth() берёт его (из кэша или у identity),
+    call(fn) вызывает fn(token) и при 401 один раз перелогинивается —
+    токен из кэша могли отозвать раньше expires_at.
+    """
+
+    def __init__(
+        self,
+        identity_url: str,
+        username: str,
+        account_id: str,
+        password: str,
+        project_name: str,
+        timeout: int,
+        cache_path: Optional[str] = None,
+        refresh_margin: int = 600,
+    ):
+        self.identity_url = identity_url
+        self.username = username
+        self.account_id = account_id
+        self.password = password
+        self.project_name = project_name
+        self.timeout = timeout
+        self.cache_path = cache_path
+        self.refresh_margin = refresh_margin
+        self.token = ""
+
+    def auth(self, force: bool = False) -> str:
+        self.token = get_selectel_project_token(
+            identity_url=self.identity_url,
+            username=self.username,
+            account_id=self.account_id,
+            password=self.password,
+            project_name=self.project_name,
+            timeout=self.timeout,
+            cache_path=self.cache_path,
+            refresh_margin=self.refresh_margin,
+            force=force,
+        )
+        return self.token
+
+    def call(self, fn: Callable[[str], T]) -> T:
+        if not self.token:
+            self.auth()
+        try:
+            return fn(self.token)
+        except SelectelAuthError as e:
+            logging.warning("%s. Получаю новый IAM-токен.", e)
+            invalidate_selectel_token_cache(self.cache_path)
+            self.auth(force=True)
+            return fn(self.token)
+
 
 # -------------------------
 # Selectel Let's Encrypt certs list
 # -------------------------
-def list_selectel_le_certs(le_base_url: str, token: str, timeout: int) -> List[dict]:
+def fetch_selectel_le_certs(
+    le_base_url: str,
+    token: str,
+    timeout: int,
+    cache_path: Optional[str] = None,
+) -> List[dict]:
     """
-    Пытаемся поддержать два варианта:
+    Список LE сертификатов. Пробуем два варианта base:
       1) le_base_url = https://api.selectel.ru/certs/le   -> list на "/"
       2) le_base_url = https://api.selectel.ru            -> list на "/certs/le/"
+
+    С кэшем в cache_path:
+      - шлём If-None-Match / If-Modified-Since по сохранённым ETag / Last-Modified;
+      - первым пробуем URL, который сработал в прошлый раз;
+      - на 304 или при том же sha256 тела берём items из кэша (без разбора JSON).
     """
-    candidates = [
-        join_url(le_base_url, ""),          # "/"
-        join_url(le_base_url, "certs/le/"), # на случай если base = https://api.selectel.ru
-    ]
+    state = load_json_state(cache_path) or {}
+    cached_url = state.get("url")
+    has_cache = isinstance(state.get("items"), list)
+
+    candidates = _le_list_candidates(le_base_url)
+    if cached_url in candidates:
+        candidates.remove(cached_url)
+        candidates.insert(0, cached_url)
 
     last_err = None
     for url in candidates:
-        status, _headers, body = http_request(
-            "GET",
-            url,
-            headers={"X-Auth-Token": token},
-            timeout=timeout,
-        )
+        use_cache = has_cache and url == cached_url
+        headers = {"X-Auth-Token": token}
+        if use_cache and state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if use_cache and state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+
+        status, resp_headers, body = http_request("GET", url, headers=headers, timeout=timeout)
+        if status == 401:
+            raise SelectelAuthError(f"GET {url} -> HTTP 401: токен отклонён")
+
+        if status == 304 and use_cache:
+            logging.info("Список LE сертификатов не изменился (HTTP 304).")
+            return state["items"]
+
         if status == 200:
-            j = json_loads_safe(body)
-            if not isinstance(j, dict) or "items" not in j:
-                raise RuntimeError(f"Неожиданный формат списка сертификатов: {j or body[:300]}")
-            items = j.get("items") or []
-            if not isinstance(items, list):
-                raise RuntimeError(f"items не list: {type(items)}")
+            digest = hashlib.sha256(body).hexdigest()
+            if use_cache and digest == state.get("hash"):
+                logging.info("Список LE сертификатов не изменился (тот же sha256).")
+                return state["items"]
+
+            items = _parse_le_items(body)
+            save_json_state(cache_path, {
+                "url": url,
+                "etag": get_header(resp_headers, "ETag"),
+                "last_modified": get_header(resp_headers, "Last-Modified"),
+                "hash": digest,
+                # храним только то, что нужно для сопоставления
+                "items": [
+                    {k: it.get(k) for k in ("id", "knox_cert_id", "domains", "expire_at")}
+                    for it in items if isinstance(it, dict)
+                ],
+            })
             return items
 
         last_err = f"GET {url} -> HTTP {status}: {body[:300]}"
@@ -91,6 +235,21 @@ def list_selectel_le_certs(le_base_url: str, token: str, timeout: int) -> List[d
 
     raise RuntimeError(f"Не удалось получить список LE сертификатов. Последняя ошибка: {last_err}")
 
+def _le_list_candidates(le_base_url: str) -> List[str]:
+    return [
+        join_url(le_base_url, ""),          # "/"
+        join_url(le_base_url, "certs/le/"), # на случай если base = https://api.selectel.ru
+    ]
+
+def _parse_le_items(body: bytes) -> List[dict]:
+    j = json_loads_safe(body)
+    if not isinstance(j, dict) or "items" not in j:
+        raise RuntimeError(f"Неожиданный формат списка сертификатов: {j or body[:300]}")
+    items = j.get("items") or []
+    if not isinstance(items, list):
+        raise RuntimeError(f"items не list: {type(items)}")
+    return items
+
 def get_cert_manager_json(cert_manager_url: str, token: str, path: str, timeout: int) -> Tuple[int, object, bytes]:
     url = join_url(cert_manager_url, path)
     status, _headers, body = http_request(
@@ -99,23 +258,15 @@ def get_cert_manager_json(cert_manager_url: str, token: str, path: str, timeout:
         headers={"X-Auth-Token": token},
         timeout=timeout,
     )
+    if status == 401:
+        raise SelectelAuthError(f"GET {url} -> HTTP 401: токен отклонён")
     j = json_loads_safe(body)
     return status, j if j is not None else body.decode("utf-8", errors="replace"), body
 
 
 
-def download_selectel_cert_bundle(
-    cert_manager_url: str,
-    token: str,
-    cert_id: str,
-    timeout: int,
-) -> Tuple[List[str], str]:
-    """
-    Возвращает (cert_chain_list, private_key_pem)
-    cert_chain_list: список PEM сертификатов (как минимум leaf).
-    """
+def fetch_selectel_cert_chain(cert_manager_url: str, token: str, cert_id: str, timeout: int) -> List[str]:
     certs: List[str] = []
-    privkey: Optional[str] = None
 
     # 1) Пробуем /cert/{id} (часто там есть pem.certificates)
     status, obj, _raw = get_cert_manager_json(cert_manager_url, token, f"cert/{cert_id}", timeout)
@@ -129,7 +280,13 @@ def download_selectel_cert_bundle(
         if status2 == 200:
             certs = extract_pem_certificates(obj2)
 
-    # 3) private_key
+    if not certs:
+        raise RuntimeError(f"Не удалось получить публичные сертификаты для cert_id={cert_id}")
+    return certs
+
+def fetch_selectel_private_key(cert_manager_url: str, token: str, cert_id: str, timeout: int) -> str:
+    privkey: Optional[str] = None
+
     status3, obj3, raw3 = get_cert_manager_json(cert_manager_url, token, f"cert/{cert_id}/private_key", timeout)
     if status3 == 200:
         privkey = extract_private_key(obj3)
@@ -138,9 +295,49 @@ def download_selectel_cert_bundle(
             txt = raw3.decode("utf-8", errors="replace")
             privkey = extract_private_key(txt)
 
-    if not certs:
-        raise RuntimeError(f"Не удалось получить публичные сертификаты для cert_id={cert_id}")
     if not privkey:
         raise RuntimeError(f"Не удалось получить private_key для cert_id={cert_id}")
+    return privkey
+
+def download_selectel_cert_bundles(
+    cert_manager_url: str,
+    token: str,
+    cert_ids: List[str],
+    timeout: int,
+    concurrency: int = 8,
+) -> Tuple[Dict[str, Tuple[List[str], str]], Dict[str, str]]:
+    """
+    Параллельно качает цепочки и приватные ключи для всех cert_ids
+    (не больше concurrency запросов одновременно).
+
+    Возвращает ({cert_id: (cert_chain_list, private_key_pem)}, {cert_id: текст ошибки}).
+    Ничего не пишет — раскладка по диску только после того, как собрано всё.
+    """
+    bundles: Dict[str, Tuple[List[str], str]] = {}
+    errors: Dict[str, str] = {}
+    if not cert_ids:
+        return bundles, errors
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="fetch") as pool:
+        futures = {
+            cert_id: (
+                pool.submit(fetch_selectel_cert_chain, cert_manager_url, token, cert_id, timeout),
+                pool.submit(fetch_selectel_private_key, cert_manager_url, token, cert_id, timeout),
+            )
+            for cert_id in cert_ids
+        }
+
+        auth_error: Optional[SelectelAuthError] = None
+        for cert_id, (f_chain, f_key) in futures.items():
+            try:
+                bundles[cert_id] = (f_chain.result(), f_key.result())
+            except SelectelAuthError as e:
+                auth_error = e
+            except Exception as e:
+                errors[cert_id] = str(e)
+
+    # 401 — проблема токена, а не конкретного сертификата: пусть решает вызывающий
+    if auth_error:
+        raise auth_error
 
-    return certs, privkey
+    return bundles, errors
@@ -0,0 +1,29 @@
+import json
+import logging
+import os
+from typing import Optional
+
+from utils.other import write_file
+
+
+# -------------------------
+# JSON-состояние между запусками (кэши и т.п.)
+# -------------------------
+def load_json_state(path: Optional[str]) -> Optional[dict]:
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            obj = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning("Не смог прочитать файл состояния %s: %s (игнорирую)", path, e)
+        return None
+    return obj if isinstance(obj, dict) else None
+
+def save_json_state(path: Optional[str], obj: dict, mode: int = 0o600) -> None:
+    if not path:
+        return
+    try:
+        write_file(path, json.dumps(obj, ensure_ascii=False, separators=(",", ":")), mode)
+    except OSError as e:
+        logging.warning("Не смог сохранить файл состояния %s: %s", path, e)
@@ -0,0 +1,109 @@
+import hashlib
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from utils.other import ensure_dir, write_version_dir
+from utils.x509 import first_certificate_der
+
+# -------------------------
+# Контентно-адресуемое хранилище bundle
+# -------------------------
+# CERT_STORE_DIR/.objects/<sha256 leaf>/{cert,chain,fullchain,privkey}.pem — сами файлы (один раз на сертификат)
+# CERT_STORE_DIR/.objects/by-id/<knox_id>_<expire> -> ../<sha256>     — что уже скачано из Selectel
+# CERT_STORE_DIR/<domain>/<expire> -> ../.objects/<sha256>             — папки версий по доменам (симлинки)
+
+OBJECTS_DIRNAME = ".objects"
+ALIASES_DIRNAME = "by-id"
+# имя папки версии: CERT_STORE_DIR/<domain>/<YYYY-mm-dd_HH-MM-SS>
+VERSION_STAMP_RE = re.compile(r"^\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}$")
+
+
+def objects_dir(cert_store_dir: str) -> str:
+    return os.path.join(cert_store_dir, OBJECTS_DIRNAME)
+
+def bundle_fingerprint(leaf_pem: str) -> str:
+    """
+    sha256 от DER leaf-сертификата (то же, что openssl x509 -fingerprint -sha256).
+    """
+    return hashlib.sha256(first_certificate_der(leaf_pem.encode("utf-8"))).hexdigest()
+
+def bundle_files(certs: List[str], privkey: str) -> Dict[str, Tuple[str, int]]:
+    """
+    Цепочка (leaf первым) и ключ -> файлы папки версии {имя: (содержимое, mode)}.
+    """
+    leaf = certs[0].strip() + "\n"
+    chain = "\n".join([c.strip() for c in certs[1:]]).strip()
+    chain = (chain + "\n") if chain else ""
+    return {
+        "cert.pem": (leaf, 0o644),
+        "chain.pem": (chain, 0o644),
+        "fullchain.pem": (leaf + chain, 0o644),
+        "privkey.pem": (privkey, 0o600),
+    }
+
+def _alias_name(knox_id: str, stamp: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]", "_", f"{knox_id}_{stamp}")
+
+def find_stored_bundle(store: str, knox_id: str, stamp: str) -> Optional[str]:
+    """
+    Если bundle для (knox_id, expire) уже лежит в хранилище — путь к его папке, иначе None.
+    Дешёвая проверка: один readlink/stat, без скачивания и чтения файлов.
+    """
+    alias = os.path.join(store, ALIASES_DIRNAME, _alias_name(knox_id, stamp))
+    if not os.path.islink(alias):
+        return None
+    obj_dir = os.path.realpath(alias)
+    if not os.path.isfile(os.path.join(obj_dir, "privkey.pem")):
+        return None
+    return obj_dir
+
+def find_stored_object(store: str, fingerprint: str) -> Optional[str]:
+    """
+    Папка объекта по отпечатку leaf, если он уже лежит в хранилище (под любым knox_id).
+    """
+    if not re.fullmatch(r"[0-9a-f]{64}", fingerprint or ""):
+        return None
+    obj_dir = os.path.join(store, fingerprint)
+    return obj_dir if os.path.isfile(os.path.join(obj_dir, "privkey.pem")) else None
+
+def link_bundle_alias(store: str, knox_id: str, stamp: str, obj_dir: str) -> None:
+    aliases = os.path.join(store, ALIASES_DIRNAME)
+    ensure_dir(aliases)
+    _replace_symlink(os.path.join(aliases, _alias_name(knox_id, stamp)), os.path.join("..", os.path.basename(obj_dir)))
+
+def store_bundle(store: str, knox_id: str, stamp: str, files: Dict[str, Tuple[str, int]]) -> Tuple[str, bool]:
+    """
+    Кладёт bundle в хранилище по отпечатку leaf (если такого ещё нет) и запоминает alias по knox_id.
+    Возвращает (папка объекта, были ли записаны файлы).
+    """
+    fp = bundle_fingerprint(files["cert.pem"][0])
+    obj_dir = os.path.join(store, fp)
+    written = write_version_dir(obj_dir, files)
+    link_bundle_alias(store, knox_id, stamp, obj_dir)
+    return obj_dir, written
+
+def link_version_dir(ver_dir: str, obj_dir: str) -> None:
+    """
+    Делает ver_dir относительным симлинком на папку объекта.
+    Старые (настоящие) папки версий не трогаем — они продолжают работать как есть.
+    """
+    if os.path.isdir(ver_dir) and not os.path.islink(ver_dir):
+        logging.info("Папка версии %s — обычная папка (старый формат), оставляю как есть.", ver_dir)
+        return
+    ensure_dir(os.path.dirname(ver_dir))
+    _replace_symlink(ver_dir, os.path.relpath(obj_dir, os.path.dirname(ver_dir)))
+
+def _replace_symlink(link: str, target: str) -> None:
+    if os.path.islink(link) and os.readlink(link) == target:
+        return
+    tmp = f"{link}.tmp-{os.getpid()}"
+    try:
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.symlink(target, tmp)
+        os.replace(tmp, link)
+    finally:
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
@@ -0,0 +1,215 @@
+import base64
+import binascii
+import hashlib
+import re
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+# -------------------------
+# Минимальный ASN.1/DER разбор X.509 (без openssl)
+# -------------------------
+
+_PEM_CERT_RE = re.compile(
+    rb"-----BEGIN CERTIFICATE-----(.*?)-----END CERTIFICATE-----",
+    flags=re.DOTALL,
+)
+
+_OID_SAN = "2.5.29.17"
+
+# короткие имена для subject (как у openssl)
+_NAME_OIDS = {
+    "2.5.4.3": "CN",
+    "2.5.4.5": "serialNumber",
+    "2.5.4.6": "C",
+    "2.5.4.7": "L",
+    "2.5.4.8": "ST",
+    "2.5.4.10": "O",
+    "2.5.4.11": "OU",
+    "1.2.840.113549.1.9.1": "emailAddress",
+}
+
+# строковые типы внутри AttributeValue
+_STRING_TAGS = {0x0C, 0x13, 0x14, 0x16, 0x1A, 0x1E}
+
+
+class X509Error(ValueError):
+    pass
+
+
+def _read_tlv(data: bytes, pos: int) -> Tuple[int, int, int]:
+    """
+    Читает заголовок TLV на позиции pos.
+    Возвращает (tag, начало значения, конец значения).
+    """
+    if pos + 2 > len(data):
+        raise X509Error("обрезанный TLV")
+    tag = data[pos]
+    if tag & 0x1F == 0x1F:
+        raise X509Error("многобайтовые теги не поддерживаются")
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7F
+        if n == 0 or n > 4 or pos + n > len(data):
+            raise X509Error("некорректная длина TLV")
+        length = int.from_bytes(data[pos:pos + n], "big")
+        pos += n
+    end = pos + length
+    if end > len(data):
+        raise X509Error("длина TLV выходит за пределы данных")
+    return tag, pos, end
+
+
+def _children(data: bytes, start: int, end: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Список дочерних элементов конструкции: (tag, tlv_start, value_start, value_end).
+    """
+    res = []
+    pos = start
+    while pos < end:
+        tag, vs, ve = _read_tlv(data, pos)
+        res.append((tag, pos, vs, ve))
+        pos = ve
+    return res
+
+
+def _decode_oid(raw: bytes) -> str:
+    if not raw:
+        raise X509Error("пустой OID")
+    first = raw[0]
+    parts = [str(min(first // 40, 2)), str(first - 40 * min(first // 40, 2))]
+    val = 0
+    for b in raw[1:]:
+        val = (val << 7) | (b & 0x7F)
+        if not b & 0x80:
+            parts.append(str(val))
+            val = 0
+    return ".".join(parts)
+
+
+def _decode_time(tag: int, raw: bytes) -> datetime:
+    s = raw.decode("ascii")
+    if tag == 0x17:  # UTCTime: YYMMDDHHMMSSZ
+        dt = datetime.strptime(s, "%y%m%d%H%M%SZ")
+        # RFC 5280: YY >= 50 -> 19YY, иначе 20YY
+        if dt.year >= 2050:
+            dt = dt.replace(year=dt.year - 100)
+        return dt
+    if tag == 0x18:  # GeneralizedTime: YYYYMMDDHHMMSSZ
+        return datetime.strptime(s, "%Y%m%d%H%M%SZ")
+    raise X509Error(f"неизвестный тип времени: 0x{tag:02x}")
+
+
+def _decode_string(tag: int, raw: bytes) -> str:
+    if tag == 0x1E:  # BMPString
+        return raw.decode("utf-16-be", errors="replace")
+    return raw.decode("utf-8", errors="replace")
+
+
+def _decode_name(data: bytes, start: int, end: int) -> str:
+    # Name ::= SEQUENCE OF RelativeDistinguishedName (SET OF AttributeTypeAndValue)
+    parts = []
+    for _tag, _p, rs, re_ in _children(data, start, end):
+        for _t, _p2, as_, ae in _children(data, rs, re_):
+            attr = _children(data, as_, ae)
+            if len(attr) < 2 or attr[0][0] != 0x06:
+                continue
+            oid = _decode_oid(data[attr[0][2]:attr[0][3]])
+            vtag, _vp, vs, ve = attr[1]
+            if vtag not in _STRING_TAGS:
+                continue
+            parts.append(f"{_NAME_OIDS.get(oid, oid)}={_decode_string(vtag, data[vs:ve])}")
+    return ", ".join(parts)
+
+
+def _decode_san(data: bytes, start: int, end: int) -> List[str]:
+    # GeneralNames ::= SEQUENCE OF GeneralName; dNSName ::= [2] IMPLICIT IA5String
+    tag, gs, ge = _read_tlv(data, start)
+    if tag != 0x30:
+        raise X509Error("SAN: ожидался SEQUENCE")
+    dns = []
+    for t, _p, vs, ve in _children(data, gs, ge):
+        if t == 0x82:
+            d = data[vs:ve].decode("ascii", errors="replace").strip().lower().strip(".")
+            if d:
+                dns.append(d)
+    return dns
+
+
+def parse_der_certificate(der: bytes) -> Dict[str, object]:
+    """
+    Разбирает DER сертификат и возвращает:
+      {"not_after": datetime, "san": [..], "subject": "CN=..", "fingerprint": "sha256 SPKI hex"}
+    """
+    tag, cs, ce = _read_tlv(der, 0)
+    if tag != 0x30:
+        raise X509Error("Certificate: ожидался SEQUENCE")
+    tag, ts, te = _read_tlv(der, cs)
+    if tag != 0x30:
+        raise X509Error("TBSCertificate: ожидался SEQUENCE")
+
+    fields = _children(der, ts, te)
+    # version [0] EXPLICIT опционален
+    if fields and fields[0][0] == 0xA0:
+        fields = fields[1:]
+    # serial, signature, issuer, validity, subject, subjectPublicKeyInfo, ...
+    if len(fields) < 6:
+        raise X509Error("TBSCertificate: слишком мало полей")
+
+    _vtag, _vp, vs, ve = fields[3]
+    validity = _children(der, vs, ve)
+    if len(validity) != 2:
+        raise X509Error("Validity: ожидалось два времени")
+    na_tag, _np, na_s, na_e = validity[1]
+    not_after = _decode_time(na_tag, der[na_s:na_e])
+
+    _stag, _sp, ss, se = fields[4]
+    subject = _decode_name(der, ss, se)
+
+    _ktag, kp, _ks, ke = fields[5]
+    fingerprint = hashlib.sha256(der[kp:ke]).hexdigest()
+
+    san: List[str] = []
+    for ftag, _fp, fs, fe in fields[6:]:
+        if ftag != 0xA3:
+            continue
+        _t, es, ee = _read_tlv(der, fs)
+        for _xt, _xp, xs, xe in _children(der, es, ee):
+            ext = _children(der, xs, xe)
+            if not ext or ext[0][0] != 0x06:
+                continue
+            if _decode_oid(der[ext[0][2]:ext[0][3]]) != _OID_SAN:
+                continue
+            # critical BOOLEAN опционален, значение — последний OCTET STRING
+            otag, _op, os_, oe = ext[-1]
+            if otag != 0x04:
+                raise X509Error("SAN: ожидался OCTET STRING")
+            san = _decode_san(der, os_, oe)
+
+    return {
+        "not_after": not_after,
+        "san": san,
+        "subject": subject,
+        "fingerprint": fingerprint,
+    }
+
+
+def first_certificate_der(data: bytes) -> bytes:
+    """
+    Достаёт DER первого сертификата из PEM (fullchain -> leaf) или возвращает DER как есть.
+    """
+    m = _PEM_CERT_RE.search(data)
+    if m:
+        try:
+            return base64.b64decode(b"".join(m.group(1).split()), validate=True)
+        except (binascii.Error, ValueError) as e:
+            raise X509Error(f"битый base64 в PEM: {e}") from e
+    if data[:1] == b"\x30":
+        return data
+    raise X509Error("не похоже ни на PEM, ни на DER сертификат")
+
+
+def read_certificate_file(cert_path: str) -> Dict[str, object]:
+    with open(cert_path, "rb") as f:
+        data = f.read()
+    return parse_der_certificate(first_certificate_der(data))